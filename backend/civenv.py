@@ -1,5 +1,7 @@
-import copy
 import random
+from collections.abc import Iterable
+from dataclasses import dataclass
+from enum import Enum
 from typing import Any, cast
 
 import gymnasium as gym
@@ -8,16 +10,23 @@ import numpy.typing as npt
 from gymnasium import Space, spaces
 
 from backend.logger import setup_logger
-from backend.models.civmap import CivMap, Tile
+from backend.models.civmap import CITY_RADIUS, City, CivMap, Tile
+from backend.models.hex_topology import Coordinate, disk_coordinates, hex_radius, hex_topology
 from backend.models.int_enums import District, Feature, Resource, ResourceType, Terrain
 from backend.placement.district_placement_rules import (
     DISTRICT_TO_PLACEMENT_CLASS,
     PlacementClass,
 )
 from backend.placement.district_validation import can_place_district
-from backend.yields.yield_logic import YieldDict, get_base_city_housing, get_score, get_tile_score
+from backend.yields.yield_logic import (
+    ScoreResult,
+    YieldDict,
+    get_base_city_housing,
+    get_score,
+    get_tile_contribution,
+    get_tile_score,
+)
 
-from .utils import get_hex_distance
 from .yields.district_adjacency_rules import YieldType
 
 logger = setup_logger(__name__)
@@ -30,19 +39,75 @@ def sum_score(score_summary: dict[YieldType, float]) -> float:
     return float(sum(scores.values()))
 
 
-class CivEnv(gym.Env[npt.NDArray[np.float32], int]):
+Signature = frozenset[tuple[tuple[int, int], District]]
+# The districts on the map and the city centers in founding order, which together decide who owns every tile
+StateKey = tuple[Signature, tuple[Coordinate, ...]]
+
+# terrains, features, district, resources, resourceTypes, is hill, is mountain, river edges, is withinCity
+OBSERVATION_CHANNELS = len(Terrain) + len(Feature) + len(District) + len(Resource) + len(ResourceType) + 4
+# ObservationMode.TILES columns: indices into terrains, features, districts, resources and resourceTypes
+TILE_CATEGORIES = (len(Terrain), len(Feature), len(District), len(Resource), len(ResourceType))
+# followed by is hill, is mountain, river edges, is withinCity
+TILE_FLAGS = 4
+TILE_COLUMNS = len(TILE_CATEGORIES) + TILE_FLAGS
+TILE_DISTRICT_COLUMN = 2
+TILE_WITHIN_CITY_COLUMN = TILE_COLUMNS - 1
+
+
+class ObservationMode(str, Enum):
+    """How CivEnv encodes its observation planes, which only ever hold zeros and ones."""
+
+    # float32 planes, shaped (channels, 2 * radius + 1, 2 * radius + 1) with the map's center tile in the middle
+    FLOAT = "float32"
+    # The same planes as uint8, 4 times smaller. SB3 policies turn them into floats themselves.
+    UINT8 = "uint8"
+    # The planes flattened and packed 8 to a byte, 32 times smaller. Policies need PackedPlanesExtractor to read them.
+    PACKED = "packed"
+    # No planes: one uint8 row per tile of category indices and flags, shaped (tiles, TILE_COLUMNS). Policies need
+    # TileEmbeddingExtractor to read them.
+    TILES = "tiles"
+
+    @classmethod
+    def of_space(cls, space: Space[Any]) -> "ObservationMode":
+        """The mode whose observations fit space, like the observation space a model was trained with."""
+        if space.dtype == np.float32:
+            return cls.FLOAT
+        assert space.shape is not None
+        return {1: cls.PACKED, 2: cls.TILES}.get(len(space.shape), cls.UINT8)
+
+
+@dataclass(frozen=True)
+class PlacementUndo:
+    """Everything push_placement() changed, so pop_placement() can restore it exactly."""
+
+    tile: Tile
+    previous_district: District
+    previous_sig: Signature
+    previous_city_centers: tuple[Coordinate, ...]
+    previous_yield: float
+    previous_score: float | None
+    # Tiles whose score, legal districts or observation the placement may have changed
+    affected: npt.NDArray[np.intp]
+    # Set when the placement added a district to an existing city: the city and what it had built before
+    previous_district_built: tuple[City, bool] | None = None
+    # Set when the placement founded a city: the prior (withinCityLimits, city) of every tile it claimed
+    previous_city_state: list[tuple[Tile, bool, City | None]] | None = None
+
+
+class CivEnv(gym.Env[npt.NDArray[Any], int]):
     offset: int
     current_civ_map: CivMap
     last_yield: float
     template_maps: list[CivMap] | None
 
-    _hex_dist_cache: dict[tuple[int, int, int, int], int]
     _district_tile_only_cache: dict[tuple[PlacementClass, Terrain, bool, bool, Feature, ResourceType], bool]
     _district_neighbor_cache: dict[
         tuple[
             PlacementClass,
             tuple[Terrain, ...],
             tuple[Feature, ...],
+            # Whether a neighbor is a city center
+            bool,
             Terrain,
             bool,
             bool,
@@ -52,31 +117,64 @@ class CivEnv(gym.Env[npt.NDArray[np.float32], int]):
         bool,
     ]
 
-    _tile_mask_cache: dict[tuple[frozenset[tuple[tuple[int, int], District]], District], npt.NDArray[Any]]
-    _score_cache: dict[frozenset[tuple[tuple[int, int], District]], float]
-    _action_mask_cache: dict[frozenset[tuple[tuple[int, int], District]], npt.NDArray[Any]]
-    _current_sig: frozenset[tuple[tuple[int, int], District]]
+    _tile_mask_cache: dict[tuple[StateKey, District], npt.NDArray[Any]]
+    _score_cache: dict[StateKey, ScoreResult]
+    _action_mask_cache: dict[StateKey, npt.NDArray[Any]]
+    _current_sig: Signature
+    _city_centers: tuple[Coordinate, ...]
+    # Total score of the current state, kept up to date by push_placement() once it is first needed
+    _score: float | None
+    _undo_stack: list[PlacementUndo]
+    # Observation planes and ObservationMode.TILES rows of the map they were built for, kept up to date by
+    # push_placement() and pop_placement()
+    _planes: tuple[CivMap, npt.NDArray[np.uint8]] | None
+    _tile_rows: tuple[CivMap, npt.NDArray[np.uint8]] | None
 
     action_space: Space[int]
 
-    def __init__(self, template_maps: list[CivMap] | None = None):
+    def __init__(
+        self,
+        template_maps: list[CivMap] | None = None,
+        observation_mode: ObservationMode = ObservationMode.FLOAT,
+        max_cities: int = 1,
+    ):
+        """
+        Args:
+            template_maps: Maps episodes start from, all with the same tiles. An empty map by default.
+            observation_mode: How observations are encoded
+            max_cities: How many cities an episode may found. Each one builds its own set of districts on the tiles
+                it claims, and tiles within reach of several cities belong to the first one founded.
+        """
         super().__init__()
         self.last_yield = 0
         self.template_maps = template_maps
+        self.observation_mode = observation_mode
+        self.max_cities = max_cities
 
-        self._hex_dist_cache = {}
         self._district_tile_only_cache = {}
         self._district_neighbor_cache = {}
         self._score_cache = {}
         self._tile_mask_cache = {}
         self._action_mask_cache = {}
         self._current_sig = frozenset()
+        self._city_centers = ()
+        self._score = None
+        self._undo_stack = []
+        self._planes = None
+        self._tile_rows = None
 
         self.init_map()
 
         assert self.current_civ_map is not None
         self.tile_keys = list(self.current_civ_map.get_keys())
-        self.n_tiles = len(self.tile_keys)  # Should be 61
+        self.n_tiles = len(self.tile_keys)  # 61 on a map of radius 4
+        self.topology = hex_topology(self.tile_keys)
+        self.radius = hex_radius(self.tile_keys)
+        # Observation planes are square, with the map's center tile in the middle
+        self.board_size = 2 * self.radius + 1
+        self.offset = self.radius
+        # Rows of the neighbors of each tile in ObservationMode.TILES observations, n_tiles where there is none
+        self.tile_neighbors = self.topology.neighbors
 
         self.district_list = list(District)
         self.terrain_list = list(Terrain)
@@ -97,27 +195,24 @@ class CivEnv(gym.Env[npt.NDArray[np.float32], int]):
         self.resource_type_base = self.resource_base + len(self.resource_list)
         self.binary_base = self.resource_type_base + len(self.resourceType_list)
 
-        self.placeable_districts = [d for d in District if d is not District.NONE]
+        self.placeable_districts: list[District] = [d for d in District if d is not District.NONE]
+        self._city_center_row = self.placeable_districts.index(District.CITY_CENTER)
         self.action_space = spaces.Discrete(len(self.placeable_districts) * self.n_tiles)
 
-        # terrains, features, district, resources, resourceTypes, is hill, is mountain, river edges, is withinCity
-        self.num_observation_channels = (
-            len(self.terrain_list)
-            + len(self.feature_list)
-            + len(District)
-            + len(self.resource_list)
-            + len(self.resourceType_list)
-            + 4
-        )
+        self.num_observation_channels = OBSERVATION_CHANNELS
+        planes_shape = (self.num_observation_channels, self.board_size, self.board_size)
 
-        self.observation_space = spaces.Box(
-            low=0.0,
-            high=1.0,
-            shape=(self.num_observation_channels, 9, 9),
-            dtype=np.float32,
-        )
-
-        self.offset = 4
+        if observation_mode is ObservationMode.PACKED:
+            packed_length = (int(np.prod(planes_shape)) + 7) // 8
+            self.observation_space = spaces.Box(low=0, high=255, shape=(packed_length,), dtype=np.uint8)
+        elif observation_mode is ObservationMode.TILES:
+            high = np.array([count - 1 for count in TILE_CATEGORIES] + [1] * TILE_FLAGS, dtype=np.uint8)
+            self.observation_space = spaces.Box(
+                low=0, high=np.tile(high, (self.n_tiles, 1)), shape=(self.n_tiles, TILE_COLUMNS), dtype=np.uint8
+            )
+        else:
+            dtype = np.float32 if observation_mode is ObservationMode.FLOAT else np.uint8
+            self.observation_space = spaces.Box(low=0, high=1, shape=planes_shape, dtype=dtype)
 
     def init_map(self) -> None:
         if self.template_maps is None:
@@ -127,25 +222,32 @@ class CivEnv(gym.Env[npt.NDArray[np.float32], int]):
             self.current_civ_map = civ_map
         else:
             base_map = random.choice(self.template_maps)
-            self.current_civ_map = copy.deepcopy(base_map)
+            self.current_civ_map = base_map.copy()
+
+    def state_key(self) -> StateKey:
+        return self._current_sig, self._city_centers
+
+    def get_cached_score_result(self) -> ScoreResult:
+        key = self.state_key()
+        if key not in self._score_cache:
+            self._score_cache[key] = get_score(self.current_civ_map.tiles)
+        return self._score_cache[key]
 
     def get_cached_score(self) -> float:
-        sig = self._current_sig
-        if sig not in self._score_cache:
-            self._score_cache[sig] = sum_score(get_score(self.current_civ_map.tiles).summary)
-        return self._score_cache[sig]
+        return sum_score(self.get_cached_score_result().summary)
 
     def get_cached_can_place_district(self, district: District, tile_key: tuple[int, int]) -> bool:
         tile = self.current_civ_map.tiles[tile_key]
 
-        if district is not District.CITY_CENTER and not tile.withinCityLimits:
+        # Districts go on tiles a city owns, as in the action mask. Tiles of a saved layout can be within city limits
+        # without a city.
+        if district is not District.CITY_CENTER and tile.city is None:
             return False
 
         placement_class = DISTRICT_TO_PLACEMENT_CLASS[district]
 
         if (
             placement_class == PlacementClass.STANDARD
-            or placement_class == PlacementClass.COAST
             or placement_class == PlacementClass.AERIAL
             or placement_class == PlacementClass.CITY_CENTER
         ):
@@ -158,17 +260,24 @@ class CivEnv(gym.Env[npt.NDArray[np.float32], int]):
                 tile.resourceType,
             )
 
-            return self._district_tile_only_cache.setdefault(
-                tile_only_key,
-                can_place_district(district, self.current_civ_map.tiles, tile_key),
-            )
+            if tile_only_key not in self._district_tile_only_cache:
+                self._district_tile_only_cache[tile_only_key] = can_place_district(
+                    district, self.current_civ_map.tiles, tile_key
+                )
+            return self._district_tile_only_cache[tile_only_key]
 
-        elif placement_class == PlacementClass.PRESERVE or placement_class == PlacementClass.ENCAMPMENT:
+        elif (
+            placement_class == PlacementClass.COAST
+            or placement_class == PlacementClass.PRESERVE
+            or placement_class == PlacementClass.ENCAMPMENT
+        ):
+            # Coast districts need land next to them, and preserves and encampments no city center next to them
             neighbors = tile.get_neighbors(self.current_civ_map.tiles)
             neighbor_key = (
                 placement_class,
                 tuple(n.terrain for n in neighbors),
                 tuple(n.feature for n in neighbors),
+                any(n.district == District.CITY_CENTER for n in neighbors),
                 tile.terrain,
                 tile.hill,
                 tile.mountain,
@@ -176,24 +285,43 @@ class CivEnv(gym.Env[npt.NDArray[np.float32], int]):
                 tile.resourceType,
             )
 
-            return self._district_neighbor_cache.setdefault(
-                neighbor_key,
-                can_place_district(district, self.current_civ_map.tiles, tile_key),
-            )
+            if neighbor_key not in self._district_neighbor_cache:
+                self._district_neighbor_cache[neighbor_key] = can_place_district(
+                    district, self.current_civ_map.tiles, tile_key
+                )
+            return self._district_neighbor_cache[neighbor_key]
         else:
             return can_place_district(district, self.current_civ_map.tiles, tile_key)
 
-    def grid_signature(self) -> frozenset[tuple[tuple[int, int], District]]:
+    def grid_signature(self) -> Signature:
         return frozenset((k, t.district) for k, t in self.current_civ_map.tiles.items() if t.district != District.NONE)
 
     def get_cached_hex_dist(self, t1: Tile, t2: Tile) -> int:
-        key = (t1.q, t1.r, t2.q, t2.r)
-        if key not in self._hex_dist_cache:
-            self._hex_dist_cache[key] = get_hex_distance(t1, t2)
-        return self._hex_dist_cache[key]
-
-    def _get_obs(self) -> npt.NDArray[np.float32]:
-        obs = np.zeros((self.num_observation_channels, 9, 9), dtype=np.float32)
+        index = self.topology.index
+        return int(self.topology.distances[index[(t1.q, t1.r)], index[(t2.q, t2.r)]])
+
+    def _get_obs(self) -> npt.NDArray[Any]:
+        if self.observation_mode is ObservationMode.TILES:
+            return np.copy(self._current_tile_rows())
+        planes = self._current_planes()
+        if self.observation_mode is ObservationMode.FLOAT:
+            return planes.astype(np.float32)
+        if self.observation_mode is ObservationMode.PACKED:
+            return np.packbits(planes)
+        return np.copy(planes)
+
+    def _current_planes(self) -> npt.NDArray[np.uint8]:
+        if self._planes is None or self._planes[0] is not self.current_civ_map:
+            self._planes = (self.current_civ_map, self._get_planes())
+        return self._planes[1]
+
+    def _current_tile_rows(self) -> npt.NDArray[np.uint8]:
+        if self._tile_rows is None or self._tile_rows[0] is not self.current_civ_map:
+            self._tile_rows = (self.current_civ_map, self._get_tile_rows())
+        return self._tile_rows[1]
+
+    def _get_planes(self) -> npt.NDArray[np.uint8]:
+        obs = np.zeros((self.num_observation_channels, self.board_size, self.board_size), dtype=np.uint8)
 
         for tile in self.current_civ_map.tiles.values():
             x = tile.q + self.offset
@@ -218,106 +346,274 @@ class CivEnv(gym.Env[npt.NDArray[np.float32], int]):
 
         return obs
 
-    def step(self, action: int) -> tuple[npt.NDArray[np.float32], float, bool, bool, dict[str, Any]]:
+    def _get_tile_rows(self) -> npt.NDArray[np.uint8]:
+        """The ObservationMode.TILES observation, with rows in tile_keys order."""
+        tiles = self.current_civ_map.tiles
+        rows = np.zeros((self.n_tiles, TILE_COLUMNS), dtype=np.uint8)
+        for i, key in enumerate(self.tile_keys):
+            tile = tiles[key]
+            rows[i] = (
+                self.terrain_idx[tile.terrain],
+                self.feature_idx[tile.feature],
+                self.district_idx[tile.district],
+                self.resource_idx[tile.resource],
+                self.resource_type_idx[tile.resourceType],
+                tile.hill,
+                tile.mountain,
+                any(tile.rivers),
+                tile.withinCityLimits,
+            )
+        return rows
+
+    def _observe_tiles(self, tiles: list[Tile]) -> None:
+        """Bring the observations built so far up to date with the districts and city limits of these tiles."""
+        if self._planes is not None and self._planes[0] is self.current_civ_map:
+            planes = self._planes[1]
+            districts = planes[self.district_base : self.district_base + len(self.district_list)]
+            for tile in tiles:
+                x = tile.q + self.offset
+                y = tile.r + self.offset
+                districts[:, x, y] = 0
+                districts[self.district_idx[tile.district], x, y] = 1
+                planes[self.binary_base + 3, x, y] = tile.withinCityLimits
+        if self._tile_rows is not None and self._tile_rows[0] is self.current_civ_map:
+            rows = self._tile_rows[1]
+            for tile in tiles:
+                i = self.topology.index[(tile.q, tile.r)]
+                rows[i, TILE_DISTRICT_COLUMN] = self.district_idx[tile.district]
+                rows[i, TILE_WITHIN_CITY_COLUMN] = tile.withinCityLimits
+
+    def decode_action(self, action: int) -> tuple[District, tuple[int, int]]:
         district_idx = action // self.n_tiles
         tile_idx = action % self.n_tiles
-
-        district = self.placeable_districts[district_idx]
-        tile_key = self.tile_keys[tile_idx]
-        tile = self.current_civ_map.tiles[tile_key]
-
-        tile.district = district
-        self._current_sig = self.grid_signature()
+        return self.placeable_districts[district_idx], self.tile_keys[tile_idx]
+
+    def push_placement(self, action: int) -> float:
+        """
+        Apply a placement and record how to undo it with pop_placement().
+
+        Updates the tile, its city, the grid signature, the running score and the observations. Only the tile and its
+        neighbors are rescored, or for a new city, the tiles it claims. Masks and scores are cached by state, so they
+        need no separate undo. Nothing is copied.
+
+        Returns:
+            The change in total score caused by the placement
+        """
+        district, tile_key = self.decode_action(action)
+        civ_map = self.current_civ_map
+        tile = civ_map.tiles[tile_key]
+        affected = self.topology.disk(action % self.n_tiles, CITY_RADIUS if district == District.CITY_CENTER else 1)
+        score = self._score if self._score is not None else self.get_cached_score()
+        score -= self._local_score(affected)
+
+        previous_district = tile.district
+        previous_sig = self._current_sig
+        previous_city_centers = self._city_centers
+        previous_district_built: tuple[City, bool] | None = None
+        previous_city_state: list[tuple[Tile, bool, City | None]] | None = None
+        changed = [tile]
 
         if district == District.CITY_CENTER:
-            self.current_civ_map.make_city((tile.q, tile.r))
-        elif len(self.current_civ_map.cities) > 0:
-            # Add district to the single city
-            self.current_civ_map.cities[0].add_district(district)
-
-        new_total = self.get_cached_score()
-        base_reward = new_total - self.last_yield
+            previous_city_state = []
+            for key in disk_coordinates(tile_key, CITY_RADIUS):
+                claimed = civ_map.tiles.get(key)
+                if claimed is not None and claimed.city is None:
+                    previous_city_state.append((claimed, claimed.withinCityLimits, claimed.city))
+            tile.district = district
+            try:
+                civ_map.make_city(tile_key)
+            except ValueError:
+                tile.district = previous_district
+                raise
+            self._city_centers = previous_city_centers + (tile_key,)
+            changed += [claimed for claimed, _, _ in previous_city_state]
+        else:
+            tile.district = district
+            if tile.city is not None:
+                previous_district_built = (tile.city, tile.city.districts_built[district.value])
+                tile.city.add_district(district)
+
+        sig = previous_sig
+        if previous_district != District.NONE:
+            sig = sig - {(tile_key, previous_district)}
+        self._current_sig = sig | {(tile_key, district)}
+
+        self._undo_stack.append(
+            PlacementUndo(
+                tile=tile,
+                previous_district=previous_district,
+                previous_sig=previous_sig,
+                previous_city_centers=previous_city_centers,
+                previous_yield=self.last_yield,
+                previous_score=self._score,
+                affected=affected,
+                previous_district_built=previous_district_built,
+                previous_city_state=previous_city_state,
+            )
+        )
 
+        self._score = score + self._local_score(affected)
+        self._observe_tiles(changed)
+        previous_yield = self.last_yield
+        self.last_yield = self._score
+        return self.last_yield - previous_yield
+
+    def pop_placement(self) -> None:
+        """Exactly revert the most recent push_placement()."""
+        undo = self._undo_stack.pop()
+        civ_map = self.current_civ_map
+        district = undo.tile.district
+        changed = [undo.tile]
+
+        if undo.previous_city_state is not None:
+            civ_map.cities.pop()
+            for tile, within_city_limits, city in undo.previous_city_state:
+                tile.withinCityLimits = within_city_limits
+                tile.city = city
+                changed.append(tile)
+        elif undo.previous_district_built is not None:
+            city, built = undo.previous_district_built
+            city.districts_built[district.value] = built
+
+        undo.tile.district = undo.previous_district
+        self._current_sig = undo.previous_sig
+        self._city_centers = undo.previous_city_centers
+        self._score = undo.previous_score
+        self.last_yield = undo.previous_yield
+        self._observe_tiles(changed)
+
+    def _local_score(self, tiles: npt.NDArray[np.intp]) -> float:
+        """What these tiles add to the total score, which only depends on them and their neighbors."""
+        grid = self.current_civ_map.tiles
+        return sum(get_tile_contribution(grid[self.tile_keys[i]], grid) for i in tiles.tolist())
+
+    def shape_reward(self, district: District, tile: Tile, base_reward: float) -> float:
+        """Turn the score change from a placement into the training reward."""
         if district == District.CITY_CENTER:
-            reward = (
+            return (
                 (base_reward * 0.1)
                 + (sum(get_tile_score(tile).values()) * 2)
                 + get_base_city_housing(tile, self.current_civ_map)
             )
-        else:
-            reward = base_reward + 2
-        self.last_yield = new_total
-
-        terminated = not self.action_mask().any()
-
-        obs = self._get_obs()
+        return base_reward + 2
 
-        return (
-            obs,
-            reward,
-            terminated,
-            False,
-            {
-                "district_mask": self.district_mask(),
-                "tile_mask": self.tile_mask(district),
-            },
-        )
-
-    def action_mask(self) -> npt.NDArray[Any]:
-        sig = self._current_sig
-        if sig in self._action_mask_cache:
-            return self._action_mask_cache[sig]
+    def step(self, action: int) -> tuple[npt.NDArray[np.float32], float, bool, bool, dict[str, Any]]:
+        district, tile_key = self.decode_action(action)
+        tile = self.current_civ_map.tiles[tile_key]
 
-        mask = np.zeros(len(self.placeable_districts) * self.n_tiles, dtype=bool)
+        reward = self.shape_reward(district, tile, self.push_placement(action))
 
-        district_mask = self.district_mask()
+        terminated = not self.action_mask().any()
 
-        for district_idx, district in enumerate(self.placeable_districts):
-            if not district_mask[district_idx]:
-                continue
+        obs = self._get_obs()
 
-            t_mask = self.tile_mask(district)
+        return obs, reward, terminated, False, self._get_info(district)
 
-            base = district_idx * self.n_tiles
-            mask[base : base + self.n_tiles] = t_mask
+    def _get_info(self, district: District) -> dict[str, Any]:
+        # The district's row of the action mask, which is kept up to date locally, unlike a fresh tile_mask()
+        row = self.placeable_districts.index(district)
+        return {
+            "district_mask": self.district_mask(),
+            "tile_mask": self.action_mask()[row * self.n_tiles : (row + 1) * self.n_tiles],
+        }
 
-        self._action_mask_cache[sig] = mask
+    def action_mask(self) -> npt.NDArray[Any]:
+        """
+        Which actions are legal, cached by state.
+
+        A new state's mask is derived from the latest state on the undo stack with a cached mask. Only the tiles
+        placements have touched since are checked again, and a city's tiles lose the districts it has built since, so
+        a step costs the same on a map of any size.
+        """
+        key = self.state_key()
+        if key in self._action_mask_cache:
+            return self._action_mask_cache[key]
+
+        mask = None
+        touched: list[npt.NDArray[np.intp]] = []
+        cities: dict[int, City] = {}
+        for undo in reversed(self._undo_stack):
+            touched.append(undo.affected)
+            city = undo.tile.city
+            if city is not None:
+                cities[city.id] = city
+            previous = self._action_mask_cache.get((undo.previous_sig, undo.previous_city_centers))
+            if previous is not None:
+                mask = previous.copy()
+                break
+
+        tiles: Iterable[int]
+        if mask is None:
+            mask = np.zeros(len(self.placeable_districts) * self.n_tiles, dtype=bool)
+            tiles = range(self.n_tiles)
+            cities = {}
+        else:
+            tiles = np.unique(np.concatenate(touched)).tolist()
+
+        grid = mask.reshape(len(self.placeable_districts), self.n_tiles)
+        for city in cities.values():
+            # Cities only ever gain districts, and with them the districts they can no longer build
+            built = [row for row, d in enumerate(self.placeable_districts) if city.districts_built[d.value]]
+            claimed = [self.topology.index[key] for key in city.tiles]
+            if built and claimed:
+                grid[np.ix_(built, claimed)] = False
+        if len(self.current_civ_map.cities) >= self.max_cities:
+            grid[self._city_center_row] = False
+        for i in tiles:
+            grid[:, i] = self._tile_actions(i)
+
+        self._action_mask_cache[key] = mask
         return mask
 
+    def _tile_actions(self, tile_index: int) -> npt.NDArray[np.bool_]:
+        """Which placeable districts may go on the tile, as a column of the action mask."""
+        key = self.tile_keys[tile_index]
+        tile = self.current_civ_map.tiles[key]
+        legal = np.zeros(len(self.placeable_districts), dtype=bool)
+        if tile.district != District.NONE:
+            return legal
+
+        city = tile.city
+        if city is None:
+            if len(self.current_civ_map.cities) < self.max_cities:
+                legal[self._city_center_row] = self.get_cached_can_place_district(District.CITY_CENTER, key)
+            return legal
+
+        for row, district in enumerate(self.placeable_districts):
+            if district is not District.CITY_CENTER and not city.districts_built[district.value]:
+                legal[row] = self.get_cached_can_place_district(district, key)
+        return legal
+
     def district_mask(self) -> npt.NDArray[Any]:
+        """Which districts some city may still found or build, wherever the tiles allow."""
         mask = np.zeros(len(self.placeable_districts), dtype=bool)
-
-        existing = set()
-        has_city = len(self.current_civ_map.cities) > 0
-        if has_city:
-            city = self.current_civ_map.cities[0]
-            existing = {District(i) for i, built in enumerate(city.districts_built) if built}
+        cities = self.current_civ_map.cities
 
         for i, d in enumerate(self.placeable_districts):
-            if d in existing:
-                continue
-            if d is District.CITY_CENTER and has_city:
-                continue
-            if d is not District.CITY_CENTER and not has_city:
-                continue
-
-            mask[i] = True
+            if d is District.CITY_CENTER:
+                mask[i] = len(cities) < self.max_cities
+            else:
+                mask[i] = any(not city.districts_built[d.value] for city in cities)
         return mask
 
     def tile_mask(self, district: District) -> npt.NDArray[Any]:
-        sig = (self._current_sig, district)
-        if sig in self._tile_mask_cache:
-            return self._tile_mask_cache[sig]
+        """The empty tiles the district may go on, whichever districts their cities have built."""
+        key = (self.state_key(), district)
+        if key in self._tile_mask_cache:
+            return self._tile_mask_cache[key]
 
         mask = np.zeros(self.n_tiles, dtype=bool)
+        tiles = self.current_civ_map.tiles
 
-        if self.current_civ_map.cities:
-            search_indices = [i for i, k in enumerate(self.tile_keys) if self.current_civ_map.tiles[k].withinCityLimits]
+        # Tiles are owned the same way as in _tile_actions(): city centers go on tiles no city owns, and other
+        # districts on tiles a city does
+        if district is District.CITY_CENTER:
+            search_indices = [i for i, k in enumerate(self.tile_keys) if tiles[k].city is None]
         else:
-            search_indices = list(range(self.n_tiles))
+            search_indices = [i for i, k in enumerate(self.tile_keys) if tiles[k].city is not None]
 
         for idx in search_indices:
-            tile = self.current_civ_map.tiles[self.tile_keys[idx]]
+            tile = tiles[self.tile_keys[idx]]
 
             if tile.district != District.NONE:
                 continue
@@ -325,7 +621,7 @@ class CivEnv(gym.Env[npt.NDArray[np.float32], int]):
             if self.get_cached_can_place_district(district, self.tile_keys[idx]):
                 mask[idx] = True
 
-        self._tile_mask_cache[sig] = mask
+        self._tile_mask_cache[key] = mask
         return mask
 
     def reset(
@@ -335,9 +631,12 @@ class CivEnv(gym.Env[npt.NDArray[np.float32], int]):
         self.init_map()
 
         self.last_yield = 0
+        self._score = None
         self._score_cache.clear()
         self._action_mask_cache.clear()
         self._tile_mask_cache.clear()
-        self._current_sig = frozenset()
+        self._undo_stack.clear()
+        self._current_sig = self.grid_signature()
+        self._city_centers = tuple(city.center_coords for city in self.current_civ_map.cities)
 
         return self._get_obs(), {}
@@ -1,109 +1,129 @@
+import math
+from typing import Any, TypeVar
+
+from pydantic import BaseModel
+
+from backend.data_transfer.enum_tables import (
+    DISTRICT_TO_INT,
+    DISTRICT_TO_STRING,
+    FEATURE_TO_INT,
+    FEATURE_TO_STRING,
+    IMPROVEMENT_TO_INT,
+    IMPROVEMENT_TO_STRING,
+    RESOURCE_TO_INT,
+    RESOURCE_TO_STRING,
+    RESOURCE_TYPE_TO_INT,
+    RESOURCE_TYPE_TO_STRING,
+    TERRAIN_TO_INT,
+    TERRAIN_TO_STRING,
+    YIELD_TYPE_TO_STRING,
+)
 from backend.data_transfer.tile_string import TileString
 from backend.models.civmap import CivMap, Tile
-from backend.models.int_enums import (
-    District,
-    Feature,
-    Improvement,
-    Resource,
-    ResourceType,
-    Terrain,
-)
-from backend.models.string_enums import (
-    DistrictString,
-    FeatureString,
-    ImprovementString,
-    ResourceString,
-    ResourceTypeString,
-    TerrainString,
-)
-from backend.utils import get_tuple_from_string, yield_dict_to_string
+from backend.models.hex_topology import hex_radius
+from backend.models.int_enums import District
+from backend.utils import get_tuple_from_string
 from backend.yields.district_adjacency_rules import YieldType
-from backend.yields.yield_logic import get_score
+from backend.yields.yield_logic import ScoreResult, get_score
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+def construct_validated(model_cls: type[ModelT], values: dict[str, Any]) -> ModelT:
+    """
+    Build a model from values that are already known to be valid.
+
+    Does the same as model_construct() for a complete set of fields, without its per-field default handling, which
+    costs more than the rest of the conversion combined.
+    """
+    model = model_cls.__new__(model_cls)
+    object.__setattr__(model, "__dict__", values)
+    object.__setattr__(model, "__pydantic_fields_set__", set(values))
+    object.__setattr__(model, "__pydantic_extra__", None)
+    object.__setattr__(model, "__pydantic_private__", None)
+    return model
+
+
+def convert_tile_string_to_tile(tile_string: TileString) -> Tile:
+    # The TileString has already been validated by FastAPI, so the Tile only needs its enums translated.
+    return Tile(
+        q=tile_string.q,
+        r=tile_string.r,
+        terrain=TERRAIN_TO_INT[tile_string.terrain],
+        hill=tile_string.hill,
+        mountain=tile_string.mountain,
+        mountain_no=tile_string.mountain_no,
+        feature=FEATURE_TO_INT[tile_string.feature],
+        district=DISTRICT_TO_INT[tile_string.district],
+        resource=RESOURCE_TO_INT[tile_string.resource],
+        resourceType=RESOURCE_TYPE_TO_INT[tile_string.resourceType],
+        improvement=IMPROVEMENT_TO_INT[tile_string.improvement],
+        rivers=list(tile_string.rivers),
+        withinCityLimits=tile_string.withinCityLimits,
+    )
 
 
 def convert_dto_grid_to_grid(dto: dict[str, TileString]) -> dict[tuple[int, int], Tile]:
-    converted_grid: dict[tuple[int, int], Tile] = {}
-
-    for key_string, tile_string in dto.items():
-        key = get_tuple_from_string(key_string)
-        converted_grid[key] = Tile(
-            q=tile_string.q,
-            r=tile_string.r,
-            terrain=Terrain[tile_string.terrain.value.upper()],
-            hill=tile_string.hill,
-            mountain=tile_string.mountain,
-            mountain_no=tile_string.mountain_no,
-            feature=Feature[tile_string.feature.value.upper()],
-            district=District[tile_string.district.value.upper()],
-            resource=Resource[tile_string.resource.value.upper()],
-            resourceType=ResourceType[tile_string.resourceType.value.upper()],
-            improvement=Improvement[tile_string.improvement.value.upper()],
-            rivers=tile_string.rivers,
-            withinCityLimits=tile_string.withinCityLimits,
-            city=None,
-        )
-
-    return converted_grid
+    return {get_tuple_from_string(key_string): convert_tile_string_to_tile(ts) for key_string, ts in dto.items()}
 
 
 def convert_dto_grid_to_map(dto: dict[str, TileString]) -> CivMap:
     civ_map = CivMap()
+    civ_map.tiles = convert_dto_grid_to_grid(dto)
+    civ_map.radius = hex_radius(civ_map.tiles)
 
-    city_center: Tile | None = None
-    for key_string, tile_string in dto.items():
-        key = get_tuple_from_string(key_string)
-        district = District[tile_string.district.value.upper()]
-
-        civ_map.tiles[key] = Tile(
-            q=tile_string.q,
-            r=tile_string.r,
-            terrain=Terrain[tile_string.terrain.value.upper()],
-            hill=tile_string.hill,
-            mountain=tile_string.mountain,
-            mountain_no=tile_string.mountain_no,
-            feature=Feature[tile_string.feature.value.upper()],
-            district=district,
-            resource=Resource[tile_string.resource.value.upper()],
-            resourceType=ResourceType[tile_string.resourceType.value.upper()],
-            improvement=Improvement[tile_string.improvement.value.upper()],
-            rivers=tile_string.rivers,
-            withinCityLimits=tile_string.withinCityLimits,
-            city=None,
-        )
+    # Every city center founds a city, and cities founded first keep the tiles they share
+    for tile in civ_map.tiles.values():
+        if tile.district == District.CITY_CENTER and tile.city is None:
+            civ_map.make_city((tile.q, tile.r))
 
-        if district == District.CITY_CENTER:
-            city_center = civ_map.tiles[key]
+    return civ_map
 
-    if city_center is not None:
-        civ_map.make_city((city_center.q, city_center.r), allow_overwrite=True)
 
-    return civ_map
+def convert_yields_to_dto(yield_info: dict[YieldType, float]) -> dict[str, float]:
+    out: dict[str, float] = {}
+    for yield_type, value in yield_info.items():
+        floored = float(math.floor(value))
+        if floored > 0:
+            out[YIELD_TYPE_TO_STRING[yield_type]] = floored
+    return out
 
 
-def convert_grid_to_dto(grid: dict[tuple[int, int], Tile]) -> dict[str, TileString]:
-    dto: dict[str, TileString] = {}
+def convert_grid_to_dto(grid: dict[tuple[int, int], Tile], score: ScoreResult | None = None) -> dict[str, TileString]:
+    """
+    Convert an internal grid back into API tiles, filling in per-tile yields.
 
-    for key, tile in grid.items():
+    Args:
+        grid: The grid to convert
+        score: The result of get_score(grid), if the caller already has it. Computed here otherwise.
+    """
+    if score is None:
+        score = get_score(grid)
+    tile_results = score.tiles
+
+    dto: dict[str, TileString] = {}
+    for tile in grid.values():
         key_string = f"{tile.q},{tile.r}"
-        dto[key_string] = TileString(
-            q=tile.q,
-            r=tile.r,
-            terrain=TerrainString(Terrain(tile.terrain.value).name.lower()),
-            hill=tile.hill,
-            mountain=tile.mountain,
-            mountain_no=tile.mountain_no,
-            feature=FeatureString(Feature(tile.feature.value).name.lower()),
-            district=DistrictString(District(tile.district.value).name.lower()),
-            resource=ResourceString(Resource(tile.resource.value).name.lower()),
-            resourceType=ResourceTypeString(ResourceType(tile.resourceType.value).name.lower()),
-            improvement=ImprovementString(Improvement(tile.improvement.value).name.lower()),
-            yields={},
-            rivers=tile.rivers,
-            withinCityLimits=tile.withinCityLimits,
+        yield_info = tile_results.get(key_string)
+
+        dto[key_string] = construct_validated(
+            TileString,
+            {
+                "q": tile.q,
+                "r": tile.r,
+                "terrain": TERRAIN_TO_STRING[tile.terrain],
+                "hill": tile.hill,
+                "mountain": tile.mountain,
+                "mountain_no": tile.mountain_no,
+                "feature": FEATURE_TO_STRING[tile.feature],
+                "district": DISTRICT_TO_STRING[tile.district],
+                "resource": RESOURCE_TO_STRING[tile.resource],
+                "resourceType": RESOURCE_TYPE_TO_STRING[tile.resourceType],
+                "improvement": IMPROVEMENT_TO_STRING[tile.improvement],
+                "rivers": list(tile.rivers),
+                "yields": convert_yields_to_dto(yield_info) if yield_info else {},
+                "withinCityLimits": tile.withinCityLimits,
+            },
         )
 
-    tile_results: dict[str, dict[YieldType, float]] = get_score(grid).tiles
-    for tile_key, yield_info in tile_results.items():
-        dto[tile_key].yields = yield_dict_to_string(yield_info, floor_values=True)
-
     return dto
@@ -0,0 +1,85 @@
+"""
+Lookup tables between the frontend string enums and the int enums generated from them, resolved once at import.
+"""
+
+from enum import Enum, IntEnum
+from typing import TypeVar
+
+from backend.models.int_enums import (
+    District,
+    Feature,
+    Improvement,
+    Resource,
+    ResourceType,
+    Terrain,
+)
+from backend.models.string_enums import (
+    DistrictString,
+    FeatureString,
+    ImprovementString,
+    ResourceString,
+    ResourceTypeString,
+    TerrainString,
+)
+from backend.yields.district_adjacency_rules import YieldType
+
+StringEnumT = TypeVar("StringEnumT", bound=Enum)
+IntEnumT = TypeVar("IntEnumT", bound=IntEnum)
+
+
+def _int_member(int_enum: type[IntEnumT], string_member: Enum) -> IntEnumT | None:
+    name = str(string_member.value).upper()
+    if name in int_enum.__members__:
+        return int_enum[name]
+    return int_enum.__members__.get(string_member.name)
+
+
+def build_to_int_table(string_enum: type[StringEnumT], int_enum: type[IntEnumT]) -> dict[StringEnumT, IntEnumT]:
+    table: dict[StringEnumT, IntEnumT] = {}
+    for member in string_enum:
+        int_member = _int_member(int_enum, member)
+        if int_member is not None:
+            table[member] = int_member
+    return table
+
+
+def build_to_string_table(string_enum: type[StringEnumT], int_enum: type[IntEnumT]) -> dict[IntEnumT, StringEnumT]:
+    return {int_member: member for member, int_member in build_to_int_table(string_enum, int_enum).items()}
+
+
+def build_raw_string_table(string_enum: type[StringEnumT], int_enum: type[IntEnumT]) -> dict[str, IntEnumT]:
+    """
+    Map raw JSON strings to int enum members.
+
+    Accepts both the string value (``"bonus"``) and the lower-cased member name (``"bonus_resource"``), since older
+    map exports in ``maps/`` used the latter.
+    """
+    table: dict[str, IntEnumT] = {}
+    for member, int_member in build_to_int_table(string_enum, int_enum).items():
+        table[member.name.lower()] = int_member
+        table[str(member.value)] = int_member
+    return table
+
+
+TERRAIN_TO_INT = build_to_int_table(TerrainString, Terrain)
+FEATURE_TO_INT = build_to_int_table(FeatureString, Feature)
+DISTRICT_TO_INT = build_to_int_table(DistrictString, District)
+RESOURCE_TO_INT = build_to_int_table(ResourceString, Resource)
+RESOURCE_TYPE_TO_INT = build_to_int_table(ResourceTypeString, ResourceType)
+IMPROVEMENT_TO_INT = build_to_int_table(ImprovementString, Improvement)
+
+TERRAIN_TO_STRING = build_to_string_table(TerrainString, Terrain)
+FEATURE_TO_STRING = build_to_string_table(FeatureString, Feature)
+DISTRICT_TO_STRING = build_to_string_table(DistrictString, District)
+RESOURCE_TO_STRING = build_to_string_table(ResourceString, Resource)
+RESOURCE_TYPE_TO_STRING = build_to_string_table(ResourceTypeString, ResourceType)
+IMPROVEMENT_TO_STRING = build_to_string_table(ImprovementString, Improvement)
+
+TERRAIN_FROM_RAW = build_raw_string_table(TerrainString, Terrain)
+FEATURE_FROM_RAW = build_raw_string_table(FeatureString, Feature)
+DISTRICT_FROM_RAW = build_raw_string_table(DistrictString, District)
+RESOURCE_FROM_RAW = build_raw_string_table(ResourceString, Resource)
+RESOURCE_TYPE_FROM_RAW = build_raw_string_table(ResourceTypeString, ResourceType)
+IMPROVEMENT_FROM_RAW = build_raw_string_table(ImprovementString, Improvement)
+
+YIELD_TYPE_TO_STRING: dict[YieldType, str] = {y: y.name.lower() for y in YieldType}
@@ -0,0 +1,42 @@
+from pydantic import BaseModel, ConfigDict
+
+from backend.models.civmap import Tile
+from backend.models.int_enums import District, Feature, Improvement, Resource, ResourceType, Terrain
+
+
+class TileRecord(BaseModel):
+    """A tile as stored in map files, with its categorical fields already decoded to int enums."""
+
+    q: int
+    r: int
+    terrain: Terrain
+    hill: bool
+    mountain: bool
+    mountain_no: int
+    feature: Feature
+    district: District
+    resource: Resource
+    resourceType: ResourceType
+    improvement: Improvement
+    rivers: list[bool]
+    withinCityLimits: bool
+
+    # Built on the first map file loaded, so that servers, which never load one, do not pay for it
+    model_config = ConfigDict(defer_build=True)
+
+    def to_tile(self) -> Tile:
+        return Tile(
+            q=self.q,
+            r=self.r,
+            terrain=self.terrain,
+            hill=self.hill,
+            mountain=self.mountain,
+            mountain_no=self.mountain_no,
+            feature=self.feature,
+            district=self.district,
+            resource=self.resource,
+            resourceType=self.resourceType,
+            improvement=self.improvement,
+            rivers=list(self.rivers),
+            withinCityLimits=self.withinCityLimits,
+        )
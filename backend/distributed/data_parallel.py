@@ -0,0 +1,111 @@
+import os
+import socket
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import torch as th
+import torch.distributed as dist
+from sb3_contrib.ppo_mask import MaskablePPO
+from stable_baselines3.common.buffers import RolloutBuffer
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env import VecEnv
+from torch.multiprocessing.spawn import spawn
+
+from backend.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+@dataclass
+class LearnerGroup:
+    """Where this process stands among the learner processes training one model."""
+
+    rank: int
+    world_size: int
+
+    @property
+    def is_main(self) -> bool:
+        """Whether this process logs, checkpoints and saves the model for the group."""
+        return self.rank == 0
+
+    def cores(self, cores: list[int]) -> list[int]:
+        """
+        This process' share of cores, as a contiguous slice.
+
+        Cores on the same socket are usually numbered together, so a contiguous slice keeps a learner and its envs on
+        one socket where possible.
+        """
+        share, extra = divmod(len(cores), self.world_size)
+        if share == 0:
+            return [cores[self.rank % len(cores)]]
+        start = self.rank * share + min(self.rank, extra)
+        return cores[start : start + share + (1 if self.rank < extra else 0)]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+def _run_learner(rank: int, world_size: int, port: int, target: Callable[..., None], args: tuple[Any, ...]) -> None:
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    try:
+        target(LearnerGroup(rank, world_size), *args)
+    finally:
+        dist.destroy_process_group()
+
+
+def spawn_learners(world_size: int, target: Callable[..., None], *args: Any) -> None:
+    """
+    Run target(group, *args) in world_size new processes joined in a gloo process group, and wait for all of them.
+
+    Raises:
+        ProcessRaisedException: If any of the processes fails
+    """
+    spawn(_run_learner, args=(world_size, _free_port(), target, args), nprocs=world_size)  # type: ignore[no-untyped-call]
+
+
+class DataParallelMaskablePPO(MaskablePPO):
+    """
+    MaskablePPO as one of several learner processes, each updating on the rollouts of its own envs.
+
+    All processes start from the main process' weights, and every gradient is averaged across them as soon as backward()
+    produces it, before it is clipped and applied. With the same minibatch size in every process, each update is the
+    one a single process would make on the union of their minibatches, so the processes' weights stay identical without
+    ever being sent again. num_timesteps counts the env steps of all processes.
+
+    Every process must take the same number of gradient steps, so target_kl, which stops each one after its own KL
+    estimate, is not supported.
+    """
+
+    def __init__(self, *args: Any, world_size: int, **kwargs: Any):
+        if kwargs.get("target_kl") is not None:
+            raise ValueError("target_kl would stop learner processes after different numbers of gradient steps")
+        self.world_size = world_size
+        super().__init__(*args, **kwargs)
+
+        for parameter in self.policy.parameters():
+            dist.broadcast(parameter.data, src=0)
+            parameter.register_post_accumulate_grad_hook(self._average_gradient)  # type: ignore[no-untyped-call]
+
+    def _average_gradient(self, parameter: th.Tensor) -> None:
+        assert parameter.grad is not None
+        dist.all_reduce(parameter.grad)
+        parameter.grad /= self.world_size
+
+    def collect_rollouts(
+        self,
+        env: VecEnv,
+        callback: BaseCallback,
+        rollout_buffer: RolloutBuffer,
+        n_rollout_steps: int,
+        use_masking: bool = True,
+    ) -> bool:
+        collected = super().collect_rollouts(env, callback, rollout_buffer, n_rollout_steps, use_masking)
+        if collected:
+            # The other processes collected just as many steps at the same time
+            self.num_timesteps += (self.world_size - 1) * n_rollout_steps * env.num_envs
+        return collected
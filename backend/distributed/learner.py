@@ -0,0 +1,496 @@
+import json
+import os
+import pickle
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Sequence
+
+import gymnasium as gym
+import numpy as np
+import numpy.typing as npt
+import torch as th
+from sb3_contrib.common.maskable.buffers import MaskableRolloutBuffer
+from sb3_contrib.ppo_mask import MaskablePPO
+from stable_baselines3.common.buffers import RolloutBuffer
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env import VecEnv
+from stable_baselines3.common.vec_env.base_vec_env import VecEnvIndices, VecEnvObs, VecEnvStepReturn
+
+from backend.civenv import ObservationMode
+from backend.distributed.protocol import Connection, MessageType, ProtocolError, Trajectory, pack_arrays, parse_address
+from backend.logger import setup_logger
+from backend.utils import THREAD_POOL_VARIABLES
+
+logger = setup_logger(__name__)
+
+
+class RolloutServer:
+    """
+    The learner's end of the rollout workers' connections.
+
+    Workers connect and say how many envs they run. Their envs are numbered in the order the workers connected, and
+    the trajectories they send back are joined in that order, so the learner sees one batch of envs.
+    """
+
+    def __init__(self, address: str = "127.0.0.1:0"):
+        host, port = parse_address(address)
+        self.listener = socket.create_server((host, port))
+        self.connections: list[Connection] = []
+        self.worker_envs: list[int] = []
+        self.trajectory_stream: TrajectoryStream | None = None
+
+    @property
+    def address(self) -> str:
+        """Where workers connect, with the port filled in when the server was given port 0."""
+        host, port = self.listener.getsockname()[:2]
+        return f"{host}:{port}"
+
+    @property
+    def num_envs(self) -> int:
+        return sum(self.worker_envs)
+
+    def accept(self, count: int, timeout: float = 60.0) -> None:
+        """
+        Wait for count more workers to connect.
+
+        Raises:
+            TimeoutError: If they do not all connect within timeout seconds
+        """
+        self.listener.settimeout(timeout)
+        for _ in range(count):
+            try:
+                sock, peer = self.listener.accept()
+            except socket.timeout as e:
+                raise TimeoutError(f"Only {len(self.connections)} rollout workers connected") from e
+            sock.settimeout(None)
+            connection = Connection(sock)
+            envs = int(json.loads(connection.expect(MessageType.HELLO))["envs"])
+            self.connections.append(connection)
+            self.worker_envs.append(envs)
+            logger.info(f"Rollout worker {peer[0]}:{peer[1]} connected with {envs} envs")
+
+    def setup(
+        self,
+        policy_class: type[th.nn.Module],
+        policy_kwargs: dict[str, Any],
+        map_glob: str,
+        seed: int,
+        observation_mode: ObservationMode = ObservationMode.FLOAT,
+        max_cities: int = 1,
+    ) -> None:
+        """Tell every worker how to build its envs and its copy of the policy."""
+        offset = 0
+        for connection, envs in zip(self.connections, self.worker_envs):
+            setup = {
+                "policy_class": policy_class,
+                "policy_kwargs": policy_kwargs,
+                "map_glob": map_glob,
+                "seed": seed + offset,
+                "observation_mode": observation_mode.value,
+                "max_cities": max_cities,
+            }
+            connection.send(MessageType.SETUP, pickle.dumps(setup))
+            offset += envs
+
+    def broadcast_weights(self, policy: th.nn.Module, version: int) -> None:
+        payload = pack_arrays(
+            {name: tensor.detach().cpu().numpy() for name, tensor in policy.state_dict().items()},
+            {"version": version},
+        )
+        for connection in self.connections:
+            connection.send(MessageType.WEIGHTS, payload)
+
+    def collect(self, steps: int) -> list[Trajectory]:
+        """Have every worker collect steps steps per env at once, and wait for all of them."""
+        for connection in self.connections:
+            connection.send_json(MessageType.COLLECT, {"steps": steps})
+        return [Trajectory.decode(connection.expect(MessageType.TRAJECTORY)) for connection in self.connections]
+
+    def stream(self, steps: int, maxsize: int) -> "TrajectoryStream":
+        """Keep every worker collecting trajectories of steps steps per env, instead of one at a time on request."""
+        self.trajectory_stream = TrajectoryStream(self.connections, steps, maxsize)
+        return self.trajectory_stream
+
+    def close(self) -> None:
+        if self.trajectory_stream is not None:
+            self.trajectory_stream.close()
+        for connection in self.connections:
+            try:
+                connection.send(MessageType.CLOSE)
+            except OSError:
+                pass
+            connection.close()
+        self.listener.close()
+
+
+class TrajectoryStream:
+    """
+    Keeps every worker collecting, and queues the trajectories they send for the learner.
+
+    A thread per worker receives its trajectories and asks it for the next one as soon as the last one is queued. The
+    queue holds at most maxsize trajectories: when the learner falls behind, workers are left waiting instead of
+    collecting ever staler data.
+    """
+
+    def __init__(self, connections: list[Connection], steps: int, maxsize: int):
+        self.queue: queue.Queue[Trajectory] = queue.Queue(maxsize)
+        self.error: BaseException | None = None
+        self._closed = threading.Event()
+        for connection in connections:
+            threading.Thread(target=self._receive, args=(connection, steps), daemon=True).start()
+
+    def _receive(self, connection: Connection, steps: int) -> None:
+        try:
+            while not self._closed.is_set():
+                connection.send_json(MessageType.COLLECT, {"steps": steps})
+                trajectory = Trajectory.decode(connection.expect(MessageType.TRAJECTORY))
+                while not self._closed.is_set():
+                    try:
+                        self.queue.put(trajectory, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+        except (OSError, ProtocolError) as e:
+            if not self._closed.is_set():
+                self.error = e
+
+    def get(self) -> Trajectory:
+        """
+        The next trajectory any worker sent, waiting for one if none is queued.
+
+        Raises:
+            ProtocolError: If a worker disconnected or sent something unexpected
+        """
+        while True:
+            if self.error is not None:
+                raise ProtocolError("A rollout worker failed") from self.error
+            try:
+                return self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def close(self) -> None:
+        self._closed.set()
+
+
+def spawn_local_workers(
+    address: str, count: int, envs_per_worker: int, cores: Sequence[int] | None = None
+) -> list[subprocess.Popen[bytes]]:
+    """
+    Start rollout worker processes on this machine, connecting to the server at address.
+
+    Each worker runs torch and BLAS with a single thread, and when cores are given, is pinned round robin to one of
+    them.
+    """
+    env = {**os.environ, **dict.fromkeys(THREAD_POOL_VARIABLES, "1")}
+    workers = []
+    for i in range(count):
+        command = [sys.executable, "-m", "backend.distributed.worker", "--learner", address]
+        command += ["--envs", str(envs_per_worker)]
+        if cores:
+            command += ["--core", str(cores[i % len(cores)])]
+        workers.append(subprocess.Popen(command, env=env))
+    return workers
+
+
+class RemoteEnvs(VecEnv):
+    """
+    Stands in for the envs run by the workers connected to a RolloutServer, so the model knows their number and spaces.
+
+    Nothing is stepped through it: DistributedMaskablePPO gets whole trajectories from the workers instead. Closing it
+    sends the workers away.
+    """
+
+    def __init__(
+        self, server: RolloutServer, observation_space: gym.spaces.Space[Any], action_space: gym.spaces.Space[Any]
+    ):
+        super().__init__(server.num_envs, observation_space, action_space)
+        self.server = server
+
+    def reset(self) -> VecEnvObs:
+        # Only called when learning starts; the workers reset their own envs
+        assert self.observation_space.shape is not None
+        return np.zeros((self.num_envs, *self.observation_space.shape), dtype=self.observation_space.dtype)
+
+    def step_async(self, actions: np.ndarray) -> None:
+        raise NotImplementedError("Remote envs are stepped by their workers")
+
+    def step_wait(self) -> VecEnvStepReturn:
+        raise NotImplementedError("Remote envs are stepped by their workers")
+
+    def close(self) -> None:
+        self.server.close()
+
+    def get_attr(self, attr_name: str, indices: VecEnvIndices = None) -> list[Any]:
+        if attr_name == "render_mode":
+            # Asked for by VecEnv itself. CivEnv does not render.
+            return [None for _ in self._get_indices(indices)]
+        raise NotImplementedError("Remote envs are not reachable from the learner")
+
+    def set_attr(self, attr_name: str, value: Any, indices: VecEnvIndices = None) -> None:
+        raise NotImplementedError("Remote envs are not reachable from the learner")
+
+    def env_method(
+        self, method_name: str, *method_args: Any, indices: VecEnvIndices = None, **method_kwargs: Any
+    ) -> list[Any]:
+        raise NotImplementedError("Remote envs are not reachable from the learner")
+
+    def env_is_wrapped(
+        self, wrapper_class: type[gym.Wrapper[Any, Any, Any, Any]], indices: VecEnvIndices = None
+    ) -> list[bool]:
+        return [False] * self.num_envs
+
+
+class DistributedMaskablePPO(MaskablePPO):
+    """
+    MaskablePPO with rollouts collected by RolloutWorkers instead of a VecEnv.
+
+    Before every rollout the current weights go out to all workers, tagged with an increasing version, and each worker
+    steps its envs with them. The trajectories fill the rollout buffer exactly as MaskablePPO.collect_rollouts() would
+    have, so the update itself is unchanged. Callbacks still run once per step, but only after the whole rollout is in,
+    so they cannot stop a rollout early.
+    """
+
+    def __init__(self, env: RemoteEnvs, **kwargs: Any):
+        self.server = env.server
+        self.policy_version = 0
+        super().__init__(env=env, **kwargs)
+
+    def _excluded_save_params(self) -> list[str]:
+        return [*super()._excluded_save_params(), "server"]
+
+    def collect_rollouts(
+        self,
+        env: VecEnv,
+        callback: BaseCallback,
+        rollout_buffer: RolloutBuffer,
+        n_rollout_steps: int,
+        use_masking: bool = True,
+    ) -> bool:
+        assert isinstance(rollout_buffer, MaskableRolloutBuffer), "RolloutBuffer doesn't support action masking"
+        self.policy.set_training_mode(False)
+        rollout_buffer.reset()
+        callback.on_rollout_start()
+
+        self.policy_version += 1
+        self.server.broadcast_weights(self.policy, self.policy_version)
+        trajectory = Trajectory.concatenate(self.server.collect(n_rollout_steps))
+        if trajectory.policy_version != self.policy_version:
+            raise ProtocolError(f"Got a rollout from policy {trajectory.policy_version}, not {self.policy_version}")
+
+        if not self._add_rollout(trajectory, trajectory.values, trajectory.log_probs, rollout_buffer, callback):
+            return False
+
+        rollout_buffer.compute_returns_and_advantage(
+            last_values=th.as_tensor(trajectory.last_values, device=self.device), dones=trajectory.last_dones
+        )
+        callback.on_rollout_end()
+        return True
+
+    def _add_rollout(
+        self,
+        trajectory: Trajectory,
+        values: npt.NDArray[np.float32],
+        log_probs: npt.NDArray[np.float32],
+        rollout_buffer: MaskableRolloutBuffer,
+        callback: BaseCallback,
+    ) -> bool:
+        """Fill the rollout buffer with a trajectory, running the step callbacks as if it was being collected."""
+        for step in range(trajectory.actions.shape[0]):
+            rollout_buffer.add(
+                trajectory.observations[step],
+                trajectory.actions[step].reshape(-1, 1),
+                trajectory.rewards[step],
+                trajectory.episode_starts[step],
+                th.as_tensor(values[step], device=self.device),
+                th.as_tensor(log_probs[step], device=self.device),
+                action_masks=trajectory.action_masks[step],
+            )
+            self.num_timesteps += trajectory.num_envs
+            callback.update_locals(locals())
+            if not callback.on_step():
+                return False
+
+        assert self.ep_info_buffer is not None
+        for episode_return, length in zip(trajectory.episode_returns, trajectory.episode_lengths):
+            self.ep_info_buffer.extend([{"r": float(episode_return), "l": int(length)}])
+        return True
+
+
+def vtrace(
+    trajectory: Trajectory,
+    values: npt.NDArray[np.float32],
+    last_values: npt.NDArray[np.float32],
+    log_ratios: npt.NDArray[np.float32],
+    gamma: float,
+    gae_lambda: float,
+    rho_clip: float = 1.0,
+    c_clip: float = 1.0,
+) -> tuple[npt.NDArray[np.float32], npt.NDArray[np.float32]]:
+    """
+    Advantages and value targets for a trajectory collected by an older policy, corrected with V-trace.
+
+    This is the GAE recursion of RolloutBuffer.compute_returns_and_advantage(), with each TD error weighted by the
+    truncated importance ratio min(rho_clip, pi / mu) and each trace cut by gae_lambda * min(c_clip, pi / mu), where pi
+    is the current policy and mu the one that acted. When the trajectory is on-policy, all ratios are 1 and the result
+    is exactly GAE.
+
+    Args:
+        values: Values of the trajectory's observations under the current value function, shaped (steps, envs)
+        last_values: Values of its last_observations under the current value function
+        log_ratios: log pi - log mu of every action taken, shaped (steps, envs)
+
+    Returns:
+        The advantages and the value targets, both shaped (steps, envs)
+    """
+    ratios = np.exp(log_ratios)
+    rhos = np.minimum(rho_clip, ratios)
+    traces = gae_lambda * np.minimum(c_clip, ratios)
+
+    advantages = np.zeros_like(values)
+    last_advantage = np.zeros_like(last_values)
+    steps = values.shape[0]
+    for step in reversed(range(steps)):
+        if step == steps - 1:
+            next_non_terminal = 1.0 - trajectory.last_dones.astype(np.float32)
+            next_values = last_values
+        else:
+            next_non_terminal = 1.0 - trajectory.episode_starts[step + 1].astype(np.float32)
+            next_values = values[step + 1]
+        delta = rhos[step] * (trajectory.rewards[step] + gamma * next_values * next_non_terminal - values[step])
+        last_advantage = delta + gamma * traces[step] * next_non_terminal * last_advantage
+        advantages[step] = last_advantage
+    return advantages, advantages + values
+
+
+class AsyncMaskablePPO(DistributedMaskablePPO):
+    """
+    MaskablePPO that keeps training while the rollout workers keep collecting.
+
+    Workers never wait for an update: they collect with the latest weights they have received, and their
+    trajectories queue up in a bounded TrajectoryStream. After every update the new weights are sent out, so the data
+    an update uses is usually one or two policy versions old. Trajectories more than max_policy_lag versions old are
+    dropped.
+
+    Stale data is corrected for in two places. Before each update the current policy re-evaluates the batch: its
+    log-probabilities become PPO's old log-probabilities, so the clipped ratio stays centered on the policy being
+    updated, and the gap to the policy that acted is corrected for with V-trace in the advantages and value targets.
+    """
+
+    def __init__(
+        self,
+        env: RemoteEnvs,
+        queue_size: int = 8,
+        max_policy_lag: int = 4,
+        rho_clip: float = 1.0,
+        c_clip: float = 1.0,
+        **kwargs: Any,
+    ):
+        self.queue_size = queue_size
+        self.max_policy_lag = max_policy_lag
+        self.rho_clip = rho_clip
+        self.c_clip = c_clip
+        self.dropped_trajectories = 0
+        self._leftover: Trajectory | None = None
+        super().__init__(env, **kwargs)
+
+    def _excluded_save_params(self) -> list[str]:
+        return [*super()._excluded_save_params(), "_leftover"]
+
+    def collect_rollouts(
+        self,
+        env: VecEnv,
+        callback: BaseCallback,
+        rollout_buffer: RolloutBuffer,
+        n_rollout_steps: int,
+        use_masking: bool = True,
+    ) -> bool:
+        assert isinstance(rollout_buffer, MaskableRolloutBuffer), "RolloutBuffer doesn't support action masking"
+        self.policy.set_training_mode(False)
+        rollout_buffer.reset()
+        callback.on_rollout_start()
+
+        stream = self.server.trajectory_stream
+        if stream is None:
+            self.policy_version += 1
+            self.server.broadcast_weights(self.policy, self.policy_version)
+            stream = self.server.stream(n_rollout_steps, self.queue_size)
+
+        wait_start = time.perf_counter()
+        trajectory, lags = self._next_batch(stream, env.num_envs)
+        self.logger.record("async/learner_wait_sec", time.perf_counter() - wait_start)
+        self.logger.record("async/policy_lag_mean", float(np.mean(lags)))
+        self.logger.record("async/policy_lag_max", max(lags))
+        self.logger.record("async/queued_trajectories", stream.queue.qsize())
+        self.logger.record("async/dropped_trajectories", self.dropped_trajectories)
+
+        values, log_probs, last_values = self._evaluate(trajectory)
+        log_ratios = log_probs - trajectory.log_probs
+        self.logger.record("async/rho_clipped_fraction", float(np.mean(log_ratios > np.log(self.rho_clip))))
+
+        if not self._add_rollout(trajectory, values, log_probs, rollout_buffer, callback):
+            return False
+
+        advantages, returns = vtrace(
+            trajectory, values, last_values, log_ratios, self.gamma, self.gae_lambda, self.rho_clip, self.c_clip
+        )
+        rollout_buffer.advantages[:] = advantages
+        rollout_buffer.returns[:] = returns
+        callback.on_rollout_end()
+        return True
+
+    def _next_batch(self, stream: TrajectoryStream, num_envs: int) -> tuple[Trajectory, list[int]]:
+        """
+        Trajectories from the stream joined into one with num_envs envs, and the policy lag of each.
+
+        Envs beyond num_envs are kept for the next batch.
+        """
+        batch: list[Trajectory] = []
+        lags: list[int] = []
+        envs = 0
+        while envs < num_envs:
+            trajectory, self._leftover = self._leftover or stream.get(), None
+            lag = self.policy_version - trajectory.policy_version
+            if lag > self.max_policy_lag:
+                self.dropped_trajectories += 1
+                continue
+            if envs + trajectory.num_envs > num_envs:
+                trajectory, self._leftover = trajectory.split(num_envs - envs)
+            batch.append(trajectory)
+            lags.append(lag)
+            envs += trajectory.num_envs
+        return Trajectory.concatenate(batch), lags
+
+    def _evaluate(
+        self, trajectory: Trajectory
+    ) -> tuple[npt.NDArray[np.float32], npt.NDArray[np.float32], npt.NDArray[np.float32]]:
+        """
+        Values and action log-probabilities of a trajectory under the current policy.
+
+        Returns:
+            The values and log-probabilities of every step, shaped (steps, envs), and the values of the last
+            observations
+        """
+        steps, envs = trajectory.actions.shape
+        with th.no_grad():
+            observations = trajectory.observations.reshape(steps * envs, *trajectory.observations.shape[2:])
+            values, log_probs, _ = self.policy.evaluate_actions(
+                th.as_tensor(observations, device=self.device),
+                th.as_tensor(trajectory.actions.reshape(-1), device=self.device),
+                action_masks=th.as_tensor(trajectory.action_masks.reshape(steps * envs, -1), device=self.device),
+            )
+            last_values = self.policy.predict_values(th.as_tensor(trajectory.last_observations, device=self.device))
+        return (
+            values.cpu().numpy().reshape(steps, envs),
+            log_probs.cpu().numpy().reshape(steps, envs),
+            last_values.cpu().numpy().reshape(envs),
+        )
+
+    def train(self) -> None:
+        super().train()
+        self.policy_version += 1
+        self.server.broadcast_weights(self.policy, self.policy_version)
@@ -0,0 +1,219 @@
+import json
+import socket
+import struct
+import threading
+from dataclasses import dataclass, fields
+from enum import IntEnum
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+
+# Message type and payload length, in network byte order
+HEADER = struct.Struct("!BQ")
+ARRAY_HEADER_LENGTH = struct.Struct("!I")
+
+
+class MessageType(IntEnum):
+    # Worker to learner, JSON: how many envs the worker runs
+    HELLO = 1
+    # Learner to worker, pickled: how to build the policy and the envs
+    SETUP = 2
+    # Learner to worker, arrays: policy parameters, with their version in the metadata
+    WEIGHTS = 3
+    # Learner to worker, JSON: how many steps to collect per env
+    COLLECT = 4
+    # Worker to learner, arrays: an encoded Trajectory
+    TRAJECTORY = 5
+    # Learner to worker, empty: stop and disconnect
+    CLOSE = 6
+
+
+class ProtocolError(Exception):
+    """Raised when the other side sends something unexpected or disconnects."""
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class Connection:
+    """Length-prefixed messages over a TCP socket. Messages may be sent from several threads, but received from one."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._send_lock = threading.Lock()
+
+    def send(self, kind: MessageType, payload: bytes = b"") -> None:
+        with self._send_lock:
+            self.sock.sendall(HEADER.pack(kind, len(payload)))
+            self.sock.sendall(payload)
+
+    def send_json(self, kind: MessageType, value: Any) -> None:
+        self.send(kind, json.dumps(value).encode())
+
+    def receive(self) -> tuple[MessageType, bytes]:
+        kind, length = HEADER.unpack(self._receive_exactly(HEADER.size))
+        return MessageType(kind), self._receive_exactly(length)
+
+    def expect(self, kind: MessageType) -> bytes:
+        """
+        Receive the next message, which must be of the given type.
+
+        Raises:
+            ProtocolError: If a message of another type arrives
+        """
+        received, payload = self.receive()
+        if received is not kind:
+            raise ProtocolError(f"Expected a {kind.name} message, got {received.name}")
+        return payload
+
+    def _receive_exactly(self, length: int) -> bytes:
+        buffer = bytearray(length)
+        view = memoryview(buffer)
+        received = 0
+        while received < length:
+            count = self.sock.recv_into(view[received:])
+            if count == 0:
+                raise ProtocolError("Connection closed by the other side")
+            received += count
+        return bytes(buffer)
+
+    def close(self) -> None:
+        # Shutting down first wakes up a thread blocked receiving, which closing alone does not
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def pack_arrays(arrays: dict[str, npt.NDArray[Any]], meta: dict[str, Any] | None = None) -> bytes:
+    """
+    Encode named arrays as a JSON header describing them, followed by their raw bytes.
+
+    Unlike pickle, decoding cannot run code, and the arrays are copied only once on each side.
+    """
+    header = json.dumps(
+        {
+            "meta": meta or {},
+            "arrays": [[name, array.dtype.str, list(array.shape)] for name, array in arrays.items()],
+        }
+    ).encode()
+    parts = [ARRAY_HEADER_LENGTH.pack(len(header)), header]
+    parts += [np.ascontiguousarray(array).tobytes() for array in arrays.values()]
+    return b"".join(parts)
+
+
+def unpack_arrays(payload: bytes) -> tuple[dict[str, npt.NDArray[Any]], dict[str, Any]]:
+    """
+    Decode what pack_arrays() encoded.
+
+    Returns:
+        The arrays, which are read-only views into the payload, and the metadata
+    """
+    (header_length,) = ARRAY_HEADER_LENGTH.unpack_from(payload)
+    offset = ARRAY_HEADER_LENGTH.size
+    header = json.loads(payload[offset : offset + header_length])
+    offset += header_length
+
+    arrays: dict[str, npt.NDArray[Any]] = {}
+    for name, dtype_str, shape in header["arrays"]:
+        dtype = np.dtype(dtype_str)
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(shape)
+        offset += count * dtype.itemsize
+    return arrays, header["meta"]
+
+
+@dataclass
+class Trajectory:
+    """
+    A fixed number of steps from each of a worker's envs, shaped (steps, envs, ...), as a rollout buffer stores them.
+
+    episode_starts[t] says whether observations[t] is the first of an episode. last_observations, last_values and
+    last_dones describe the state after the final step, for bootstrapping the returns.
+    """
+
+    # Fields shaped (envs, ...) rather than (steps, envs, ...)
+    PER_ENV_FIELDS = ("last_observations", "last_values", "last_dones")
+    # Fields with one entry per finished episode
+    EPISODE_FIELDS = ("episode_returns", "episode_lengths")
+    # Fields sent as bits when they hold only zeros and ones
+    BIT_FIELDS = ("observations", "last_observations", "action_masks")
+
+    # In the dtype of the env's observation space
+    observations: npt.NDArray[Any]
+    actions: npt.NDArray[np.int64]
+    rewards: npt.NDArray[np.float32]
+    episode_starts: npt.NDArray[np.bool_]
+    values: npt.NDArray[np.float32]
+    log_probs: npt.NDArray[np.float32]
+    action_masks: npt.NDArray[np.bool_]
+    last_observations: npt.NDArray[Any]
+    last_values: npt.NDArray[np.float32]
+    last_dones: npt.NDArray[np.bool_]
+    # Total reward and length of every episode that ended during the trajectory
+    episode_returns: npt.NDArray[np.float32]
+    episode_lengths: npt.NDArray[np.int64]
+    policy_version: int
+
+    @property
+    def num_envs(self) -> int:
+        return int(self.actions.shape[1])
+
+    def encode(self) -> bytes:
+        """
+        The trajectory as a TRAJECTORY payload.
+
+        Observation planes and action masks hold only zeros and ones, so they are sent as bits. That makes float32
+        planes 32 times smaller and masks and uint8 planes 8 times, and together they are nearly all of the data.
+        Observations the env already packed into bytes are sent as they are.
+        """
+        arrays = {f.name: getattr(self, f.name) for f in fields(self) if f.name != "policy_version"}
+        packed: dict[str, Any] = {}
+        for name in self.BIT_FIELDS:
+            array = arrays[name]
+            if array.dtype == np.bool_ or np.all((array == 0) | (array == 1)):
+                packed[name] = [array.dtype.str, list(array.shape)]
+                arrays[name] = np.packbits(array != 0)
+        return pack_arrays(arrays, {"policy_version": self.policy_version, "packed": packed})
+
+    @classmethod
+    def decode(cls, payload: bytes) -> "Trajectory":
+        arrays, meta = unpack_arrays(payload)
+        for name, (dtype, shape) in meta["packed"].items():
+            arrays[name] = np.unpackbits(arrays[name], count=int(np.prod(shape))).reshape(shape).astype(dtype)
+        return cls(**arrays, policy_version=int(meta["policy_version"]))
+
+    @classmethod
+    def concatenate(cls, trajectories: list["Trajectory"]) -> "Trajectory":
+        """Join trajectories of the same length along the env axis, in order."""
+        joined: dict[str, Any] = {}
+        for f in fields(cls):
+            values = [getattr(t, f.name) for t in trajectories]
+            if f.name == "policy_version":
+                joined[f.name] = min(values)
+            elif f.name in cls.PER_ENV_FIELDS or f.name in cls.EPISODE_FIELDS:
+                joined[f.name] = np.concatenate(values)
+            else:
+                joined[f.name] = np.concatenate(values, axis=1)
+        return cls(**joined)
+
+    def split(self, envs: int) -> tuple["Trajectory", "Trajectory"]:
+        """The first envs envs and the rest. Episodes that ended are counted with the first part."""
+        first: dict[str, Any] = {}
+        rest: dict[str, Any] = {}
+        for f in fields(self):
+            value = getattr(self, f.name)
+            if f.name == "policy_version":
+                first[f.name] = rest[f.name] = value
+            elif f.name in self.EPISODE_FIELDS:
+                first[f.name], rest[f.name] = value, value[:0]
+            elif f.name in self.PER_ENV_FIELDS:
+                first[f.name], rest[f.name] = value[:envs], value[envs:]
+            else:
+                first[f.name], rest[f.name] = value[:, :envs], value[:, envs:]
+        return Trajectory(**first), Trajectory(**rest)
@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import pickle
+import queue
+import socket
+import threading
+import time
+from glob import glob
+from typing import Any
+
+import numpy as np
+import torch as th
+from sb3_contrib.common.maskable.policies import MaskableActorCriticPolicy
+from stable_baselines3.common.utils import obs_as_tensor
+
+from backend.civenv import CivEnv, ObservationMode
+from backend.distributed.protocol import (
+    Connection,
+    MessageType,
+    ProtocolError,
+    Trajectory,
+    parse_address,
+    unpack_arrays,
+)
+from backend.logger import setup_logger
+from backend.utils import load_map_from_json
+
+logger = setup_logger(__name__)
+
+
+class RolloutWorker:
+    """
+    Runs CivEnvs for a learner on the other end of a connection.
+
+    The learner sends the policy setup once, then weights and collection requests. Each request is answered with a
+    Trajectory of the requested length from every env. Envs carry on where they stopped between requests, the way a
+    VecEnv does between rollouts, and episodes that end are reset right away.
+
+    Messages are read by a background thread as they arrive, so the learner can send new weights while a trajectory is
+    being collected. They are loaded before the next one starts, and only the latest weights received are kept.
+    """
+
+    connection: Connection
+    num_envs: int
+    envs: list[CivEnv]
+    policy: MaskableActorCriticPolicy | None
+    policy_version: int
+
+    def __init__(self, connection: Connection, num_envs: int):
+        self.connection = connection
+        self.num_envs = num_envs
+        self.envs = []
+        self.policy = None
+        self.policy_version = -1
+
+        self._observations = np.empty(0, dtype=np.float32)
+        self._episode_starts = np.ones(num_envs, dtype=bool)
+        self._episode_returns = np.zeros(num_envs)
+        self._episode_lengths = np.zeros(num_envs, dtype=np.int64)
+
+        # Steps asked for by each collection request not served yet, or None once the learner is gone
+        self._requests: queue.Queue[int | None] = queue.Queue()
+        self._pending_weights: bytes | None = None
+        self._weights_lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def run(self) -> None:
+        """Serve the learner until it sends CLOSE or disconnects."""
+        self.connection.send_json(MessageType.HELLO, {"envs": self.num_envs})
+        self._setup(pickle.loads(self.connection.expect(MessageType.SETUP)))
+        threading.Thread(target=self._receive, daemon=True).start()
+
+        while (steps := self._requests.get()) is not None and not self._closed.is_set():
+            self._load_pending_weights()
+            try:
+                self.connection.send(MessageType.TRAJECTORY, self.collect(steps).encode())
+            except OSError:
+                break
+        logger.info("The learner closed the connection")
+
+    def _receive(self) -> None:
+        try:
+            while True:
+                kind, payload = self.connection.receive()
+                if kind is MessageType.WEIGHTS:
+                    with self._weights_lock:
+                        self._pending_weights = payload
+                elif kind is MessageType.COLLECT:
+                    self._requests.put(int(json.loads(payload)["steps"]))
+                elif kind is MessageType.CLOSE:
+                    break
+                else:
+                    logger.warning(f"Ignoring unexpected {kind.name} message")
+        except (OSError, ProtocolError):
+            pass
+        finally:
+            self._closed.set()
+            self._requests.put(None)
+
+    def _setup(self, setup: dict[str, Any]) -> None:
+        template_maps = [load_map_from_json(path) for path in sorted(glob(setup["map_glob"]))]
+        observation_mode = ObservationMode(setup["observation_mode"])
+        self.envs = [CivEnv(template_maps, observation_mode, setup["max_cities"]) for _ in range(self.num_envs)]
+        self._observations = np.stack([env.reset(seed=setup["seed"] + i)[0] for i, env in enumerate(self.envs)])
+
+        env = self.envs[0]
+        self.policy = setup["policy_class"](
+            env.observation_space, env.action_space, lambda _: 0.0, **setup["policy_kwargs"]
+        )
+        self.policy.set_training_mode(False)
+
+    def _load_pending_weights(self) -> None:
+        with self._weights_lock:
+            payload, self._pending_weights = self._pending_weights, None
+        if payload is None:
+            return
+        assert self.policy is not None, "SETUP must come before WEIGHTS"
+        arrays, meta = unpack_arrays(payload)
+        self.policy.load_state_dict({name: th.from_numpy(array.copy()) for name, array in arrays.items()})
+        self.policy_version = int(meta["version"])
+
+    def collect(self, steps: int) -> Trajectory:
+        """Step every env steps times with the current policy, the way MaskablePPO.collect_rollouts() does."""
+        assert self.policy is not None, "SETUP must come before COLLECT"
+        n = self.num_envs
+        n_actions = int(self.envs[0].action_space.n)  # type: ignore[attr-defined]
+        observations = np.empty((steps, n, *self._observations.shape[1:]), dtype=self._observations.dtype)
+        actions = np.empty((steps, n), dtype=np.int64)
+        rewards = np.empty((steps, n), dtype=np.float32)
+        episode_starts = np.empty((steps, n), dtype=bool)
+        values = np.empty((steps, n), dtype=np.float32)
+        log_probs = np.empty((steps, n), dtype=np.float32)
+        action_masks = np.empty((steps, n, n_actions), dtype=bool)
+        finished_returns: list[float] = []
+        finished_lengths: list[int] = []
+        dones = np.zeros(n, dtype=bool)
+
+        for t in range(steps):
+            masks = np.stack([env.action_mask() for env in self.envs])
+            with th.no_grad():
+                step_actions, step_values, step_log_probs = self.policy(
+                    obs_as_tensor(self._observations, self.policy.device), action_masks=masks
+                )
+
+            observations[t] = self._observations
+            actions[t] = step_actions.cpu().numpy()
+            episode_starts[t] = self._episode_starts
+            values[t] = step_values.cpu().numpy().reshape(-1)
+            log_probs[t] = step_log_probs.cpu().numpy()
+            action_masks[t] = masks
+
+            for i, env in enumerate(self.envs):
+                observation, reward, terminated, truncated, _ = env.step(int(actions[t, i]))
+                rewards[t, i] = reward
+                self._episode_returns[i] += reward
+                self._episode_lengths[i] += 1
+                dones[i] = terminated or truncated
+                if dones[i]:
+                    finished_returns.append(float(self._episode_returns[i]))
+                    finished_lengths.append(int(self._episode_lengths[i]))
+                    self._episode_returns[i] = 0.0
+                    self._episode_lengths[i] = 0
+                    observation, _ = env.reset()
+                self._observations[i] = observation
+            self._episode_starts = dones.copy()
+
+        with th.no_grad():
+            last_values = self.policy.predict_values(obs_as_tensor(self._observations, self.policy.device))
+
+        return Trajectory(
+            observations=observations,
+            actions=actions,
+            rewards=rewards,
+            episode_starts=episode_starts,
+            values=values,
+            log_probs=log_probs,
+            action_masks=action_masks,
+            last_observations=self._observations.copy(),
+            last_values=last_values.cpu().numpy().reshape(-1).astype(np.float32),
+            last_dones=dones,
+            episode_returns=np.array(finished_returns, dtype=np.float32),
+            episode_lengths=np.array(finished_lengths, dtype=np.int64),
+            policy_version=self.policy_version,
+        )
+
+
+def connect(address: str, timeout: float) -> Connection:
+    """
+    Connect to a learner, retrying until it is listening.
+
+    Raises:
+        ConnectionError: If the learner cannot be reached within timeout seconds
+    """
+    host, port = parse_address(address)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return Connection(socket.create_connection((host, port)))
+        except OSError as e:
+            if time.monotonic() > deadline:
+                raise ConnectionError(f"Could not reach the learner at {address}") from e
+            time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect CivEnv rollouts for a learner over TCP.")
+    parser.add_argument("--learner", required=True, help="host:port the learner listens on")
+    parser.add_argument("--envs", type=int, default=4, help="Envs stepped by this worker")
+    parser.add_argument("--threads", type=int, default=1, help="Torch threads for policy inference")
+    parser.add_argument("--core", type=int, help="Pin the worker to this core")
+    parser.add_argument("--connect-timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    if args.core is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {args.core})
+    th.set_num_threads(args.threads)
+    connection = connect(args.learner, args.connect_timeout)
+    try:
+        RolloutWorker(connection, args.envs).run()
+    finally:
+        connection.close()
@@ -0,0 +1,340 @@
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import statistics
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, cast
+
+import numpy as np
+import torch as th
+from sb3_contrib import MaskablePPO
+from sb3_contrib.common.maskable.distributions import MaskableCategoricalDistribution
+
+from backend.civenv import CivEnv, ObservationMode
+from backend.logger import setup_logger
+from backend.perf.benchmarks import environment_info
+from backend.utils import DEFAULT_MAP_GLOB, available_cores, load_map_from_json, load_templates
+from backend.yields.district_adjacency_rules import YieldType
+
+logger = setup_logger(__name__)
+
+# The model evaluated by this worker process, loaded by init_worker()
+MODEL: MaskablePPO | None = None
+
+# The timesteps in the names CheckpointCallback saves checkpoints under
+CHECKPOINT_TIMESTEPS = re.compile(r"_(\d+)_steps$")
+
+
+@dataclass
+class EpisodeResult:
+    # The map's path as given, and its index among all maps evaluated, since maps in different directories may share a
+    # file name
+    map: str
+    index: int
+    deterministic: bool
+    steps: int
+    score: float
+    # The final get_score() summary, by yield
+    yields: dict[str, float]
+
+
+@dataclass
+class MapSummary:
+    """The results of one map: its deterministic episode, and the spread of its sampled ones."""
+
+    # The map's path as given
+    map: str
+    score: float
+    steps: int
+    yields: dict[str, float]
+    # None without sampled episodes
+    sampled_mean: float | None = None
+    sampled_std: float | None = None
+    sampled_min: float | None = None
+    sampled_max: float | None = None
+    sampled_steps: float | None = None
+
+    @classmethod
+    def of(cls, episodes: list[EpisodeResult]) -> "MapSummary":
+        deterministic = next(episode for episode in episodes if episode.deterministic)
+        summary = cls(deterministic.map, deterministic.score, deterministic.steps, deterministic.yields)
+        sampled = [episode for episode in episodes if not episode.deterministic]
+        if sampled:
+            scores = [episode.score for episode in sampled]
+            summary.sampled_mean = statistics.mean(scores)
+            summary.sampled_std = statistics.pstdev(scores)
+            summary.sampled_min = min(scores)
+            summary.sampled_max = max(scores)
+            summary.sampled_steps = statistics.mean(episode.steps for episode in sampled)
+        return summary
+
+
+def init_worker(model_path: str) -> None:
+    """Load the model once per worker process, with torch on a single thread since every core has a worker."""
+    global MODEL
+    th.set_num_threads(1)
+    MODEL = MaskablePPO.load(model_path, device="cpu")
+
+
+def play_maps(
+    map_paths: list[str], indices: list[int], sampled: int, max_cities: int, seed: int
+) -> list[EpisodeResult]:
+    """
+    Play a deterministic episode and sampled ones on every map, all of them at once.
+
+    The episodes still running are stepped together, with a single forward pass per step for all of them. Sampled
+    episodes draw their actions from their own generator, seeded by the map's index among all maps evaluated and the
+    episode's number, so the results do not depend on how the maps were spread over the workers.
+
+    Args:
+        map_paths: The maps to play
+        indices: Index of each map among all maps evaluated
+        sampled: Sampled episodes per map
+        max_cities: Cities an episode may found, as in training
+        seed: Seed of the sampled episodes
+
+    Returns:
+        The result of every episode
+    """
+    assert MODEL is not None, "init_worker() loads the model"
+    policy = MODEL.policy
+    observation_mode = ObservationMode.of_space(MODEL.observation_space)
+
+    envs: list[CivEnv] = []
+    # The map path and index of every episode
+    maps: list[tuple[str, int]] = []
+    # None for deterministic episodes
+    generators: list[np.random.Generator | None] = []
+    for path, index in zip(map_paths, indices):
+        civ_map = load_map_from_json(path)
+        for episode in range(1 + sampled):
+            envs.append(CivEnv([civ_map], observation_mode, max_cities))
+            maps.append((path, index))
+            generators.append(np.random.default_rng([seed, index, episode]) if episode else None)
+
+    observations = [env.reset()[0] for env in envs]
+    steps = [0] * len(envs)
+    running = list(range(len(envs)))
+    while running:
+        masks = np.stack([envs[i].action_mask() for i in running])
+        with th.no_grad():
+            obs_tensor, _ = policy.obs_to_tensor(np.stack([observations[i] for i in running]))
+            distribution = policy.get_distribution(obs_tensor, action_masks=masks)
+            probs = cast(MaskableCategoricalDistribution, distribution).distribution.probs.cpu().numpy()
+
+        still_running = []
+        for i, row in zip(running, probs):
+            generator = generators[i]
+            if generator is None:
+                action = int(row.argmax())
+            else:
+                # Illegal actions have a probability of 0, so they never hold the first cumulative sum above the draw
+                cumulative = np.cumsum(row, dtype=np.float64)
+                action = int(np.searchsorted(cumulative, generator.random() * cumulative[-1], side="right"))
+            observations[i], _, terminated, truncated, _ = envs[i].step(action)
+            steps[i] += 1
+            if not (terminated or truncated):
+                still_running.append(i)
+        running = still_running
+
+    results = []
+    for env, (path, index), generator, episode_steps in zip(envs, maps, generators, steps):
+        score = env.get_cached_score_result()
+        results.append(
+            EpisodeResult(
+                map=path,
+                index=index,
+                deterministic=generator is None,
+                steps=episode_steps,
+                score=env.get_cached_score(),
+                yields={
+                    yield_type.name.lower(): float(value)
+                    for yield_type, value in score.summary.items()
+                    if yield_type is not YieldType.NONE
+                },
+            )
+        )
+    return results
+
+
+def evaluate(
+    model_path: Path, map_paths: list[Path], sampled: int, workers: int, max_cities: int = 1, seed: int = 0
+) -> tuple[list[MapSummary], dict[str, Any]]:
+    """
+    Evaluate a model on every map, with the maps spread over a pool of worker processes.
+
+    Returns:
+        The summary of every map in the order given, and the run's totals and throughput
+    """
+    workers = max(1, min(workers, len(map_paths)))
+    chunks = [list(range(len(map_paths)))[worker::workers] for worker in range(workers)]
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(str(model_path),),
+    ) as pool:
+        # Start every worker and load its model before timing
+        for future in [pool.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+
+        start = time.perf_counter()
+        futures = [
+            pool.submit(play_maps, [str(map_paths[i]) for i in chunk], chunk, sampled, max_cities, seed)
+            for chunk in chunks
+        ]
+        outcomes = [future.result() for future in futures]
+        seconds = time.perf_counter() - start
+
+    by_map: list[list[EpisodeResult]] = [[] for _ in map_paths]
+    for results in outcomes:
+        for result in results:
+            by_map[result.index].append(result)
+    summaries = [MapSummary.of(episodes) for episodes in by_map]
+
+    episodes = len(map_paths) * (1 + sampled)
+    totals = {
+        "episodes": episodes,
+        "steps": sum(result.steps for results in outcomes for result in results),
+        "seconds": seconds,
+        "episodes_per_second": episodes / seconds,
+        "mean_score": statistics.mean(summary.score for summary in summaries),
+        "mean_sampled_score": (
+            statistics.mean(cast(float, summary.sampled_mean) for summary in summaries) if sampled else None
+        ),
+    }
+    return summaries, totals
+
+
+def compare(summaries: list[MapSummary], baseline: dict[str, Any]) -> None:
+    """Log the change of each map's scores against a results file saved earlier."""
+    previous = {entry["map"]: entry for entry in baseline["maps"]}
+    for summary in summaries:
+        if summary.map not in previous:
+            continue
+        line = f"{Path(summary.map).name:<28} {summary.score - previous[summary.map]['score']:>+8.1f}"
+        if summary.sampled_mean is not None and previous[summary.map]["sampled_mean"] is not None:
+            line += f" {summary.sampled_mean - previous[summary.map]['sampled_mean']:>+8.1f} sampled"
+        logger.info(line)
+
+
+def watch_checkpoints(
+    checkpoint_dir: Path,
+    map_paths: list[Path],
+    results_path: Path,
+    sampled: int,
+    workers: int,
+    max_cities: int = 1,
+    seed: int = 0,
+    poll_seconds: float = 10.0,
+) -> None:
+    """
+    Evaluate every checkpoint saved to checkpoint_dir from now on, appending a JSON line per checkpoint to results_path.
+
+    Checkpoints are evaluated oldest first, once fully written. Runs until interrupted, or until the process that
+    started it exits, so a training run that dies does not leave it behind.
+    """
+    started = time.time()
+    parent = os.getppid()
+    evaluated: set[Path] = set()
+    while os.getppid() == parent:
+        # Zip files end with their directory, so a checkpoint still being saved is not a zip file yet
+        pending = sorted(
+            (
+                path
+                for path in checkpoint_dir.glob("*.zip")
+                if path not in evaluated and path.stat().st_mtime >= started and zipfile.is_zipfile(path)
+            ),
+            key=lambda path: path.stat().st_mtime,
+        )
+        if not pending:
+            time.sleep(poll_seconds)
+            continue
+
+        checkpoint = pending[0]
+        evaluated.add(checkpoint)
+        try:
+            summaries, totals = evaluate(checkpoint, map_paths, sampled, workers, max_cities, seed)
+        except Exception as e:
+            logger.error(f"Failed to evaluate {checkpoint}: {e}")
+            continue
+
+        match = CHECKPOINT_TIMESTEPS.search(checkpoint.stem)
+        record = {
+            "checkpoint": checkpoint.name,
+            "timesteps": int(match.group(1)) if match else None,
+            **totals,
+            "scores": {summary.map: summary.score for summary in summaries},
+        }
+        with results_path.open("a") as f:
+            f.write(json.dumps(record) + "\n")
+        logger.info(f"{checkpoint.name}: mean score {totals['mean_score']:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate a saved agent on every map template.")
+    parser.add_argument("model", type=Path, nargs="?", help="Saved MaskablePPO model, like agents/civ_agent_v1.0.zip")
+    parser.add_argument(
+        "--watch", type=Path, help="Instead of a model, evaluate each checkpoint saved to this directory from now on"
+    )
+    parser.add_argument("--maps", default=DEFAULT_MAP_GLOB, help="Glob of the maps to play")
+    parser.add_argument("--sampled", type=int, default=8, help="Episodes per map with sampled actions")
+    parser.add_argument("--workers", type=int, default=available_cores(), help="Worker processes")
+    parser.add_argument("--max-cities", type=int, default=1, help="Cities an episode may found, as in training")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", type=Path, help="Save the results to this JSON file, or with --watch, append a line per checkpoint"
+    )
+    parser.add_argument("--baseline", type=Path, help="Compare against results saved earlier with --output")
+    args = parser.parse_args()
+    if (args.model is None) == (args.watch is None):
+        parser.error("give either a model or --watch")
+
+    if args.watch is not None:
+        # Below training in priority, for the processes this starts too
+        if hasattr(os, "nice"):
+            os.nice(10)
+        watch_checkpoints(
+            args.watch,
+            load_templates(args.maps),
+            args.output or args.watch / "evaluations.jsonl",
+            args.sampled,
+            args.workers,
+            args.max_cities,
+            args.seed,
+        )
+    else:
+        summaries, totals = evaluate(
+            args.model, load_templates(args.maps), args.sampled, args.workers, args.max_cities, args.seed
+        )
+        for summary in summaries:
+            line = f"{Path(summary.map).name:<28} {summary.score:>8.1f} in {summary.steps:>3} steps"
+            if summary.sampled_mean is not None:
+                line += f", sampled {summary.sampled_mean:>8.1f} ± {summary.sampled_std:.1f}"
+            logger.info(line)
+        logger.info(
+            f"{totals['episodes']} episodes, {totals['steps']} steps in {totals['seconds']:.2f}s "
+            f"({totals['episodes_per_second']:,.1f} episodes/s), mean score {totals['mean_score']:.1f}"
+        )
+
+        if args.output is not None:
+            settings = {"sampled": args.sampled, "max_cities": args.max_cities, "seed": args.seed}
+            report = {
+                "environment": environment_info(),
+                "model": str(args.model),
+                "settings": settings,
+                **totals,
+                "maps": [asdict(summary) for summary in summaries],
+            }
+            args.output.write_text(json.dumps(report, indent=2))
+            logger.info(f"Saved results to {args.output}")
+
+        if args.baseline is not None:
+            compare(summaries, json.loads(args.baseline.read_text()))
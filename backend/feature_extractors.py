@@ -0,0 +1,80 @@
+import math
+
+import gymnasium as gym
+import torch as th
+from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
+
+from backend.civenv import OBSERVATION_CHANNELS, TILE_CATEGORIES, TILE_FLAGS
+from backend.models.hex_topology import map_topology, radius_for_tile_count
+
+
+class PackedPlanesExtractor(BaseFeaturesExtractor):
+    """
+    Unpacks ObservationMode.PACKED observations into the flat zeros and ones FlattenExtractor gives for float ones.
+
+    The rest of the policy is the same as with float observations, while rollout buffers and messages between
+    processes hold a single bit per plane cell. Bits are only expanded to floats here, a minibatch at a time.
+    """
+
+    def __init__(self, observation_space: gym.spaces.Box, planes: int | None = None):
+        if planes is None:
+            # Square planes of OBSERVATION_CHANNELS channels, padded to whole bytes
+            side = round(math.sqrt(observation_space.shape[0] * 8 / OBSERVATION_CHANNELS))
+            planes = OBSERVATION_CHANNELS * side**2
+        super().__init__(observation_space, features_dim=planes)
+        self.bit_values: th.Tensor
+        self.register_buffer("bit_values", th.tensor([128, 64, 32, 16, 8, 4, 2, 1], dtype=th.uint8), persistent=False)
+
+    def forward(self, observations: th.Tensor) -> th.Tensor:
+        # SB3 hands the packed bytes over as floats
+        packed = observations.to(th.uint8).unsqueeze(-1)
+        bits = packed.bitwise_and(self.bit_values).ne(0).flatten(1)
+        return bits[:, : self.features_dim].float()
+
+
+class TileEmbeddingExtractor(BaseFeaturesExtractor):
+    """
+    Reads ObservationMode.TILES observations: embeds each tile's categories, then mixes every tile with its neighbors.
+
+    Each round of message passing adds the sum of a tile's neighbors' features to its own, through separate weights,
+    so after rounds rounds a tile's features depend on every tile within that many steps. The features of all tiles
+    are concatenated in the order of the observation's rows, which is also the order of the tiles in the actions.
+
+    Args:
+        neighbors: Rows of each row's neighbors, len(neighbors) where there is none, like CivEnv.tile_neighbors. By
+            default those of a map with as many tiles as the observations have rows, in the order maps store them.
+    """
+
+    def __init__(
+        self,
+        observation_space: gym.spaces.Box,
+        neighbors: list[list[int]] | None = None,
+        embedding_dim: int = 8,
+        hidden_dim: int = 32,
+        rounds: int = 2,
+    ):
+        if neighbors is None:
+            neighbors = map_topology(radius_for_tile_count(observation_space.shape[0])).neighbors.tolist()
+        assert observation_space.shape == (len(neighbors), len(TILE_CATEGORIES) + TILE_FLAGS)
+        super().__init__(observation_space, features_dim=len(neighbors) * hidden_dim)
+        self.neighbors: th.Tensor
+        self.register_buffer("neighbors", th.tensor(neighbors, dtype=th.long), persistent=False)
+
+        self.embeddings = th.nn.ModuleList(th.nn.Embedding(count, embedding_dim) for count in TILE_CATEGORIES)
+        self.input = th.nn.Linear(len(TILE_CATEGORIES) * embedding_dim + TILE_FLAGS, hidden_dim)
+        self.own = th.nn.ModuleList(th.nn.Linear(hidden_dim, hidden_dim) for _ in range(rounds))
+        self.around = th.nn.ModuleList(th.nn.Linear(hidden_dim, hidden_dim, bias=False) for _ in range(rounds))
+
+    def forward(self, observations: th.Tensor) -> th.Tensor:
+        # SB3 hands the indices over as floats
+        categories = observations[..., : len(TILE_CATEGORIES)].long()
+        embedded = [embedding(categories[..., i]) for i, embedding in enumerate(self.embeddings)]
+        flags = observations[..., len(TILE_CATEGORIES) :]
+        features = th.relu(self.input(th.cat([*embedded, flags], dim=-1)))
+
+        for own, around in zip(self.own, self.around):
+            # A row of zeros for the neighbors off the map
+            padded = th.nn.functional.pad(features, (0, 0, 0, 1))
+            neighbor_sum = padded[:, self.neighbors].sum(dim=2)
+            features = th.relu(own(features) + around(neighbor_sum))
+        return features.flatten(1)
@@ -1,81 +1,146 @@
-import math
+import os
+import time
+from contextlib import asynccontextmanager
+from enum import Enum
 from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable
 
-from fastapi import FastAPI
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
-from sb3_contrib import MaskablePPO
 
-from backend.yields.yield_logic import get_score
-
-from .civenv import CivEnv
-from .data_transfer.dto_converters import (
-    convert_dto_grid_to_grid,
-    convert_dto_grid_to_map,
-    convert_grid_to_dto,
-)
 from .data_transfer.tile_string import TileString
-from .utils import enum_to_str, yield_dict_to_string
+from .logger import setup_logger
+from .serving import scoring_handlers
+from .serving.dispatch import route_of, run_in_pool
+from .serving.metrics import CONTENT_TYPE, ServerMetrics
+from .serving.response_cache import ResponseCache
+from .serving.scheduler import Lane
+from .serving.worker_pool import PoolConfig, WorkerPool
 
-app = FastAPI()
+logger = setup_logger(__name__)
 
 BASE_DIR = Path(__file__).resolve().parent
 
-app.mount(
-    "/static",
-    StaticFiles(directory=BASE_DIR.parent / "static"),
-    name="static",
-)
-
-
-@app.get("/", response_class=FileResponse)
-async def read_index() -> FileResponse:
-    index_path = BASE_DIR.parent / "index.html"
-    return FileResponse(index_path)
-
-
-MODEL_PATH = BASE_DIR.parent / "agents" / "civ_agent_v1.0"
-MODEL: MaskablePPO | None = None
 
+class ServiceMode(str, Enum):
+    """Which endpoints a server runs, set with CIV_SERVICE_MODE."""
 
-def get_model() -> MaskablePPO:
-    global MODEL
-    if MODEL is None:
-        MODEL = MaskablePPO.load(MODEL_PATH)
-    return MODEL
+    # Scoring, planning and agent inference
+    FULL = "full"
+    # /calculate only. Neither the server nor its workers import the environment, the planners or any ML library.
+    SCORING = "scoring"
 
 
-@app.post("/analyze-map", response_model=dict[str, TileString])
-async def analyze_map(grid: dict[str, TileString]) -> dict[str, TileString]:
-    model = get_model()
+router = APIRouter()
 
-    # eval_env = CivEnv([convert_dto_grid_to_grid(grid)])
-    eval_env = CivEnv([convert_dto_grid_to_map(grid)])
-    obs, _ = eval_env.reset()
 
-    terminated = False
-    truncated = False
-
-    while not (terminated or truncated):
-        action_masks = eval_env.action_mask()
-        action, _states = model.predict(obs, action_masks=action_masks, deterministic=True)
-        obs, reward, terminated, truncated, info = eval_env.step(action)
-
-    return convert_grid_to_dto(eval_env.current_civ_map.tiles)
-
-
-@app.post("/calculate", response_model=dict[str, dict[str, int] | dict[str, dict[str, float]]])
-async def calculate_score(grid: dict[str, TileString]) -> dict[str, dict[str, int] | dict[str, dict[str, float]]]:
-    score = get_score(convert_dto_grid_to_grid(grid))
-    summary_out: dict[str, int] = {}
-    for yield_type, value in score.summary.items():
-        summary_out[enum_to_str(yield_type)] = math.floor(value)
+@router.get("/", response_class=FileResponse)
+async def read_index() -> FileResponse:
+    index_path = BASE_DIR.parent / "index.html"
+    return FileResponse(index_path)
 
-    tiles_out: dict[str, dict[str, float]] = {}
-    for tile_key, info in score.tiles.items():
-        tiles_out[tile_key] = yield_dict_to_string(info, floor_values=True)
 
-    return {
-        "summary": summary_out,
-        "tiles": tiles_out,
-    }
+@router.get("/scheduler-stats")
+async def scheduler_stats(request: Request) -> dict[str, dict[str, int | float]]:
+    pool: WorkerPool = request.app.state.pool
+    return pool.scheduler.snapshot()
+
+
+@router.get("/metrics")
+async def read_metrics(request: Request) -> Response:
+    """Request latencies, per-stage times, planner work, queue depths and model load time, for Prometheus."""
+    metrics: ServerMetrics = request.app.state.metrics
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
+
+@router.post("/calculate", response_model=dict[str, dict[str, int] | dict[str, dict[str, float]]])
+async def calculate_score(request: Request, grid: dict[str, TileString]) -> Response:
+    score, _ = await run_in_pool(request, Lane.SCORING, scoring_handlers.calculate_score, grid)
+    return JSONResponse(score)
+
+
+@router.post("/improvement-legality", response_model=dict[str, list[str] | dict[str, list[bool]]])
+async def improvement_legality(request: Request, grid: dict[str, TileString]) -> Response:
+    """Every improvement's legality on every tile, so the editor can check placements without a request per click."""
+    legality, _ = await run_in_pool(request, Lane.SCORING, scoring_handlers.improvement_legality, grid)
+    return JSONResponse(legality)
+
+
+@router.post("/district-legality", response_model=dict[str, list[str] | dict[str, str]])
+async def district_legality(request: Request, grid: dict[str, TileString]) -> Response:
+    """
+    Every district's legality on every tile, as a base64 bitset per district in the order of the returned tiles.
+
+    Responses are cached by a hash of the request body, so an editor asking again about an unchanged map is answered
+    without going to a worker.
+    """
+    cache: ResponseCache = request.app.state.legality_cache
+    metrics: ServerMetrics = request.app.state.metrics
+    key = cache.key(await request.body())
+    content = cache.get(key)
+    if content is not None:
+        metrics.cache_lookups.inc(route=route_of(request), outcome="hit")
+        return Response(content=content, media_type="application/json")
+
+    metrics.cache_lookups.inc(route=route_of(request), outcome="miss")
+    legality, _ = await run_in_pool(request, Lane.SCORING, scoring_handlers.district_legality, grid)
+    response = JSONResponse(legality)
+    cache.put(key, bytes(response.body))
+    return response
+
+
+async def record_latency(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    start = time.perf_counter()
+    request.state.received_at = start
+    response = await call_next(request)
+    metrics: ServerMetrics = request.app.state.metrics
+    metrics.request_seconds.observe(
+        time.perf_counter() - start,
+        method=request.method,
+        route=route_of(request),
+        status=str(response.status_code),
+    )
+    return response
+
+
+def create_app(mode: ServiceMode = ServiceMode.FULL) -> FastAPI:
+    """
+    Build the server for the given mode, with its own worker pool, started and stopped with the app.
+
+    A scoring-only app imports the planning endpoints and handlers not at all, and its workers only load what scoring
+    needs, so it starts faster and each replica takes a fraction of the memory.
+    """
+    if mode is ServiceMode.FULL:
+        from .serving import handlers, inference_routes
+
+        pool = WorkerPool(PoolConfig.from_env(), handlers.init_worker)
+    else:
+        pool = WorkerPool(PoolConfig.from_env(inference=False), scoring_handlers.init_scoring_worker)
+
+    @asynccontextmanager
+    async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+        pool.start()
+        yield
+        pool.shutdown()
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.pool = pool
+    app.state.metrics = ServerMetrics(pool.scheduler)
+    # Legality responses for this many recent maps
+    app.state.legality_cache = ResponseCache(int(os.getenv("CIV_LEGALITY_CACHE", 256)))
+    app.middleware("http")(record_latency)
+
+    app.mount(
+        "/static",
+        StaticFiles(directory=BASE_DIR.parent / "static"),
+        name="static",
+    )
+    app.include_router(router)
+    if mode is ServiceMode.FULL:
+        app.include_router(inference_routes.router)
+    logger.info(f"Serving in {mode.value} mode")
+    return app
+
+
+app = create_app(ServiceMode(os.getenv("CIV_SERVICE_MODE", ServiceMode.FULL.value)))
@@ -1,21 +1,24 @@
+"""
+The map, tile and city model the environment, scoring and validation run on.
+
+These are plain slotted dataclasses: attribute access and assignment cost no more than on any Python object, and a
+tile takes a fraction of the memory of a pydantic model. Input is validated where it enters, as TileString for the API
+and TileRecord for map files, and converted to and from these at that boundary only.
+"""
+
 from __future__ import annotations
 
-from pydantic import BaseModel, Field
+from dataclasses import dataclass, field
 
-from backend.models.int_enums import (
-    District,
-    Feature,
-    Improvement,
-    Resource,
-    ResourceType,
-    Terrain,
-)
+from backend.models.hex_topology import EDGE_INDEX, Coordinate, disk_coordinates, hex_keys, neighbor_coordinates
+from backend.models.int_enums import District, Feature, Improvement, Resource, ResourceType, Terrain
 
-Coordinate = tuple[int, int]
-NEIGHBOR_OFFSETS = [(0, 1), (1, 0), (1, -1), (0, -1), (-1, 0), (-1, 1)]
+# Tiles this far from a city center can belong to the city
+CITY_RADIUS = 3
 
 
-class Tile(BaseModel):
+@dataclass(slots=True, eq=False)
+class Tile:
     q: int
     r: int
     terrain: Terrain
@@ -29,68 +32,65 @@ class Tile(BaseModel):
     improvement: Improvement
     rivers: list[bool]
     withinCityLimits: bool
-    city: City | None = None
+    city: City | None = field(default=None, repr=False)
+
+    def copy(self) -> Tile:
+        """A copy outside of any city, for CivMap.copy() to put in the copied one."""
+        return Tile(
+            self.q,
+            self.r,
+            self.terrain,
+            self.hill,
+            self.mountain,
+            self.mountain_no,
+            self.feature,
+            self.district,
+            self.resource,
+            self.resourceType,
+            self.improvement,
+            list(self.rivers),
+            self.withinCityLimits,
+        )
 
     def get_neighbors(self, grid: dict[Coordinate, Tile]) -> list[Tile]:
-        neighbors = []
-
-        for dq, dr in NEIGHBOR_OFFSETS:
-            neighbor = grid.get((self.q + dq, self.r + dr))
-            if neighbor is None:
-                continue
-            neighbors.append(neighbor)
-
-        return neighbors
+        return [neighbor for key in neighbor_coordinates((self.q, self.r)) if (neighbor := grid.get(key)) is not None]
 
     def get_city_neighbors(self) -> list[Tile]:
         if self.city is None:
             return []
-        return [
-            self.city.tiles[(self.q + dx, self.r + dy)]
-            for dx, dy in NEIGHBOR_OFFSETS
-            if (self.q + dx, self.r + dy) in self.city.tiles
-        ]
+        return self.get_neighbors(self.city.tiles)
 
     def get_edge_index(self, neighbor: Tile) -> int:
-        dq = neighbor.q - self.q
-        dr = neighbor.r - self.r
-
-        if dq == 1 and dr == 0:
-            return 0
-        if dq == 0 and dr == 1:
-            return 1
-        if dq == -1 and dr == 1:
-            return 2
-        if dq == -1 and dr == 0:
-            return 3
-        if dq == 0 and dr == -1:
-            return 4
-        if dq == 1 and dr == -1:
-            return 5
-
-        return -1
-
-
-class City(BaseModel):
+        return EDGE_INDEX.get((neighbor.q - self.q, neighbor.r - self.r), -1)
+
+
+@dataclass(slots=True, eq=False)
+class City:
     id: int
     center_coords: Coordinate
-    tiles: dict[Coordinate, Tile] = Field(default_factory=dict)
-    districts_built: list[bool] = Field(default_factory=lambda: [False] * len(District))
+    tiles: dict[Coordinate, Tile] = field(default_factory=dict, repr=False)
+    districts_built: list[bool] = field(default_factory=lambda: [False] * len(District))
 
     def add_tiles_within_city_radius(
         self, grid: dict[Coordinate, Tile], q_city_center: int, r_city_center: int
-    ) -> None:
-        radius = 3
-        for q in range(-radius, radius + 1):
-            for r in range(-radius, radius + 1):
-                if abs(q + r) <= radius:
-                    tile = grid.get((q_city_center + q, r_city_center + r))
-                    if tile:
-                        tile.withinCityLimits = True
-                        self.tiles[(q_city_center + q, r_city_center + r)] = tile
-                        tile.city = self
-                        if tile.district != District.NONE:
-                            self.districts_built[tile.district.value] = True
+    ) -> list[Tile]:
+        """
+        Claim the tiles within CITY_RADIUS of the center. Tiles another city already claimed stay with it.
+
+        Returns:
+            The tiles claimed
+        """
+        claimed = []
+        for key in disk_coordinates((q_city_center, r_city_center), CITY_RADIUS):
+            tile = grid.get(key)
+            if tile and tile.city is None:
+                tile.withinCityLimits = True
+                self.tiles[key] = tile
+                tile.city = self
+                if tile.district != District.NONE:
+                    self.districts_built[tile.district.value] = True
+                claimed.append(tile)
+        return claimed
 
     def remove_tiles(self) -> None:
         for tile in self.tiles.values():
@@ -112,54 +112,81 @@ class City(BaseModel):
         self.districts_built[district.value] = True
 
 
-class CivMap(BaseModel):
-    cities: list[City] = Field(default_factory=list)
-    tiles: dict[Coordinate, Tile] = Field(default_factory=dict)
+@dataclass(slots=True, eq=False)
+class CivMap:
+    """
+    A hex map of the given radius around (0, 0), and the cities on it in the order they were founded.
+
+    Each tile's city is the only link from tiles to cities, so a placement only ever touches the city of its own tile,
+    and founding a city only the tiles within CITY_RADIUS of it.
+    """
+
+    cities: list[City] = field(default_factory=list)
+    tiles: dict[Coordinate, Tile] = field(default_factory=dict)
     radius: int = 4
 
+    def copy(self) -> CivMap:
+        """A copy sharing no mutable state with this map, like copy.deepcopy() at a fraction of the cost."""
+        tiles = {key: tile.copy() for key, tile in self.tiles.items()}
+        cities = []
+        for city in self.cities:
+            copied = City(
+                city.id, city.center_coords, {key: tiles[key] for key in city.tiles}, list(city.districts_built)
+            )
+            for tile in copied.tiles.values():
+                tile.city = copied
+            cities.append(copied)
+        return CivMap(cities, tiles, self.radius)
+
     def get_keys(self) -> list[Coordinate]:
         return list(self.tiles.keys())
 
     def get_tile(self, coordinate: Coordinate) -> Tile:
         return self.tiles[coordinate]
 
-    def make_city(self, coordinates: Coordinate, allow_overwrite: bool = False) -> None:
+    def make_city(self, coordinates: Coordinate, allow_overwrite: bool = False) -> City:
         """
-        Add a city at the given coordinates. Only allows a single city.
+        Found a city at the given coordinates. It claims the tiles around it that no earlier city has.
 
         Args:
             coordinates: The (q, r) coordinates for the city center
-            allow_overwrite: If True, replaces existing city. Used when loading maps.
-        """
-        if len(self.cities) > 0 and not allow_overwrite:
-            raise ValueError("Only one city is allowed per map")
+            allow_overwrite: If True, replaces the existing cities. Used when loading maps.
+
+        Raises:
+            ValueError: If the center already belongs to another city
 
-        # Remove existing city if overwriting
-        if allow_overwrite and len(self.cities) > 0:
-            self.cities[0].remove_tiles()
+        Returns:
+            The new city
+        """
+        if allow_overwrite:
+            for existing in self.cities:
+                existing.remove_tiles()
             self.cities.clear()
 
-        city = City(id=0, center_coords=coordinates)
+        center = self.tiles.get(coordinates)
+        if center is not None and center.city is not None:
+            raise ValueError(f"{coordinates} already belongs to city {center.city.id}")
+
+        city = City(id=len(self.cities), center_coords=coordinates)
         city.add_tiles_within_city_radius(self.tiles, coordinates[0], coordinates[1])
         self.cities.append(city)
+        return city
 
     def create_empty_map(self) -> None:
-        for q in range(-self.radius, self.radius + 1):
-            for r in range(-self.radius, self.radius + 1):
-                if abs(q + r) <= self.radius:
-                    self.tiles[(q, r)] = Tile(
-                        q=q,
-                        r=r,
-                        terrain=Terrain.GRASSLAND,
-                        hill=False,
-                        mountain=False,
-                        mountain_no=1,
-                        feature=Feature.NONE,
-                        district=District.NONE,
-                        resource=Resource.NONE,
-                        resourceType=ResourceType.NONE,
-                        improvement=Improvement.NONE,
-                        rivers=[False] * 6,
-                        withinCityLimits=False,
-                        city=None,
-                    )
+        for q, r in hex_keys(self.radius):
+            self.tiles[(q, r)] = Tile(
+                q=q,
+                r=r,
+                terrain=Terrain.GRASSLAND,
+                hill=False,
+                mountain=False,
+                mountain_no=1,
+                feature=Feature.NONE,
+                district=District.NONE,
+                resource=Resource.NONE,
+                resourceType=ResourceType.NONE,
+                improvement=Improvement.NONE,
+                rivers=[False] * 6,
+                withinCityLimits=False,
+                city=None,
+            )
@@ -0,0 +1,147 @@
+from collections.abc import Iterable
+from functools import lru_cache
+
+import numpy as np
+import numpy.typing as npt
+
+Coordinate = tuple[int, int]
+
+# Neighbor offsets in the order Tile.get_neighbors() returns them
+NEIGHBOR_OFFSETS = [(0, 1), (1, 0), (1, -1), (0, -1), (-1, 0), (-1, 1)]
+# Offset of the neighbor across each edge, in the order of Tile.rivers and Tile.get_edge_index()
+EDGE_OFFSETS = [(1, 0), (0, 1), (-1, 1), (-1, 0), (0, -1), (1, -1)]
+EDGE_INDEX = {offset: edge for edge, offset in enumerate(EDGE_OFFSETS)}
+# NEIGHBOR_SLOTS[edge]: position in NEIGHBOR_OFFSETS of the neighbor across the edge
+NEIGHBOR_SLOTS = [NEIGHBOR_OFFSETS.index(offset) for offset in EDGE_OFFSETS]
+
+
+def hex_keys(radius: int) -> list[Coordinate]:
+    """The coordinates of every tile within radius of the center, in the order maps store them."""
+    return [(q, r) for q in range(-radius, radius + 1) for r in range(-radius, radius + 1) if abs(q + r) <= radius]
+
+
+def neighbor_indices(keys: list[Coordinate]) -> list[list[int]]:
+    """
+    For each tile, the positions in keys of its neighbors, in NEIGHBOR_OFFSETS order.
+
+    Neighbors off the map get len(keys), so the table can index an array with one extra padding entry.
+    """
+    index = {key: i for i, key in enumerate(keys)}
+    return [[index.get((q + dq, r + dr), len(keys)) for dq, dr in NEIGHBOR_OFFSETS] for q, r in keys]
+
+
+def hex_distance(a: Coordinate, b: Coordinate) -> int:
+    return (abs(a[0] - b[0]) + abs(a[0] + a[1] - b[0] - b[1]) + abs(a[1] - b[1])) // 2
+
+
+def hex_radius(keys: Iterable[Coordinate]) -> int:
+    """The radius of the smallest map centered on (0, 0) holding every one of the tiles."""
+    return max((hex_distance(key, (0, 0)) for key in keys), default=0)
+
+
+def radius_for_tile_count(n_tiles: int) -> int:
+    """
+    The radius of the map with n_tiles tiles.
+
+    Raises:
+        ValueError: If no map has exactly that many tiles
+    """
+    radius = 0
+    while 3 * radius * (radius + 1) + 1 < n_tiles:
+        radius += 1
+    if 3 * radius * (radius + 1) + 1 != n_tiles:
+        raise ValueError(f"No hex map has exactly {n_tiles} tiles")
+    return radius
+
+
+# The coordinate caches are keyed by whatever tiles requests send, so they are bounded to stay small in a long-running
+# server. These sizes hold every tile of maps far larger than the templates.
+NEIGHBOR_CACHE_SIZE = 4096
+DISK_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=NEIGHBOR_CACHE_SIZE)
+def neighbor_coordinates(key: Coordinate) -> tuple[Coordinate, ...]:
+    """All six neighbors of a tile, on the map or not, in NEIGHBOR_OFFSETS order."""
+    q, r = key
+    return tuple((q + dq, r + dr) for dq, dr in NEIGHBOR_OFFSETS)
+
+
+@lru_cache(maxsize=DISK_CACHE_SIZE)
+def disk_coordinates(center: Coordinate, radius: int) -> tuple[Coordinate, ...]:
+    """Every tile within radius of center, on the map or not, in the order maps store them."""
+    q, r = center
+    return tuple((q + dq, r + dr) for dq, dr in _disk_offsets(radius))
+
+
+@lru_cache(maxsize=8)
+def _disk_offsets(radius: int) -> list[Coordinate]:
+    return hex_keys(radius)
+
+
+class HexTopology:
+    """
+    Index tables for a fixed set of hex tiles, so code working on arrays of them never redoes the geometry.
+
+    Tiles are numbered by their position in keys. Tables that can point off the map use n_tiles there, so they can
+    index an array with one extra padding entry. The tables are shared by every user of the same keys, and read-only.
+    """
+
+    keys: list[Coordinate]
+    index: dict[Coordinate, int]
+    n_tiles: int
+    # neighbors[i, slot]: the neighbor of tile i in NEIGHBOR_OFFSETS[slot]
+    neighbors: npt.NDArray[np.intp]
+    # edge_neighbors[i, edge]: the neighbor of tile i across the edge, as Tile.get_edge_index() numbers edges
+    edge_neighbors: npt.NDArray[np.intp]
+    # distances[i, j]: hex distance between tiles i and j
+    distances: npt.NDArray[np.int64]
+
+    def __init__(self, keys: list[Coordinate]):
+        self.keys = list(keys)
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        self.n_tiles = len(self.keys)
+
+        self.neighbors = np.array(neighbor_indices(self.keys), dtype=np.intp).reshape(self.n_tiles, 6)
+        self.edge_neighbors = self.neighbors[:, NEIGHBOR_SLOTS]
+
+        q, r = np.array(self.keys, dtype=np.int64).reshape(self.n_tiles, 2).T
+        self.distances = (
+            np.abs(q[:, None] - q[None, :])
+            + np.abs(r[:, None] - r[None, :])
+            + np.abs((q + r)[:, None] - (q + r)[None, :])
+        ) // 2
+
+        for table in (self.neighbors, self.edge_neighbors, self.distances):
+            table.setflags(write=False)
+        self._disk_masks: dict[int, npt.NDArray[np.bool_]] = {}
+        self._disks: dict[int, list[npt.NDArray[np.intp]]] = {}
+
+    def disk_mask(self, radius: int) -> npt.NDArray[np.bool_]:
+        """disk_mask(radius)[i, j]: whether tile j is within radius of tile i."""
+        if radius not in self._disk_masks:
+            mask = self.distances <= radius
+            mask.setflags(write=False)
+            self._disk_masks[radius] = mask
+        return self._disk_masks[radius]
+
+    def disk(self, center: int, radius: int) -> npt.NDArray[np.intp]:
+        """The tiles within radius of tile center, in index order."""
+        if radius not in self._disks:
+            self._disks[radius] = [np.flatnonzero(row) for row in self.disk_mask(radius)]
+        return self._disks[radius][center]
+
+
+@lru_cache(maxsize=16)
+def _topology(keys: tuple[Coordinate, ...]) -> HexTopology:
+    return HexTopology(list(keys))
+
+
+def hex_topology(keys: list[Coordinate]) -> HexTopology:
+    """The shared HexTopology of these tiles, built the first time they are seen."""
+    return _topology(tuple(keys))
+
+
+def map_topology(radius: int) -> HexTopology:
+    """The HexTopology of a map of this radius, with tiles in the order maps store them."""
+    return hex_topology(hex_keys(radius))
@@ -0,0 +1,321 @@
+import argparse
+import gc
+import itertools
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from backend.civenv import CivEnv
+from backend.data_transfer.dto_converters import (
+    convert_dto_grid_to_grid,
+    convert_dto_grid_to_map,
+    convert_grid_to_dto,
+)
+from backend.logger import setup_logger
+from backend.models.civmap import CivMap
+from backend.models.int_enums import District, Improvement
+from backend.placement.district_validation import can_place_district
+from backend.placement.improvement_validation import can_place_improvement
+from backend.utils import available_cores, load_map_from_json
+from backend.yields.district_adjacency_rules import DISTRICT_ADJACENCY_RULES
+from backend.yields.yield_logic import get_score, get_tile_score, run_adjacency_logic
+
+logger = setup_logger(__name__)
+
+MAPS_DIR = Path(__file__).resolve().parent.parent.parent / "maps"
+
+
+@dataclass
+class Benchmark:
+    """
+    One operation to time.
+
+    run is timed on its own. before, if given, runs untimed ahead of every call to run, to put the state back or pick
+    the next input, so only the operation itself is measured.
+    """
+
+    name: str
+    run: Callable[[], object]
+    before: Callable[[], object] | None = None
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    calls: int
+    ops_per_sec: float
+    median_us: float
+    min_us: float
+    # Highest traced memory in use during one call, above what was in use before it
+    peak_kib: float
+    # Traced memory still in use after one call, on average
+    retained_kib: float
+
+
+@dataclass
+class Fixtures:
+    templates: list[CivMap]
+    layouts: list[CivMap]
+    paths: list[Path]
+
+    @classmethod
+    def load(cls, maps_dir: Path = MAPS_DIR) -> "Fixtures":
+        """The map templates used for training, and the finished city layouts, which have districts to score."""
+        template_paths = sorted(maps_dir.glob("civ_test_map*.json"))
+        layout_paths = sorted(maps_dir.glob("final_city_layout*.json"))
+        return cls(
+            templates=[load_map_from_json(str(path)) for path in template_paths],
+            layouts=[load_map_from_json(str(path)) for path in layout_paths],
+            paths=template_paths + layout_paths,
+        )
+
+    @property
+    def maps(self) -> list[CivMap]:
+        return self.templates + self.layouts
+
+
+def cycle_inputs(inputs: list[Any]) -> Callable[[], Any]:
+    """A function returning the next of the inputs on every call, round robin."""
+    iterator: Iterator[Any] = itertools.cycle(inputs)
+    return lambda: next(iterator)
+
+
+def build_benchmarks(fixtures: Fixtures, seed: int = 0) -> list[Benchmark]:
+    rng = random.Random(seed)
+    grids = [civ_map.tiles for civ_map in fixtures.maps]
+    benchmarks: list[Benchmark] = []
+
+    next_grid = cycle_inputs(grids)
+    benchmarks.append(Benchmark("get_score", lambda: get_score(next_grid())))
+
+    adjacency_inputs = [
+        (tile, civ_map.tiles, DISTRICT_ADJACENCY_RULES[tile.district])
+        for civ_map in fixtures.layouts
+        for tile in civ_map.tiles.values()
+        if tile.district in DISTRICT_ADJACENCY_RULES
+    ]
+    if adjacency_inputs:
+        next_adjacency = cycle_inputs(adjacency_inputs)
+        benchmarks.append(Benchmark("run_adjacency_logic", lambda: run_adjacency_logic(*next_adjacency())))
+
+    next_tile = cycle_inputs([tile for grid in grids for tile in grid.values()])
+    benchmarks.append(Benchmark("get_tile_score", lambda: get_tile_score(next_tile())))
+
+    district_inputs = [
+        (district, civ_map.tiles, key)
+        for civ_map in fixtures.templates
+        for key in civ_map.tiles
+        for district in District
+        if district is not District.NONE
+    ]
+    rng.shuffle(district_inputs)
+    next_district = cycle_inputs(district_inputs)
+    benchmarks.append(Benchmark("can_place_district", lambda: can_place_district(*next_district())))
+
+    improvement_inputs = [
+        (tile, improvement)
+        for civ_map in fixtures.templates
+        for tile in civ_map.tiles.values()
+        for improvement in Improvement
+        if improvement is not Improvement.NONE
+    ]
+    rng.shuffle(improvement_inputs)
+    next_improvement = cycle_inputs(improvement_inputs)
+    benchmarks.append(Benchmark("can_place_improvement", lambda: can_place_improvement(*next_improvement())))
+
+    benchmarks += env_benchmarks(fixtures.templates, rng)
+
+    next_path = cycle_inputs([str(path) for path in fixtures.paths])
+    benchmarks.append(Benchmark("load_map_from_json", lambda: load_map_from_json(next_path())))
+
+    scored = [(civ_map.tiles, get_score(civ_map.tiles)) for civ_map in fixtures.maps]
+    next_scored = cycle_inputs(scored)
+    benchmarks.append(Benchmark("convert_grid_to_dto", lambda: convert_grid_to_dto(*next_scored())))
+
+    dtos = [convert_grid_to_dto(grid, score) for grid, score in scored]
+    next_dto = cycle_inputs(dtos)
+    benchmarks.append(Benchmark("convert_dto_grid_to_grid", lambda: convert_dto_grid_to_grid(next_dto())))
+    benchmarks.append(Benchmark("convert_dto_grid_to_map", lambda: convert_dto_grid_to_map(next_dto())))
+
+    return benchmarks
+
+
+def env_benchmarks(templates: list[CivMap], rng: random.Random) -> list[Benchmark]:
+    """
+    CivEnv operations, measured along random masked-action episodes like the ones seen in training.
+
+    Resets and action choices happen in the untimed part, so step() is timed on its own. The signature caches are
+    cleared before each action_mask() call, since in training almost every state is new.
+    """
+    env = CivEnv(templates)
+    env.reset(seed=rng.randrange(2**31))
+    pending = {"action": 0}
+
+    def next_step() -> None:
+        mask = env.action_mask()
+        if not mask.any():
+            env.reset()
+            mask = env.action_mask()
+        pending["action"] = rng.choice(mask.nonzero()[0].tolist())
+
+    def fresh_state() -> None:
+        next_step()
+        env.step(pending["action"])
+        env._action_mask_cache.clear()
+        env._tile_mask_cache.clear()
+
+    return [
+        Benchmark("CivEnv.reset", env.reset),
+        Benchmark("CivEnv.step", lambda: env.step(pending["action"]), before=next_step),
+        Benchmark("CivEnv.action_mask", env.action_mask, before=fresh_state),
+        Benchmark("CivEnv._get_obs", env._get_obs),
+    ]
+
+
+def time_benchmark(benchmark: Benchmark, min_time: float, repeat: int) -> tuple[int, list[float]]:
+    """
+    Time each call to run, repeat times over, each round lasting at least min_time seconds.
+
+    Returns:
+        The number of calls made, and the mean seconds per call of each round
+    """
+    calls = 0
+    rounds: list[float] = []
+    for _ in range(repeat):
+        elapsed = 0.0
+        round_calls = 0
+        deadline = time.perf_counter() + min_time
+        while time.perf_counter() < deadline or round_calls == 0:
+            if benchmark.before is not None:
+                benchmark.before()
+            start = time.perf_counter()
+            benchmark.run()
+            elapsed += time.perf_counter() - start
+            round_calls += 1
+        calls += round_calls
+        rounds.append(elapsed / round_calls)
+    return calls, rounds
+
+
+def measure_memory(benchmark: Benchmark, samples: int) -> tuple[float, float]:
+    """
+    Peak and retained traced memory of single calls, in KiB.
+
+    CPython keeps no count of allocations, so memory use is measured with tracemalloc instead, in a separate pass since
+    tracing slows every allocation down.
+    """
+    peaks: list[int] = []
+    retained: list[int] = []
+    tracemalloc.start()
+    try:
+        for _ in range(samples):
+            if benchmark.before is not None:
+                benchmark.before()
+            gc.collect()
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            benchmark.run()
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - baseline)
+            retained.append(current - baseline)
+    finally:
+        tracemalloc.stop()
+    return max(peaks) / 1024, statistics.mean(retained) / 1024
+
+
+def run_benchmarks(
+    benchmarks: list[Benchmark], min_time: float = 0.2, repeat: int = 5, memory_samples: int = 20
+) -> list[BenchmarkResult]:
+    results = []
+    for benchmark in benchmarks:
+        # One untimed call, so first-use costs like imports and cache misses are not counted
+        if benchmark.before is not None:
+            benchmark.before()
+        benchmark.run()
+
+        calls, rounds = time_benchmark(benchmark, min_time, repeat)
+        peak_kib, retained_kib = measure_memory(benchmark, memory_samples)
+        median = statistics.median(rounds)
+        results.append(
+            BenchmarkResult(
+                name=benchmark.name,
+                calls=calls,
+                ops_per_sec=1.0 / median,
+                median_us=median * 1e6,
+                min_us=min(rounds) * 1e6,
+                peak_kib=peak_kib,
+                retained_kib=retained_kib,
+            )
+        )
+        logger.info(
+            f"{benchmark.name:<26} {1.0 / median:>12,.0f} ops/s {median * 1e6:>11,.1f} us "
+            f"{peak_kib:>9,.1f} KiB peak {retained_kib:>8,.1f} KiB retained"
+        )
+    return results
+
+
+def environment_info() -> dict[str, Any]:
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cores": available_cores(),
+    }
+
+
+def compare(results: list[BenchmarkResult], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    """
+    Log each benchmark's change against a baseline file.
+
+    Returns:
+        The names of benchmarks that got slower by more than tolerance, as a fraction of the baseline ops/s
+    """
+    previous = {entry["name"]: entry for entry in baseline["results"]}
+    regressions = []
+    for result in results:
+        if result.name not in previous:
+            continue
+        change = result.ops_per_sec / previous[result.name]["ops_per_sec"] - 1
+        regressed = change < -tolerance
+        if regressed:
+            regressions.append(result.name)
+        logger.info(f"{result.name:<26} {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time scoring, placement validation, env and conversion functions.")
+    parser.add_argument("-k", "--filter", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Seconds each timing round lasts at least")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing rounds per benchmark")
+    parser.add_argument("--memory-samples", type=int, default=20, help="Calls traced for memory use")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Save the results to this JSON file")
+    parser.add_argument("--baseline", type=Path, help="Compare against results saved earlier with --output")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.10, help="Slowdown against the baseline counted as a regression"
+    )
+    args = parser.parse_args()
+
+    selected = [b for b in build_benchmarks(Fixtures.load(), args.seed) if args.filter in b.name]
+    results = run_benchmarks(selected, args.min_time, args.repeat, args.memory_samples)
+
+    if args.output is not None:
+        report = {"environment": environment_info(), "results": [asdict(result) for result in results]}
+        args.output.write_text(json.dumps(report, indent=2))
+        logger.info(f"Saved results to {args.output}")
+
+    if args.baseline is not None:
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+        if regressions:
+            logger.error(f"Slower than the baseline: {', '.join(regressions)}")
+            sys.exit(1)
@@ -0,0 +1,202 @@
+import argparse
+import cProfile
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import FrameType
+from typing import Any, Callable, SupportsFloat
+
+import gymnasium as gym
+import numpy as np
+import numpy.typing as npt
+
+from backend.civenv import CivEnv
+from backend.logger import setup_logger
+from backend.perf.benchmarks import Fixtures
+
+logger = setup_logger(__name__)
+
+# The CivEnv methods timed for each phase. Time is counted towards the innermost timed method only, so a mask
+# computed while building the info dict counts as masking, and the tiles push_placement() rescores count as scoring.
+PHASE_METHODS: dict[str, tuple[str, ...]] = {
+    "init_map": ("init_map",),
+    "grid_signature": ("grid_signature",),
+    "placement": ("push_placement",),
+    "scoring": ("get_cached_score_result", "_local_score"),
+    "masking": ("action_mask", "district_mask", "tile_mask", "get_cached_can_place_district"),
+    "observation": ("_get_obs", "_observe_tiles"),
+    "info": ("_get_info",),
+}
+
+
+@dataclass
+class ProfileReport:
+    steps: int = 0
+    resets: int = 0
+    step_seconds: float = 0.0
+    reset_seconds: float = 0.0
+    # Seconds spent in each phase across steps and resets, excluding time spent in other phases
+    phases: dict[str, float] = field(default_factory=lambda: dict.fromkeys(PHASE_METHODS, 0.0))
+
+    @property
+    def total_seconds(self) -> float:
+        return self.step_seconds + self.reset_seconds
+
+    def log(self) -> None:
+        steps_per_sec = self.steps / self.step_seconds if self.step_seconds else 0.0
+        resets_per_sec = self.resets / self.reset_seconds if self.reset_seconds else 0.0
+        logger.info(f"{self.steps} steps at {steps_per_sec:,.0f}/s, {self.resets} resets at {resets_per_sec:,.0f}/s")
+        other = self.total_seconds - sum(self.phases.values())
+        for phase, seconds in [*sorted(self.phases.items(), key=lambda item: -item[1]), ("other", other)]:
+            share = seconds / self.total_seconds if self.total_seconds else 0.0
+            logger.info(f"  {phase:<16} {seconds:>9.3f}s {share:>7.1%}")
+
+
+class StepProfiler(gym.Wrapper[npt.NDArray[np.float32], int, npt.NDArray[np.float32], int]):
+    """
+    Measures where the time of CivEnv.step() and reset() goes, per phase.
+
+    The phase methods in PHASE_METHODS are replaced on the wrapped env instance with timed versions, so calls the env
+    makes to itself are measured too. Calls from outside step() and reset(), like an agent asking for the action mask,
+    are not counted. Only the wall clock is read, so the env behaves exactly as without the wrapper.
+    """
+
+    report: ProfileReport
+
+    def __init__(self, env: gym.Env[npt.NDArray[np.float32], int]):
+        super().__init__(env)
+        self.report = ProfileReport()
+        # Start time of each timed call in progress, innermost last, with the time its timed callees took
+        self._stack: list[list[float]] = []
+        self._measuring = False
+
+        civ_env = env.unwrapped
+        for phase, methods in PHASE_METHODS.items():
+            for method in methods:
+                setattr(civ_env, method, self._timed(phase, getattr(civ_env, method)))
+
+    def _timed(self, phase: str, method: Callable[..., Any]) -> Callable[..., Any]:
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            if not self._measuring:
+                return method(*args, **kwargs)
+            self._stack.append([time.perf_counter(), 0.0])
+            try:
+                return method(*args, **kwargs)
+            finally:
+                start, inner = self._stack.pop()
+                elapsed = time.perf_counter() - start
+                self.report.phases[phase] += elapsed - inner
+                if self._stack:
+                    self._stack[-1][1] += elapsed
+
+        return timed
+
+    def step(self, action: int) -> tuple[npt.NDArray[np.float32], SupportsFloat, bool, bool, dict[str, Any]]:
+        self._measuring = True
+        start = time.perf_counter()
+        try:
+            result = self.env.step(action)
+        finally:
+            self.report.step_seconds += time.perf_counter() - start
+            self._measuring = False
+        self.report.steps += 1
+        return result
+
+    def reset(
+        self, *, seed: int | None = None, options: dict[str, Any] | None = None
+    ) -> tuple[npt.NDArray[np.float32], dict[str, Any]]:
+        self._measuring = True
+        start = time.perf_counter()
+        try:
+            result = self.env.reset(seed=seed, options=options)
+        finally:
+            self.report.reset_seconds += time.perf_counter() - start
+            self._measuring = False
+        self.report.resets += 1
+        return result
+
+
+class StackSampler:
+    """
+    Samples the main thread's Python stack at a fixed interval, from a background thread.
+
+    Unlike cProfile it adds no overhead to every call, so the relative cost of small functions is not distorted. The
+    samples are written in the collapsed stack format that flame graph tools read.
+    """
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame: FrameType | None = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_name} ({Path(frame.f_code.co_filename).name}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def dump(self, path: Path) -> None:
+        path.write_text("".join(f"{stack} {count}\n" for stack, count in self.samples.most_common()))
+
+
+def run_episodes(env: gym.Env[npt.NDArray[np.float32], int], episodes: int, seed: int) -> None:
+    """Play episodes with uniformly random legal actions, resetting like a vectorized env in training."""
+    rng = random.Random(seed)
+    # CivEnv.init_map() picks the template with the global random module
+    random.seed(seed)
+    civ_env: CivEnv = env.unwrapped  # type: ignore[assignment]
+    env.reset(seed=seed)
+    for _ in range(episodes):
+        terminated = truncated = False
+        while not (terminated or truncated):
+            action = rng.choice(np.flatnonzero(civ_env.action_mask()).tolist())
+            _, _, terminated, truncated, _ = env.step(action)
+        env.reset()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile CivEnv rollouts with random legal actions, per phase.")
+    parser.add_argument("--episodes", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cprofile", type=Path, help="Also write cProfile stats to this file, for pstats or snakeviz")
+    parser.add_argument("--sample", type=Path, help="Also write sampled stacks to this file, in collapsed format")
+    parser.add_argument("--sample-interval", type=float, default=0.001, help="Seconds between stack samples")
+    args = parser.parse_args()
+
+    profiled = StepProfiler(CivEnv(Fixtures.load().templates))
+    profiler = cProfile.Profile() if args.cprofile else None
+    sampler = StackSampler(args.sample_interval) if args.sample else None
+
+    if profiler is not None:
+        profiler.enable()
+    if sampler is not None:
+        sampler.start()
+    try:
+        run_episodes(profiled, args.episodes, args.seed)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+            logger.info(f"Wrote cProfile stats to {args.cprofile}")
+        if sampler is not None:
+            sampler.stop()
+            sampler.dump(args.sample)
+            logger.info(f"Wrote {sum(sampler.samples.values())} stack samples to {args.sample}")
+
+    profiled.report.log()
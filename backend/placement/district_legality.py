@@ -0,0 +1,53 @@
+"""
+District legality for a whole map at once, as a (tiles, districts) matrix, and packed into one bitset per district.
+
+Districts sharing a placement class follow the same rules, so each tile is checked once per class rather than once per
+district, in a single pass over the map.
+"""
+
+import numpy as np
+import numpy.typing as npt
+
+from backend.models.civmap import Tile
+from backend.models.hex_topology import Coordinate
+from backend.models.int_enums import District
+from backend.placement.district_placement_rules import DISTRICT_TO_PLACEMENT_CLASS, PlacementClass
+from backend.placement.district_validation import get_district_rejection
+
+# The columns of the legality matrix
+PLACEABLE_DISTRICTS = [district for district in District if district in DISTRICT_TO_PLACEMENT_CLASS]
+
+# A district to check each placement class with, and the class column of every district column
+_CLASS_DISTRICTS: dict[PlacementClass, District] = {}
+for _district in PLACEABLE_DISTRICTS:
+    _CLASS_DISTRICTS.setdefault(DISTRICT_TO_PLACEMENT_CLASS[_district], _district)
+_CLASS_COLUMNS = np.array([list(_CLASS_DISTRICTS).index(DISTRICT_TO_PLACEMENT_CLASS[d]) for d in PLACEABLE_DISTRICTS])
+
+
+def get_district_legality(grid: dict[Coordinate, Tile]) -> npt.NDArray[np.bool_]:
+    """
+    Whether each district can be placed on each tile, the same as can_place_district() for every pair.
+
+    Only the placement rules are checked, so tiles that already hold a district are not ruled out for that alone.
+
+    Returns:
+        Shape (tiles, districts), with tiles in the grid's order and districts in PLACEABLE_DISTRICTS order
+    """
+    by_class = np.array(
+        [
+            [get_district_rejection(district, grid, key) is None for district in _CLASS_DISTRICTS.values()]
+            for key in grid
+        ],
+        dtype=bool,
+    ).reshape(len(grid), len(_CLASS_DISTRICTS))
+    return by_class[:, _CLASS_COLUMNS]
+
+
+def pack_legality(legal: npt.NDArray[np.bool_]) -> list[bytes]:
+    """
+    A (tiles, districts) legality matrix as one bitset per district.
+
+    Tile i of a bitset is bit 7 - i % 8 of byte i // 8, the most significant bit first, and the last byte is padded
+    with zeros.
+    """
+    return [row.tobytes() for row in np.packbits(legal.T, axis=1)]
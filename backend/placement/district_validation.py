@@ -1,71 +1,83 @@
+from .. import tracing
 from ..models.civmap import Tile
 from ..models.int_enums import District, Feature, Terrain
+from ..tracing import TraceKind
 from .district_placement_rules import DISTRICT_TO_PLACEMENT_CLASS, PLACEMENT_CLASSES
 
 Coordinate = tuple[int, int]
 
 
 def can_place_district(district: District, grid: dict[Coordinate, Tile], key: Coordinate) -> bool:
+    rejection = get_district_rejection(district, grid, key)
+    if rejection is None:
+        return True
+    if tracing.ENABLED:
+        tracing.record(TraceKind.REJECTION, grid[key], district, rejection)
+    return False
+
+
+def get_district_rejection(district: District, grid: dict[Coordinate, Tile], key: Coordinate) -> str | None:
+    """The placement rule that keeps the district off the tile, or None if it can be placed there."""
     tile = grid[key]
     rules = PLACEMENT_CLASSES[DISTRICT_TO_PLACEMENT_CLASS[district]]
 
     if rules is None:
-        return True
+        return None
 
     if tile.mountain:
-        return False
+        return "mountain"
 
     if rules.requires_city and not tile.withinCityLimits:
-        return False
+        return "requires_city"
 
     if tile.terrain in rules.invalid_terrain:
-        return False
+        return "invalid_terrain"
 
     if rules.required_terrain is not None and tile.terrain not in rules.required_terrain:
-        return False
+        return "required_terrain"
 
     if tile.feature != Feature.NONE and tile.feature in rules.invalid_features:
-        return False
+        return "invalid_features"
 
     if rules.required_features is not None and tile.feature not in rules.required_features:
-        return False
+        return "required_features"
 
     if tile.resourceType in rules.invalid_resource_types:
-        return False
+        return "invalid_resource_types"
 
     if rules.requires_flat_land and tile.hill:
-        return False
+        return "requires_flat_land"
 
     neighbors = tile.get_neighbors(grid)
 
     if rules.requires_adjacent_land:
         if not any(n.terrain not in (Terrain.OCEAN, Terrain.COAST) for n in neighbors):
-            return False
+            return "requires_adjacent_land"
 
     if rules.requires_city_center:
         if not any(n.district == District.CITY_CENTER for n in neighbors):
-            return False
+            return "requires_city_center"
 
     if rules.requires_not_city_center:
         if any(n.district == District.CITY_CENTER for n in neighbors):
-            return False
+            return "requires_not_city_center"
 
     if rules.requires_freshwater_source:
         if not (
             any(n.mountain or n.feature == Feature.OASIS or n.terrain == Terrain.LAKE for n in neighbors)
             or has_valid_river_edge(tile, neighbors)
         ):
-            return False
+            return "requires_freshwater_source"
 
     if rules.requires_two_river_edges:
         if tile.rivers.count(True) < 2:
-            return False
+            return "requires_two_river_edges"
 
     if rules.requires_connect_water_or_city:
         if not check_canal(neighbors):
-            return False
+            return "requires_connect_water_or_city"
 
-    return True
+    return None
 
 
 def has_valid_river_edge(tile: Tile, neighbors: list[Tile]) -> bool:
@@ -0,0 +1,80 @@
+"""
+Improvement legality for a whole map at once, as a (tiles, improvements) matrix.
+
+Whether an improvement fits a tile depends only on a few of the tile's attributes, so every answer is computed once
+per process into a table indexed by them, and a map's matrix is a single lookup into it.
+"""
+
+from functools import cache
+
+import numpy as np
+import numpy.typing as npt
+
+from backend.models.civmap import Tile
+from backend.models.hex_topology import Coordinate
+from backend.models.int_enums import District, Feature, Improvement, Resource, ResourceType, Terrain
+from backend.placement.improvement_validation import get_improvement_rejection
+
+# The columns of the legality matrix
+PLACEABLE_IMPROVEMENTS = [improvement for improvement in Improvement if improvement is not Improvement.NONE]
+
+
+@cache
+def legality_table() -> npt.NDArray[np.bool_]:
+    """
+    legality_table()[terrain, feature, resource, hill, i]: whether PLACEABLE_IMPROVEMENTS[i] fits a tile with those
+    attributes that is not a mountain.
+
+    Built by running get_improvement_rejection() on a probe tile for every combination, so the matrices agree with
+    can_place_improvement() by construction, as long as the rules read no other attributes than these and mountain.
+    ImprovementPlacementRules and IMPROVEMENT_CHECKS do not.
+    """
+    table = np.zeros((len(Terrain), len(Feature), len(Resource), 2, len(PLACEABLE_IMPROVEMENTS)), dtype=bool)
+    probe = Tile(
+        q=0,
+        r=0,
+        terrain=Terrain.GRASSLAND,
+        hill=False,
+        mountain=False,
+        mountain_no=0,
+        feature=Feature.NONE,
+        district=District.NONE,
+        resource=Resource.NONE,
+        resourceType=ResourceType.NONE,
+        improvement=Improvement.NONE,
+        rivers=[False] * 6,
+        withinCityLimits=False,
+    )
+    for terrain in Terrain:
+        probe.terrain = terrain
+        for feature in Feature:
+            probe.feature = feature
+            for resource in Resource:
+                probe.resource = resource
+                for hill in (False, True):
+                    probe.hill = hill
+                    table[terrain, feature, resource, int(hill)] = [
+                        get_improvement_rejection(probe, improvement) is None for improvement in PLACEABLE_IMPROVEMENTS
+                    ]
+    table.setflags(write=False)
+    return table
+
+
+def get_improvement_legality(grid: dict[Coordinate, Tile]) -> npt.NDArray[np.bool_]:
+    """
+    Whether each improvement can be placed on each tile, the same as can_place_improvement() for every pair.
+
+    Returns:
+        Shape (tiles, improvements), with tiles in the grid's order and improvements in PLACEABLE_IMPROVEMENTS order
+    """
+    n_tiles = len(grid)
+    tiles = grid.values()
+    terrain = np.fromiter((tile.terrain for tile in tiles), dtype=np.intp, count=n_tiles)
+    feature = np.fromiter((tile.feature for tile in tiles), dtype=np.intp, count=n_tiles)
+    resource = np.fromiter((tile.resource for tile in tiles), dtype=np.intp, count=n_tiles)
+    hill = np.fromiter((tile.hill for tile in tiles), dtype=np.intp, count=n_tiles)
+    mountain = np.fromiter((tile.mountain for tile in tiles), dtype=bool, count=n_tiles)
+
+    legal = legality_table()[terrain, feature, resource, hill]
+    legal[mountain] = False
+    return legal
@@ -1,37 +1,51 @@
+from backend import tracing
 from backend.models.civmap import Tile
 from backend.models.int_enums import Feature, Improvement, Resource, Terrain
 from backend.placement.improvement_placement_rules import IMPROVEMENT_PLACEMENT_RULES
+from backend.tracing import TraceKind
 
 
 def can_place_improvement(tile: Tile, improvement: Improvement) -> bool:
+    rejection = get_improvement_rejection(tile, improvement)
+    if rejection is None:
+        return True
+    if tracing.ENABLED:
+        tracing.record(TraceKind.REJECTION, tile, improvement, rejection)
+    return False
+
+
+def get_improvement_rejection(tile: Tile, improvement: Improvement) -> str | None:
+    """The placement rule that keeps the improvement off the tile, or None if it can be placed there."""
     rules = IMPROVEMENT_PLACEMENT_RULES.get(improvement)
     if rules is None:
-        return True
+        return None
 
     if tile.mountain:
-        return False
+        return "mountain"
 
     if rules.invalid_terrain and tile.terrain in rules.invalid_terrain:
-        return False
+        return "invalid_terrain"
 
     if rules.required_terrain and tile.terrain not in rules.required_terrain:
-        return False
+        return "required_terrain"
 
     if rules.invalid_features and tile.feature in rules.invalid_features:
-        return False
+        return "invalid_features"
 
     if rules.required_features and tile.feature not in rules.required_features:
-        return False
+        return "required_features"
 
     if tile.resource != Resource.NONE:
         if rules.valid_resources and tile.resource not in rules.valid_resources:
-            return False
+            return "valid_resources"
 
     if rules.required_resources and tile.resource not in rules.required_resources:
-        return False
+        return "required_resources"
 
     fn = IMPROVEMENT_CHECKS.get(improvement)
-    return fn(tile) if fn else True
+    if fn is not None and not fn(tile):
+        return fn.__name__
+    return None
 
 
 def can_place_mine(tile: Tile) -> bool:
@@ -0,0 +1,459 @@
+import argparse
+import math
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+
+from backend.civenv import CivEnv
+from backend.logger import setup_logger
+from backend.models.int_enums import District
+from backend.yields.placement_scorer import NUM_DISTRICTS, SOURCE_WEIGHTS, PlacementScorer
+
+logger = setup_logger(__name__)
+
+# Scores are sums of multiples of 0.5, so anything smaller than this is float noise
+EPSILON = 1e-9
+
+
+class SearchLimitReached(Exception):
+    """Raised inside the search when the node or time limit runs out."""
+
+
+@dataclass
+class SolveResult:
+    actions: list[int]
+    score: float
+    # False if a limit stopped the search before the layout was proved to be the best
+    proved_optimal: bool
+    nodes: int
+
+
+def max_weight_assignment(weights: npt.NDArray[np.float64]) -> list[tuple[int, int]]:
+    """
+    Give each row at most one column, and each column to at most one row, so the total weight is as high as possible.
+
+    Uses the Hungarian algorithm on the rows and columns that have a positive weight anywhere; leaving a row out is
+    always allowed, so nothing else could be part of a best assignment.
+
+    Returns:
+        The (row, column) pairs of the assignment
+    """
+    rows = np.flatnonzero((weights > EPSILON).any(axis=1))
+    cols = np.flatnonzero((weights > EPSILON).any(axis=0))
+    if len(rows) == 0:
+        return []
+
+    gains = np.maximum(weights[np.ix_(rows, cols)], 0.0)
+    best = gains.argmax(axis=1)
+    if len(set(best.tolist())) == len(rows):
+        # No two rows want the same column
+        return [(int(rows[i]), int(cols[j])) for i, j in enumerate(best)]
+
+    # Minimum cost form with one extra zero column per row, so every row can be assigned to "nothing"
+    n = len(rows)
+    m = len(cols) + n
+    cost = np.zeros((n + 1, m + 1))
+    cost[1:, 1 : len(cols) + 1] = -gains
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    owner = np.zeros(m + 1, dtype=np.intp)
+    way = np.zeros(m + 1, dtype=np.intp)
+
+    for row in range(1, n + 1):
+        owner[0] = row
+        col = 0
+        min_reduced = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[col] = True
+            reduced = cost[owner[col]] - u[owner[col]] - v
+            better = ~used & (reduced < min_reduced)
+            min_reduced[better] = reduced[better]
+            way[better] = col
+            candidates = np.where(used, np.inf, min_reduced)
+            next_col = int(candidates.argmin())
+            delta = candidates[next_col]
+            u[owner[used]] += delta
+            v[used] -= delta
+            min_reduced[~used] -= delta
+            col = next_col
+            if owner[col] == 0:
+                break
+        while col:
+            previous = way[col]
+            owner[col] = owner[previous]
+            col = previous
+
+    return [
+        (int(rows[owner[j] - 1]), int(cols[j - 1]))
+        for j in range(1, len(cols) + 1)
+        if owner[j] and gains[owner[j] - 1, j - 1] > EPSILON
+    ]
+
+
+class CityBounds:
+    """
+    Upper bounds on what the remaining districts can still add to a city, from the current layout.
+
+    Placing a set of districts adds each one's marginal gain on the current layout, plus the effect each pair of new
+    neighbors has on each other. Every pair effect is counted towards one district of the pair and bounded with the
+    best legal partner for each empty neighbor tile, from DISTRICT_ADJACENCY_RULES through the scorer's match table.
+    Districts without rules never affect each other, so their bounds are exact once every district with rules is
+    placed.
+    """
+
+    scorer: PlacementScorer
+    districts: npt.NDArray[np.intp]
+    legal: npt.NDArray[np.bool_]
+    has_rules: npt.NDArray[np.bool_]
+    tiles: npt.NDArray[np.intp]
+    tile_neighbors: npt.NDArray[np.intp]
+    pair_effects: npt.NDArray[np.float64]
+
+    def __init__(self, scorer: PlacementScorer, legal: dict[int, npt.NDArray[np.bool_]]):
+        self.scorer = scorer
+        n = scorer.n_tiles
+
+        # placeable[d, k]: district d may still go on tile k. The sentinel column stays empty.
+        placeable = np.zeros((NUM_DISTRICTS, n + 1), dtype=bool)
+        for district, mask in legal.items():
+            placeable[district, :n] = mask
+
+        # Only tiles some district can go on get bounds, and only their neighbors matter
+        self.tiles = np.flatnonzero(placeable[:, :n].any(axis=0))
+        self.tile_neighbors = scorer.neighbors[self.tiles]
+
+        # effect[r, d, k]: what district d on tile k does to the adjacency of a district r next to it
+        change = scorer.matches.astype(np.float64) - scorer.matches[:, [District.NONE.value], :]
+        effect = np.einsum("rs,sdk->rdk", SOURCE_WEIGHTS, change)
+        partner_effect = effect.transpose(1, 0, 2)[:, :, self.tiles]
+        not_self = ~np.eye(NUM_DISTRICTS, dtype=bool)[:, :, None]
+
+        # pair_effects[d, t, slot, p]: what d on self.tiles[t] and p on that neighbor add to each other's adjacency
+        self.pair_effects = np.empty((NUM_DISTRICTS, len(self.tiles), 6, NUM_DISTRICTS))
+        for slot in range(6):
+            neighbor = self.tile_neighbors[:, slot]
+            pair = np.where(placeable[None, :, neighbor] & not_self, effect[:, :, neighbor] + partner_effect, -np.inf)
+            self.pair_effects[:, :, slot, :] = pair.transpose(0, 2, 1)
+
+        self.districts = np.array(sorted(legal), dtype=np.intp)
+        self.legal = placeable[:, :n]
+        self.has_rules = np.asarray(SOURCE_WEIGHTS.any(axis=1))
+
+    def _bounds(
+        self,
+        districts: npt.NDArray[np.intp],
+        partners: npt.NDArray[np.bool_],
+        share_losses: bool,
+    ) -> npt.NDArray[np.float64]:
+        """
+        The most each district could add on each tile, shape (districts, tiles).
+
+        partners[i, j] says whether pair effects between districts[i] and districts[j] count towards districts[i].
+        Each empty neighbor holds at most one partner and each partner is on at most one neighbor, so the pair bound
+        is the smaller of the best partner per neighbor and the best neighbor per partner.
+
+        With share_losses, a partner without rules that would lower the total on its own passes an equal share of that
+        loss to every district with rules that could be next to it, since it is only worth placing for their sake.
+        """
+        scorer = self.scorer
+        # Two districts without adjacency rules never affect each other
+        rules = self.has_rules[districts]
+        partners = partners & (rules[:, None] | rules[None, :])
+        rows = np.flatnonzero(partners.any(axis=1))
+        columns = np.flatnonzero(partners.any(axis=0))
+
+        free = scorer.districts == District.NONE.value
+        all_gains = scorer.marginal_gains_many(districts)
+        gains = all_gains[:, self.tiles]
+        pairs = self.pair_effects[districts[rows]][:, :, :, districts[columns]]
+
+        if share_losses:
+            # How many districts with rules each tile could still end up next to
+            could_have_rules = np.append(self.legal[districts[rules]].any(axis=0) & free[: scorer.n_tiles], False)
+            sharers = np.clip(could_have_rules[scorer.neighbors].sum(axis=1), 1, max(1, int(rules.sum())))
+            losses = np.zeros((len(columns), scorer.n_tiles + 1))
+            without_rules = ~rules[columns]
+            losses[without_rules, : scorer.n_tiles] = np.minimum(all_gains[columns[without_rules]], 0.0) / sharers
+            pairs = pairs + losses.T[self.tile_neighbors][None]
+
+        pairs = np.where(
+            free[self.tile_neighbors][None, :, :, None] & partners[np.ix_(rows, columns)][:, None, None, :],
+            pairs,
+            -np.inf,
+        )
+        per_neighbor = np.maximum(pairs.max(axis=3, initial=-np.inf), 0.0).sum(axis=2)
+        per_partner = np.maximum(pairs.max(axis=2, initial=-np.inf), 0.0).sum(axis=2)
+
+        gains[rows] += np.minimum(per_neighbor, per_partner)
+        result = np.full((len(districts), scorer.n_tiles), -np.inf)
+        result[:, self.tiles] = np.where(self.legal[districts][:, self.tiles] & free[self.tiles], gains, -np.inf)
+        return result
+
+    def gain_bounds(self, districts: npt.NDArray[np.intp]) -> npt.NDArray[np.float64]:
+        """
+        The most each district could add on each tile, if these districts are placed from now on.
+
+        The districts with adjacency rules must come first, in the order they will be placed.
+
+        Shape (districts, tiles). Tiles where the district cannot go are -inf.
+        """
+        rules = self.has_rules[districts]
+        # Pairs of two districts with rules count for the later one, and pairs with a district without rules count
+        # for the one with rules, whose six neighbors limit how many such pairs it can be part of.
+        partners = (np.tri(len(districts), k=-1, dtype=bool) & rules[None, :]) | ~rules[None, :]
+        return self._bounds(districts, partners & rules[:, None], share_losses=True)
+
+    def solo_bounds(self) -> npt.NDArray[np.float64]:
+        """
+        The most each district could change the total of any layout by.
+
+        A district whose solo bound is not positive can be left out of any layout without lowering its total.
+        """
+        partners = ~np.eye(len(self.districts), dtype=bool)
+        result: npt.NDArray[np.float64] = self._bounds(self.districts, partners, share_losses=False).max(axis=1)
+        return result
+
+
+class BranchAndBoundSolver:
+    """
+    Finds the district layout with the highest get_score() total for a single city.
+
+    Without a city, every legal city center is tried, most promising first. With the city fixed, placement legality
+    no longer depends on the other districts, so the search decides one district at a time whether to place it and
+    where, on a PlacementScorer that is updated in place. Every district is optional, since a district can lower the
+    total by covering a tile's own yields.
+
+    Only districts with adjacency rules are branched on. Districts without rules never affect each other, so once the
+    others are placed their best placement is an assignment problem, solved exactly in one go. That also covers the
+    symmetry between interchangeable districts, which are never tried in each other's places. Nodes are pruned with
+    CityBounds, recomputed from the layout at each node.
+    """
+
+    env: CivEnv
+    node_limit: int | None
+
+    def __init__(self, env: CivEnv, node_limit: int | None = None):
+        self.env = env
+        self.node_limit = node_limit
+        # Row of each district's actions in the env's action space
+        self._district_rows = {district.value: i for i, district in enumerate(env.placeable_districts)}
+
+        self._deadline = math.inf
+        self._nodes = 0
+        self._best_score = -math.inf
+        self._best_actions: list[int] = []
+
+    def solve(self, budget_seconds: float | None = None) -> SolveResult:
+        """
+        Search from the env's current state, which is left unchanged.
+
+        Returns:
+            The best layout found as env actions, in an order that can be replayed with push_placement()
+        """
+        self._deadline = math.inf if budget_seconds is None else time.perf_counter() + budget_seconds
+        self._nodes = 0
+        self._best_score = self.env.get_cached_score()
+        self._best_actions = []
+
+        proved_optimal = True
+        try:
+            if self.env.current_civ_map.cities:
+                bounds = self._city_bounds()
+                self._seed([], bounds)
+                self._solve_city([], bounds)
+            else:
+                self._solve_city_centers()
+        except SearchLimitReached:
+            proved_optimal = False
+
+        return SolveResult(
+            actions=self._best_actions,
+            score=self._best_score,
+            proved_optimal=proved_optimal,
+            nodes=self._nodes,
+        )
+
+    def _action(self, district: int, tile: int) -> int:
+        return self._district_rows[district] * self.env.n_tiles + tile
+
+    def _city_bounds(self) -> CityBounds:
+        """Bounds for the env's city, over the districts it can still build somewhere."""
+        env = self.env
+        district_mask = env.district_mask()
+        legal = {
+            district.value: env.tile_mask(district)
+            for i, district in enumerate(env.placeable_districts)
+            if district_mask[i] and env.tile_mask(district).any()
+        }
+        return CityBounds(PlacementScorer(env.current_civ_map.tiles), legal)
+
+    def _search_order(self, bounds: CityBounds) -> tuple[npt.NDArray[np.intp], int]:
+        """
+        The districts worth placing, in the order they are decided.
+
+        Returns:
+            The districts, and how many of them at the start have adjacency rules
+        """
+        solo = dict(zip(bounds.districts.tolist(), bounds.solo_bounds().tolist()))
+        # Districts with rules first, so the rest can be placed as an assignment. Biggest bounds first, since
+        # deciding them tightens the bounds the most.
+        order = sorted((d for d in solo if solo[d] > EPSILON), key=lambda d: (not bounds.has_rules[d], -solo[d]))
+        return np.array(order, dtype=np.intp), sum(bool(bounds.has_rules[d]) for d in order)
+
+    def _solve_city_centers(self) -> None:
+        env = self.env
+        if not env.district_mask()[self._district_rows[District.CITY_CENTER.value]]:
+            return
+
+        candidates: list[tuple[float, int, CityBounds]] = []
+        for tile in np.flatnonzero(env.tile_mask(District.CITY_CENTER)):
+            action = self._action(District.CITY_CENTER.value, int(tile))
+            env.push_placement(action)
+            bounds = self._city_bounds()
+            env.pop_placement()
+            best = bounds.gain_bounds(self._search_order(bounds)[0]).max(axis=1, initial=0.0)
+            candidates.append((bounds.scorer.total() + float(best.sum()), action, bounds))
+            self._seed([action], bounds)
+
+        # Searching the best looking cities first finds good layouts early, which prunes the rest harder
+        candidates.sort(key=lambda candidate: -candidate[0])
+        for bound, action, bounds in candidates:
+            if bound <= self._best_score + EPSILON:
+                break
+            env.push_placement(action)
+            try:
+                self._solve_city([action], bounds)
+            finally:
+                env.pop_placement()
+
+    def _seed(self, prefix: list[int], bounds: CityBounds) -> None:
+        """
+        Record a good layout for the city quickly, so the search starts with a strong incumbent to prune against.
+
+        Places the best district and tile by marginal gain until nothing gains, then moves single districts to their
+        best tile, or removes them, until that stops improving the total. The scorer is left as it was.
+        """
+        scorer = bounds.scorer
+        order, _ = self._search_order(bounds)
+        score = scorer.total()
+        placed: dict[int, int] = {}
+
+        improved = True
+        while improved:
+            improved = False
+            # Best new district first
+            remaining = np.array([d for d in order if d not in placed], dtype=np.intp)
+            if len(remaining) > 0:
+                gains = np.where(bounds.legal[remaining], scorer.marginal_gains_many(remaining), -np.inf)
+                gains[:, scorer.districts[: scorer.n_tiles] != District.NONE.value] = -np.inf
+                row, column = np.unravel_index(int(gains.argmax()), gains.shape)
+                if gains[row, column] > EPSILON:
+                    scorer.place(int(remaining[row]), int(column))
+                    placed[int(remaining[row])] = int(column)
+                    score += float(gains[row, column])
+                    improved = True
+                    continue
+
+            # Then moves of placed districts, including taking them out again
+            for district, tile in list(placed.items()):
+                scorer.remove(tile)
+                gains = np.where(bounds.legal[district], scorer.marginal_gains(district), -np.inf)
+                gains[scorer.districts[: scorer.n_tiles] != District.NONE.value] = -np.inf
+                loss = float(gains[tile])
+                best = int(gains.argmax())
+                if gains[best] > max(loss, 0.0) + EPSILON:
+                    scorer.place(district, best)
+                    placed[district] = best
+                    score += float(gains[best]) - loss
+                    improved = True
+                elif loss < -EPSILON:
+                    del placed[district]
+                    score -= loss
+                    improved = True
+                else:
+                    scorer.place(district, tile)
+
+        if score > self._best_score + EPSILON:
+            self._best_score = score
+            self._best_actions = prefix + [self._action(d, k) for d, k in placed.items()]
+        for tile in placed.values():
+            scorer.remove(tile)
+
+    def _solve_city(self, prefix: list[int], bounds: CityBounds) -> None:
+        scorer = bounds.scorer
+        order, n_rules = self._search_order(bounds)
+        placed: list[tuple[int, int]] = []
+
+        def record(score: float, extra: list[tuple[int, int]]) -> None:
+            if score > self._best_score + EPSILON:
+                self._best_score = score
+                self._best_actions = prefix + [self._action(d, k) for d, k in placed + extra]
+
+        def search(depth: int, score: float) -> None:
+            self._nodes += 1
+            if self._nodes & 63 == 0 and time.perf_counter() > self._deadline:
+                raise SearchLimitReached
+            if self.node_limit is not None and self._nodes > self.node_limit:
+                raise SearchLimitReached
+
+            record(score, [])
+            if depth == len(order):
+                return
+
+            tile_bounds = bounds.gain_bounds(order[depth:])
+            # No two districts share a tile, so the rest can add at most their best assignment of bounds to tiles
+            rest = score + sum(float(tile_bounds[i + 1, k]) for i, k in max_weight_assignment(tile_bounds[1:]))
+            if rest + max(float(tile_bounds[0].max(initial=0.0)), 0.0) <= self._best_score + EPSILON:
+                return
+
+            if depth == n_rules:
+                # Only districts without rules are left, so their bounds are their exact gains
+                assignment = max_weight_assignment(tile_bounds)
+                record(
+                    score + sum(float(tile_bounds[i, k]) for i, k in assignment),
+                    [(int(order[depth + i]), k) for i, k in assignment],
+                )
+                return
+
+            district = int(order[depth])
+            gains = scorer.marginal_gains(district)
+            tiles = np.flatnonzero(tile_bounds[0] + rest > self._best_score + EPSILON)
+            for tile in tiles[np.argsort(-gains[tiles], kind="stable")].tolist():
+                if tile_bounds[0, tile] + rest <= self._best_score + EPSILON:
+                    # The incumbent improved while searching the previous tiles
+                    continue
+                scorer.place(district, tile)
+                placed.append((district, tile))
+                try:
+                    search(depth + 1, score + float(gains[tile]))
+                finally:
+                    placed.pop()
+                    scorer.remove(tile)
+
+            if rest > self._best_score + EPSILON:
+                search(depth + 1, score)
+
+        search(0, scorer.total())
+
+
+if __name__ == "__main__":
+    from backend.utils import load_map_from_json
+
+    parser = argparse.ArgumentParser(description="Find the best achievable score for a map.")
+    parser.add_argument("maps", nargs="+", help="Map JSON files")
+    parser.add_argument("--budget", type=float, default=None, help="Seconds to search each map before giving up")
+    args = parser.parse_args()
+
+    for path in args.maps:
+        env = CivEnv([load_map_from_json(path)])
+        env.reset()
+        start = time.perf_counter()
+        result = BranchAndBoundSolver(env).solve(args.budget)
+        status = "optimal" if result.proved_optimal else "best found"
+        logger.info(
+            f"{path}: {result.score} ({status}, {result.nodes} nodes, {time.perf_counter() - start:.2f}s, "
+            f"{len(result.actions)} placements)"
+        )
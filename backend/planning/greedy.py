@@ -0,0 +1,206 @@
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+
+from backend.civenv import CivEnv
+from backend.models.int_enums import District
+from backend.planning.exact import EPSILON
+from backend.yields.placement_scorer import PlacementScorer
+
+Move = tuple[int, int]
+
+
+@dataclass
+class GreedyResult:
+    actions: list[int]
+    score: float
+
+
+class GreedyPlanner:
+    """
+    Places districts one at a time, always on the (district, tile) pair that adds the most to the total.
+
+    Every legal pair is scored with one PlacementScorer pass per step, so a whole layout takes a few milliseconds and
+    needs neither the model nor torch. With a lookahead of k, the width best looking moves are each followed by up to
+    k - 1 more moves before one is chosen, which finds districts that only pay off once their neighbors are placed.
+    """
+
+    env: CivEnv
+    lookahead: int
+    width: int
+
+    def __init__(self, env: CivEnv, lookahead: int = 1, width: int = 4):
+        self.env = env
+        self.lookahead = lookahead
+        self.width = width
+        # Row of each district's actions in the env's action space
+        self._district_rows = {district.value: i for i, district in enumerate(env.placeable_districts)}
+
+    def plan(self) -> GreedyResult:
+        """
+        Plan a layout from the env's current state, which is left unchanged.
+
+        With lookahead, the plan without it is made too and kept if it scores higher, since lookahead only follows the
+        width best looking moves and can miss the line plain greedy takes.
+
+        Returns:
+            The layout as env actions, in an order that can be replayed with push_placement()
+        """
+        result = self._plan()
+        if self.lookahead > 1:
+            plain = GreedyPlanner(self.env, lookahead=1, width=self.width)._plan()
+            if plain.score > result.score + EPSILON:
+                return plain
+        return result
+
+    def _plan(self) -> GreedyResult:
+        env = self.env
+        scorer = PlacementScorer(env.current_civ_map.tiles)
+        score = env.get_cached_score()
+        actions: list[int] = []
+
+        if not env.current_civ_map.cities:
+            city_center = self._choose_city_center(scorer)
+            if city_center is None:
+                return GreedyResult(actions=[], score=score)
+            score += float(scorer.city_center_gains()[city_center])
+            actions.append(self._action(District.CITY_CENTER.value, city_center))
+            self._found_city(scorer, city_center)
+
+        try:
+            legal = self._legal_tiles()
+            moves, gain = self._place_greedily(scorer, legal)
+        finally:
+            for _ in range(len(actions)):
+                env.pop_placement()
+
+        actions += [self._action(district, tile) for district, tile in moves]
+        return GreedyResult(actions=actions, score=score + gain)
+
+    def _action(self, district: int, tile: int) -> int:
+        return self._district_rows[district] * self.env.n_tiles + tile
+
+    def _found_city(self, scorer: PlacementScorer, tile: int) -> None:
+        """Found the city in the env and the scorer. Undone with env.pop_placement() alone."""
+        self.env.push_placement(self._action(District.CITY_CENTER.value, tile))
+        scorer.place(District.CITY_CENTER.value, tile)
+        scorer.claim_city(tile)
+
+    def _legal_tiles(self) -> dict[int, npt.NDArray[np.bool_]]:
+        """
+        The tiles each district the city can still build may go on.
+
+        With the city founded, legality only depends on the tiles themselves and the city center, so these hold for
+        the whole plan as long as occupied tiles are skipped.
+        """
+        env = self.env
+        district_mask = env.district_mask()
+        return {
+            district.value: env.tile_mask(district)
+            for i, district in enumerate(env.placeable_districts)
+            if district_mask[i] and env.tile_mask(district).any()
+        }
+
+    def _choose_city_center(self, scorer: PlacementScorer) -> int | None:
+        env = self.env
+        if not env.district_mask()[self._district_rows[District.CITY_CENTER.value]]:
+            return None
+        gains = np.where(env.tile_mask(District.CITY_CENTER), scorer.city_center_gains(), -np.inf)
+        candidates = self._top_moves(gains[None, :], 1 if self.lookahead == 1 else self.width)
+        if len(candidates) == 1:
+            return int(candidates[0][1])
+
+        best_value = -np.inf
+        best_tile: int | None = None
+        for _, tile in candidates:
+            before = scorer.state()
+            self._found_city(scorer, tile)
+            try:
+                future, _ = self._look_ahead(scorer, self._legal_tiles(), self.lookahead - 1)
+            finally:
+                env.pop_placement()
+                scorer.remove(tile)
+                scorer.set_within_city(before["within_city"])
+            if gains[tile] + future > best_value:
+                best_value = gains[tile] + future
+                best_tile = tile
+        return best_tile
+
+    def _place_greedily(
+        self, scorer: PlacementScorer, legal: dict[int, npt.NDArray[np.bool_]]
+    ) -> tuple[list[Move], float]:
+        """
+        Place districts until no move, or line of lookahead moves, adds anything. The scorer is left as it was.
+
+        Returns:
+            The moves up to the point where the total was highest, and how much they add to it
+        """
+        legal = dict(legal)
+        moves: list[Move] = []
+        gain = 0.0
+        best_length, best_gain = 0, 0.0
+        try:
+            while legal:
+                value, move = self._look_ahead(scorer, legal, self.lookahead)
+                if move is None or value <= EPSILON:
+                    break
+                district, tile = move
+                gain += float(scorer.marginal_gains(district)[tile])
+                scorer.place(district, tile)
+                moves.append(move)
+                del legal[district]
+                if gain > best_gain + EPSILON:
+                    best_length, best_gain = len(moves), gain
+        finally:
+            for _, tile in moves:
+                scorer.remove(tile)
+        return moves[:best_length], best_gain
+
+    def _gains(self, scorer: PlacementScorer, legal: dict[int, npt.NDArray[np.bool_]]) -> npt.NDArray[np.float64]:
+        """Marginal gains of the districts in legal, in its order, with -inf where they cannot go."""
+        districts = np.fromiter(legal, dtype=np.intp, count=len(legal))
+        allowed = np.stack(list(legal.values())) & (scorer.districts[None, : scorer.n_tiles] == District.NONE.value)
+        result: npt.NDArray[np.float64] = np.where(allowed, scorer.marginal_gains_many(districts), -np.inf)
+        return result
+
+    def _top_moves(self, gains: npt.NDArray[np.float64], count: int) -> list[tuple[int, int]]:
+        """The (row, tile) indices of up to count highest finite gains, best first."""
+        flat = gains.ravel()
+        count = min(count, int(np.isfinite(flat).sum()))
+        if count == 0:
+            return []
+        top = np.argpartition(-flat, count - 1)[:count]
+        top = top[np.argsort(-flat[top])]
+        return [(int(i) // gains.shape[1], int(i) % gains.shape[1]) for i in top]
+
+    def _look_ahead(
+        self, scorer: PlacementScorer, legal: dict[int, npt.NDArray[np.bool_]], depth: int
+    ) -> tuple[float, Move | None]:
+        """
+        The most up to depth more moves can add, trying the width best looking moves at every level except the last.
+
+        Returns:
+            That gain, and the first move of the line that reaches it, or None if no line adds anything
+        """
+        if depth <= 0 or not legal:
+            return 0.0, None
+        districts = list(legal)
+        gains = self._gains(scorer, legal)
+
+        if depth == 1:
+            row, column = divmod(int(gains.argmax()), gains.shape[1])
+            if gains[row, column] <= EPSILON:
+                return 0.0, None
+            return float(gains[row, column]), (districts[row], column)
+
+        best_value, best_move = 0.0, None
+        for row, tile in self._top_moves(gains, self.width):
+            district = districts[row]
+            scorer.place(district, tile)
+            rest = {d: mask for d, mask in legal.items() if d != district}
+            future, _ = self._look_ahead(scorer, rest, depth - 1)
+            scorer.remove(tile)
+            if gains[row, tile] + future > best_value + EPSILON:
+                best_value, best_move = float(gains[row, tile]) + future, (district, tile)
+        return best_value, best_move
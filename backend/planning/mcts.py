@@ -0,0 +1,285 @@
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Any, cast
+
+import numpy as np
+import numpy.typing as npt
+import torch as th
+from sb3_contrib import MaskablePPO
+from sb3_contrib.common.maskable.distributions import MaskableCategoricalDistribution
+
+from backend.civenv import CivEnv
+from backend.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+@dataclass
+class Node:
+    """A state in the search tree. Edge statistics are stored on the parent, indexed like ``actions``."""
+
+    actions: npt.NDArray[np.int64]
+    priors: npt.NDArray[np.float64]
+    visits: npt.NDArray[np.float64]
+    value_sums: npt.NDArray[np.float64]
+    rewards: npt.NDArray[np.float64]
+    children: dict[int, "Node"] = field(default_factory=dict)
+
+    @classmethod
+    def expand(cls, mask: npt.NDArray[Any], probs: npt.NDArray[Any]) -> "Node":
+        actions = np.flatnonzero(mask)
+        priors = probs[actions].astype(np.float64)
+        total = priors.sum()
+        priors = priors / total if total > 0 else np.full(len(actions), 1.0 / len(actions))
+        return cls(
+            actions=actions,
+            priors=priors,
+            visits=np.zeros(len(actions)),
+            value_sums=np.zeros(len(actions)),
+            rewards=np.zeros(len(actions)),
+        )
+
+
+@dataclass
+class PendingLeaf:
+    path: list[tuple[Node, int]]
+    obs: npt.NDArray[np.float32]
+    mask: npt.NDArray[Any]
+
+
+@dataclass
+class PlanResult:
+    actions: list[int]
+    score: float
+    simulations: int
+    # Calls to evaluate(), each a single forward pass
+    forward_passes: int = 0
+
+
+class MinMaxStats:
+    """Normalizes action values to [0, 1] using the range seen so far in the tree."""
+
+    def __init__(self) -> None:
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def update(self, value: float) -> None:
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def normalize(self, values: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        if self.maximum > self.minimum:
+            return (values - self.minimum) / (self.maximum - self.minimum)
+        return np.zeros_like(values)
+
+
+class MCTSPlanner:
+    """
+    Anytime Monte Carlo tree search over district placements.
+
+    The MaskablePPO policy provides the priors and the leaf value estimates, and CivEnv's shaped rewards are used for
+    the backups, so search values are on the same scale the value head was trained on. The tree is walked with
+    push_placement()/pop_placement() on a single env, so scores and masks come from the env's signature caches.
+    Leaves are collected in batches, using virtual loss to spread the batch over different leaves, and evaluated with
+    one forward pass per batch.
+    """
+
+    model: MaskablePPO
+    env: CivEnv
+    c_puct: float
+    batch_size: int
+    virtual_loss: float
+    gamma: float
+
+    def __init__(
+        self,
+        model: MaskablePPO,
+        env: CivEnv,
+        c_puct: float = 1.5,
+        batch_size: int = 8,
+        virtual_loss: float = 1.0,
+    ):
+        self.model = model
+        self.env = env
+        self.c_puct = c_puct
+        self.batch_size = batch_size
+        self.virtual_loss = virtual_loss
+        self.gamma = float(model.gamma)
+
+        self._stats = MinMaxStats()
+        self._best_actions: list[int] = []
+        self._best_score = -math.inf
+        self._forward_passes = 0
+
+    def evaluate(
+        self, obs: npt.NDArray[np.float32], masks: npt.NDArray[Any]
+    ) -> tuple[npt.NDArray[np.float32], npt.NDArray[np.float32]]:
+        """Action probabilities and state values for a batch of observations, in one forward pass."""
+        policy = self.model.policy
+        with th.no_grad():
+            obs_tensor, _ = policy.obs_to_tensor(obs)
+            distribution = policy.get_distribution(obs_tensor, action_masks=masks)
+            probs = cast(MaskableCategoricalDistribution, distribution).distribution.probs.cpu().numpy()
+            values = policy.predict_values(obs_tensor).cpu().numpy().reshape(-1)
+        self._forward_passes += 1
+        return probs, values
+
+    def plan(self, budget_seconds: float) -> PlanResult:
+        """
+        Search from the env's current state until the budget runs out.
+
+        The env is left in the state it started in. Returns the best complete layout seen: the policy's own line, a
+        terminal state reached by the search, or the most visited line completed with the policy's most likely
+        actions.
+        """
+        deadline = time.perf_counter() + budget_seconds
+        self._stats = MinMaxStats()
+        self._best_actions = []
+        self._best_score = -math.inf
+        self._forward_passes = 0
+
+        root_mask = self.env.action_mask()
+        if not root_mask.any():
+            return PlanResult(actions=[], score=self.env.get_cached_score(), simulations=0)
+
+        probs, _ = self.evaluate(self.env._get_obs()[None], root_mask[None])
+        root = Node.expand(root_mask, probs[0])
+        # The plain policy line is always a candidate, so searching never does worse than not searching.
+        start = time.perf_counter()
+        self._complete_line(root, by_visits=False)
+        # Finishing the chosen line at the end takes at most about as long as finishing the policy's line did
+        reserve = time.perf_counter() - start
+
+        simulations = 0
+        # The slowest whole batch so far, with its descents, placements and forward pass, so a batch only starts when
+        # it can finish before the reserve. Until one has run, a batch is assumed to take as long as a whole line.
+        batch_seconds: float | None = None
+        while time.perf_counter() + (reserve if batch_seconds is None else batch_seconds) + reserve < deadline:
+            start = time.perf_counter()
+            simulations += self._run_batch(root)
+            batch_seconds = max(batch_seconds or 0.0, time.perf_counter() - start)
+
+        self._complete_line(root, by_visits=True)
+        return PlanResult(
+            actions=self._best_actions,
+            score=self._best_score,
+            simulations=simulations,
+            forward_passes=self._forward_passes,
+        )
+
+    def _select(self, node: Node) -> int:
+        parent_visits = node.visits.sum()
+        q = np.where(
+            node.visits > 0,
+            self._stats.normalize((node.rewards + self.gamma * node.value_sums / np.maximum(node.visits, 1))),
+            0.0,
+        )
+        u = self.c_puct * node.priors * math.sqrt(parent_visits + 1) / (1 + node.visits)
+        return int(np.argmax(q + u))
+
+    def _record_layout(self, actions: list[int]) -> None:
+        score = self.env.get_cached_score()
+        if score > self._best_score:
+            self._best_score = score
+            self._best_actions = list(actions)
+
+    def _descend(self, root: Node) -> PendingLeaf:
+        """Walk from the root to an unexpanded edge, applying virtual loss, and return the env to the root state."""
+        node = root
+        path: list[tuple[Node, int]] = []
+        actions: list[int] = []
+
+        while True:
+            edge = self._select(node)
+            action = int(node.actions[edge])
+            district, tile_key = self.env.decode_action(action)
+            tile = self.env.current_civ_map.tiles[tile_key]
+            node.rewards[edge] = self.env.shape_reward(district, tile, self.env.push_placement(action))
+            path.append((node, edge))
+            actions.append(action)
+
+            # Virtual loss, so the rest of the batch prefers other paths
+            node.visits[edge] += self.virtual_loss
+            node.value_sums[edge] -= self.virtual_loss
+
+            child = node.children.get(edge)
+            if child is None:
+                break
+            node = child
+
+        mask = self.env.action_mask()
+        if not mask.any():
+            self._record_layout(actions)
+        leaf = PendingLeaf(path=path, obs=self.env._get_obs(), mask=mask)
+
+        for _ in actions:
+            self.env.pop_placement()
+        return leaf
+
+    def _run_batch(self, root: Node) -> int:
+        leaves: dict[tuple[int, int], PendingLeaf] = {}
+        # Paths that reached an edge already pending in this batch share its evaluation
+        duplicates: list[tuple[list[tuple[Node, int]], PendingLeaf]] = []
+
+        for _ in range(self.batch_size):
+            leaf = self._descend(root)
+            parent, edge = leaf.path[-1]
+            key = (id(parent), edge)
+            if key in leaves:
+                duplicates.append((leaf.path, leaves[key]))
+            else:
+                leaves[key] = leaf
+
+        live = [leaf for leaf in leaves.values() if leaf.mask.any()]
+        values: dict[int, float] = {}
+        if live:
+            obs = np.stack([leaf.obs for leaf in live])
+            masks = np.stack([leaf.mask for leaf in live])
+            probs, predicted = self.evaluate(obs, masks)
+            for i, leaf in enumerate(live):
+                parent, edge = leaf.path[-1]
+                parent.children[edge] = Node.expand(leaf.mask, probs[i])
+                values[id(leaf)] = float(predicted[i])
+
+        # Terminal leaves have no future value
+        for leaf in leaves.values():
+            self._backup(leaf.path, values.get(id(leaf), 0.0))
+        for path, shared in duplicates:
+            self._backup(path, values.get(id(shared), 0.0))
+
+        return len(leaves) + len(duplicates)
+
+    def _backup(self, path: list[tuple[Node, int]], leaf_value: float) -> None:
+        value = leaf_value
+        for node, edge in reversed(path):
+            node.visits[edge] += 1 - self.virtual_loss
+            node.value_sums[edge] += value + self.virtual_loss
+            self._stats.update(node.rewards[edge] + self.gamma * value)
+            value = node.rewards[edge] + self.gamma * value
+
+    def _complete_line(self, root: Node, by_visits: bool) -> None:
+        """
+        Follow the tree, then the policy's most likely actions, to a complete layout.
+
+        Inside the tree, edges are chosen by visit count when by_visits is set and by prior otherwise.
+        """
+        actions: list[int] = []
+        node: Node | None = root
+
+        while self.env.action_mask().any():
+            if node is not None:
+                edge = int(np.argmax(node.visits if by_visits and node.visits.sum() > 0 else node.priors))
+                action = int(node.actions[edge])
+                node = node.children.get(edge)
+            else:
+                mask = self.env.action_mask()
+                probs, _ = self.evaluate(self.env._get_obs()[None], mask[None])
+                action = int(np.argmax(np.where(mask, probs[0], -1.0)))
+
+            self.env.push_placement(action)
+            actions.append(action)
+
+        self._record_layout(actions)
+        for _ in actions:
+            self.env.pop_placement()
@@ -0,0 +1,48 @@
+import asyncio
+import time
+from typing import Callable, TypeVar
+
+from fastapi import HTTPException, Request
+
+from backend.serving.metrics import RequestProfile, ServerMetrics, Stage
+from backend.serving.scheduler import Lane, LaneFullError
+from backend.serving.scoring_handlers import run_profiled
+from backend.serving.worker_pool import WorkerCrashedError, WorkerPool
+
+T = TypeVar("T")
+
+
+def route_of(request: Request) -> str:
+    # The route's path template rather than the requested path, so that unknown paths cannot add series without bound
+    route = request.scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+async def run_in_pool(request: Request, lane: Lane, fn: Callable[..., T], *args: object) -> tuple[T, RequestProfile]:
+    """
+    Run a handler in a worker process of the app's pool, recording how long the request took to validate and what
+    the handler did.
+
+    Returns:
+        The handler's result, and the profile it recorded
+
+    Raises:
+        HTTPException: 503 if the lane's queue is full or the worker crashed, 504 if the request timed out
+    """
+    pool: WorkerPool = request.app.state.pool
+    metrics: ServerMetrics = request.app.state.metrics
+    route = route_of(request)
+    metrics.stage_seconds.observe(
+        time.perf_counter() - request.state.received_at, route=route, stage=Stage.VALIDATION.value
+    )
+    try:
+        result, profile = await pool.run(lane, run_profiled, fn, *args)
+    except LaneFullError:
+        raise HTTPException(status_code=503, detail="Server is busy, try again shortly", headers={"Retry-After": "1"})
+    except WorkerCrashedError:
+        # The pool is restarted by then, so the request can be retried like one rejected for load
+        raise HTTPException(status_code=503, detail="Worker crashed, try again shortly", headers={"Retry-After": "1"})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Request timed out")
+    metrics.record_profile(route, profile)
+    return result, profile
@@ -0,0 +1,141 @@
+import time
+from enum import Enum
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from pydantic import TypeAdapter
+
+from backend.civenv import CivEnv, ObservationMode
+from backend.data_transfer.dto_converters import convert_dto_grid_to_map, convert_grid_to_dto
+from backend.data_transfer.tile_string import TileString
+from backend.logger import setup_logger
+from backend.planning.exact import BranchAndBoundSolver
+from backend.planning.greedy import GreedyPlanner
+from backend.serving.metrics import Stage
+from backend.serving.scoring_handlers import PROFILE, init_scoring_worker
+
+if TYPE_CHECKING:
+    from sb3_contrib import MaskablePPO
+
+logger = setup_logger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+DTO_GRID_ADAPTER = TypeAdapter(dict[str, TileString])
+
+
+class Planner(str, Enum):
+    """How /analyze-map chooses placements."""
+
+    # One deterministic policy action per step
+    POLICY = "policy"
+    # Monte Carlo tree search guided by the policy, within a time budget
+    MCTS = "mcts"
+    # Branch and bound over placements, optimal when it finishes within the time budget
+    EXACT = "exact"
+    # Best marginal gain at every step, optionally looking a few steps ahead. Needs no model.
+    GREEDY = "greedy"
+
+    @property
+    def uses_model(self) -> bool:
+        return self in (Planner.POLICY, Planner.MCTS)
+
+
+MODEL_PATH = BASE_DIR.parent / "agents" / "civ_agent_v1.0"
+MODEL: "MaskablePPO | None" = None
+
+
+def model_available() -> bool:
+    return MODEL_PATH.with_suffix(".zip").exists()
+
+
+def get_model() -> "MaskablePPO":
+    # Imported here so that planners without a model never load torch
+    from sb3_contrib import MaskablePPO
+
+    global MODEL
+    if MODEL is None:
+        start = time.perf_counter()
+        MODEL = MaskablePPO.load(MODEL_PATH)
+        # Kept by the profile across requests, so every response reports it
+        PROFILE.model_load_seconds = time.perf_counter() - start
+        logger.info(f"Loaded the model in {PROFILE.model_load_seconds:.2f}s")
+    return MODEL
+
+
+def init_worker() -> None:
+    """
+    Preload everything a request needs, so the first request to each worker process does not pay for it.
+
+    Runs once in every worker process of the pool.
+    """
+    init_scoring_worker()
+
+    if model_available():
+        get_model()
+    else:
+        logger.warning(f"No model at {MODEL_PATH}, /analyze-map will use the greedy planner until one is trained")
+
+
+def analyze_map(
+    grid: dict[str, TileString], planner: Planner = Planner.POLICY, budget_ms: int = 1000, lookahead: int = 1
+) -> bytes:
+    """
+    Place districts on the given map with the chosen planner.
+
+    Args:
+        grid: The map to plan on
+        planner: How placements are chosen
+        budget_ms: Wall-clock search budget, for planners that search
+        lookahead: How many placements the greedy planner looks ahead
+
+    Returns:
+        The final layout, already serialized as JSON so it is cheap to send back from a worker process.
+    """
+    with PROFILE.stage(Stage.CONVERSION):
+        civ_map = convert_dto_grid_to_map(grid)
+
+    with PROFILE.stage(Stage.INFERENCE):
+        observation_mode = ObservationMode.FLOAT
+        if planner.uses_model:
+            # The agent reads observations in the encoding it was trained with
+            observation_mode = ObservationMode.of_space(get_model().observation_space)
+        eval_env = CivEnv([civ_map], observation_mode)
+        obs, _ = eval_env.reset()
+
+        if planner is Planner.EXACT:
+            solved = BranchAndBoundSolver(eval_env).solve(budget_ms / 1000)
+            for planned_action in solved.actions:
+                eval_env.push_placement(planned_action)
+            PROFILE.steps = len(solved.actions)
+        elif planner is Planner.GREEDY:
+            greedy = GreedyPlanner(eval_env, lookahead=lookahead).plan()
+            for planned_action in greedy.actions:
+                eval_env.push_placement(planned_action)
+            PROFILE.steps = len(greedy.actions)
+        elif planner is Planner.MCTS:
+            from backend.planning.mcts import MCTSPlanner
+
+            result = MCTSPlanner(get_model(), eval_env).plan(budget_ms / 1000)
+            for planned_action in result.actions:
+                eval_env.push_placement(planned_action)
+            PROFILE.steps = len(result.actions)
+            PROFILE.forward_passes = result.forward_passes
+        else:
+            model = get_model()
+            terminated = False
+            truncated = False
+
+            while not (terminated or truncated):
+                action_masks = eval_env.action_mask()
+                action, _states = model.predict(obs, action_masks=action_masks, deterministic=True)
+                obs, reward, terminated, truncated, info = eval_env.step(int(action))
+                PROFILE.forward_passes += 1
+                PROFILE.steps += 1
+
+    with PROFILE.stage(Stage.SCORING):
+        score = eval_env.get_cached_score_result()
+    with PROFILE.stage(Stage.CONVERSION):
+        dto = convert_grid_to_dto(eval_env.current_civ_map.tiles, score=score)
+        layout_json = DTO_GRID_ADAPTER.dump_json(dto)
+    return layout_json
@@ -0,0 +1,46 @@
+"""
+/analyze-map, only imported by servers that plan, since it brings in the environment and, with a model, torch.
+"""
+
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import Response
+
+from backend.data_transfer.tile_string import TileString
+from backend.logger import setup_logger
+from backend.serving import handlers
+from backend.serving.dispatch import run_in_pool
+from backend.serving.metrics import ServerMetrics
+from backend.serving.scheduler import Lane
+from backend.serving.worker_pool import WorkerPool
+
+logger = setup_logger(__name__)
+
+router = APIRouter()
+
+
+@router.post("/analyze-map", response_model=dict[str, TileString])
+async def analyze_map(
+    request: Request,
+    grid: dict[str, TileString],
+    planner: handlers.Planner = handlers.Planner.POLICY,
+    budget_ms: int = Query(default=1000, ge=0, le=20_000),
+    lookahead: int = Query(default=1, ge=1, le=3),
+) -> Response:
+    pool: WorkerPool = request.app.state.pool
+    metrics: ServerMetrics = request.app.state.metrics
+
+    # Fall back to the greedy planner rather than failing when there is no model, or inference is saturated or off
+    if planner.uses_model and not handlers.model_available():
+        logger.warning(f"No model for the {planner.value} planner, using the greedy planner")
+        planner = handlers.Planner.GREEDY
+    elif planner is not handlers.Planner.GREEDY and pool.scheduler.is_full(Lane.INFERENCE):
+        logger.info(f"Inference lane is full, using the greedy planner instead of {planner.value}")
+        planner = handlers.Planner.GREEDY
+
+    # The greedy planner takes milliseconds, like scoring, so it does not wait behind searches
+    lane = Lane.SCORING if planner is handlers.Planner.GREEDY else Lane.INFERENCE
+    layout_json, profile = await run_in_pool(request, lane, handlers.analyze_map, grid, planner, budget_ms, lookahead)
+    metrics.forward_passes.observe(profile.forward_passes, planner=planner.value)
+    metrics.episode_steps.observe(profile.steps, planner=planner.value)
+    # Returning a Response skips FastAPI re-validating the already-validated tiles against the response_model.
+    return Response(content=layout_json, media_type="application/json", headers={"X-Planner": planner.value})
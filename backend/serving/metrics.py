@@ -0,0 +1,304 @@
+import math
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Callable, Iterator, TypeVar
+
+from backend.serving.scheduler import LaneScheduler
+
+# Seconds, from a fast /calculate to an /analyze-map search using its whole budget
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = tuple[str, ...]
+
+
+class Stage(str, Enum):
+    """The parts of a request whose time is recorded separately."""
+
+    # Receiving and validating the request body, in the server process
+    VALIDATION = "validation"
+    # Converting between API tiles and the internal map, and serializing the response
+    CONVERSION = "conversion"
+    # Computing yields
+    SCORING = "scoring"
+    # Evaluating placement rules
+    LEGALITY = "legality"
+    # Building the env and choosing placements, with or without a model
+    INFERENCE = "inference"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues) -> str:
+    if not names:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Metric(ABC):
+    """
+    A metric family with fixed label names, rendered in the Prometheus text exposition format.
+
+    Label values are passed as keyword arguments, and every combination seen gets its own series.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        """
+        Raises:
+            ValueError: If the labels are not exactly the metric's label names
+        """
+        if labels.keys() != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> Iterator[str]:
+        """The metric's lines in the exposition format, without the HELP and TYPE header."""
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(f"{sample}\n" for sample in self.samples())
+
+
+class _ValueMetric(Metric):
+    """
+    A metric with a single value per series.
+
+    The values are either updated by the metric's own methods, or read when rendered from collect, which returns the
+    value of every series by its label values. Reading state that something else already keeps avoids updating a copy
+    of it on every change.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        collect: Callable[[], dict[LabelValues, float]] | None = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+        self._collect = collect
+
+    def samples(self) -> Iterator[str]:
+        values = self._collect() if self._collect is not None else self._values
+        for key, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Counter(_ValueMetric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_ValueMetric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per series: the count in each bucket (not cumulative, with one more for +Inf), the sum and the count
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        bucket = 0
+        while bucket < len(self.buckets) and value > self.buckets[bucket]:
+            bucket += 1
+        counts[bucket] += 1
+        self._sums[key] += value
+
+    def samples(self) -> Iterator[str]:
+        bucket_names = (*self.labelnames, "le")
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                labels = _format_labels(bucket_names, (*key, _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(self._sums[key])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+M = TypeVar("M", bound=Metric)
+
+
+class MetricsRegistry:
+    """The metrics of one process, rendered together for a /metrics endpoint."""
+
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: M) -> M:
+        """
+        Raises:
+            ValueError: If a metric of the same name is already registered
+        """
+        if any(m.name == metric.name for m in self.metrics):
+            raise ValueError(f"A metric named {metric.name} is already registered")
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self.metrics)
+
+
+@dataclass
+class RequestProfile:
+    """
+    What a request did inside a worker process, sent back with its result so the server can record it.
+
+    Worker processes keep no metrics of their own, so nothing has to be gathered from them when /metrics is read.
+    """
+
+    # Seconds spent in each stage
+    stages: dict[Stage, float] = field(default_factory=dict)
+    # Policy network evaluations, each of a single observation or a batch
+    forward_passes: int = 0
+    # Placements made, for requests that run an episode
+    steps: int = 0
+    # How long the worker took to load its model, if it has one
+    model_load_seconds: float | None = None
+
+    def reset(self) -> None:
+        """Start recording a new request. The model load time stays, as it belongs to the process."""
+        self.stages = {}
+        self.forward_passes = 0
+        self.steps = 0
+
+    @contextmanager
+    def stage(self, stage: Stage) -> Iterator[None]:
+        """Add the time spent inside the block to the stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage] = self.stages.get(stage, 0.0) + time.perf_counter() - start
+
+
+class ServerMetrics:
+    """
+    The metrics the API server exposes on /metrics.
+
+    Request latencies are recorded as requests finish, and what requests did inside worker processes when their
+    RequestProfile comes back. Queue depths and scheduler counts are read from the scheduler when rendered.
+    """
+
+    def __init__(self, scheduler: LaneScheduler):
+        self.scheduler = scheduler
+        self.registry = MetricsRegistry()
+        register = self.registry.register
+
+        self.request_seconds = register(
+            Histogram(
+                "civ_request_duration_seconds",
+                "Time from a request arriving to its response being ready.",
+                ("method", "route", "status"),
+            )
+        )
+        self.stage_seconds = register(
+            Histogram("civ_request_stage_seconds", "Time requests spent in each stage.", ("route", "stage"))
+        )
+        self.forward_passes = register(
+            Histogram(
+                "civ_forward_passes_per_request",
+                "Policy network evaluations per /analyze-map request.",
+                ("planner",),
+                COUNT_BUCKETS,
+            )
+        )
+        self.episode_steps = register(
+            Histogram("civ_episode_steps", "Placements per /analyze-map episode.", ("planner",), COUNT_BUCKETS)
+        )
+        self.model_load_seconds = register(
+            Gauge("civ_model_load_seconds", "Seconds the worker process that reported last took to load its model.")
+        )
+        self.cache_lookups = register(
+            Counter(
+                "civ_response_cache_lookups_total", "Response cache lookups, by whether they hit.", ("route", "outcome")
+            )
+        )
+        register(
+            Gauge(
+                "civ_queue_depth",
+                "Requests waiting for a worker process.",
+                ("lane",),
+                collect=lambda: {(lane.name.lower(),): scheduler.queue_depth(lane) for lane in scheduler.lanes},
+            )
+        )
+        register(
+            Gauge(
+                "civ_in_flight_requests",
+                "Requests running in a worker process.",
+                ("lane",),
+                collect=lambda: {(lane.name.lower(),): stats.in_flight for lane, stats in scheduler.stats.items()},
+            )
+        )
+        register(
+            Counter(
+                "civ_scheduled_requests_total",
+                "Requests given a worker process, rejected because their lane was full, or timed out.",
+                ("lane", "outcome"),
+                collect=self._scheduler_outcomes,
+            )
+        )
+
+    def _scheduler_outcomes(self) -> dict[LabelValues, float]:
+        outcomes: dict[LabelValues, float] = {}
+        for lane, stats in self.scheduler.stats.items():
+            name = lane.name.lower()
+            outcomes[(name, "served")] = stats.served
+            outcomes[(name, "rejected")] = stats.rejected
+            outcomes[(name, "timed_out")] = stats.timed_out
+        return outcomes
+
+    def record_profile(self, route: str, profile: RequestProfile) -> None:
+        """Record the stage times of a request, as measured in its worker process."""
+        for stage, seconds in profile.stages.items():
+            self.stage_seconds.observe(seconds, route=route, stage=stage.value)
+        if profile.model_load_seconds is not None:
+            self.model_load_seconds.set(profile.model_load_seconds)
+
+    def render(self) -> str:
+        return self.registry.render()
@@ -0,0 +1,33 @@
+import hashlib
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Response bodies of recent requests, by a hash of the request body, dropping the least recently used when full.
+
+    Only for endpoints whose response depends on nothing but the body. A hit is answered by the server process without
+    going through the worker pool.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._entries: OrderedDict[bytes, bytes] = OrderedDict()
+
+    @staticmethod
+    def key(body: bytes) -> bytes:
+        return hashlib.blake2b(body, digest_size=16).digest()
+
+    def get(self, key: bytes) -> bytes | None:
+        content = self._entries.get(key)
+        if content is not None:
+            self._entries.move_to_end(key)
+        return content
+
+    def put(self, key: bytes, content: bytes) -> None:
+        if self.capacity <= 0:
+            return
+        self._entries[key] = content
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
@@ -0,0 +1,150 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+
+
+class Lane(IntEnum):
+    """Request classes, in priority order: a lower value is always dispatched first."""
+
+    SCORING = 0
+    INFERENCE = 1
+
+
+class LaneFullError(Exception):
+    """Raised when a request arrives while its lane's queue is full."""
+
+
+@dataclass(frozen=True)
+class LaneConfig:
+    max_concurrency: int
+    max_queue: int
+    timeout: float
+
+
+@dataclass
+class LaneStats:
+    in_flight: int = 0
+    served: int = 0
+    rejected: int = 0
+    timed_out: int = 0
+    recent_waits: deque[float] = field(default_factory=lambda: deque(maxlen=1024))
+
+    def record_wait(self, seconds: float) -> None:
+        self.served += 1
+        self.recent_waits.append(seconds)
+
+    def wait_percentile(self, fraction: float) -> float:
+        if not self.recent_waits:
+            return 0.0
+        waits = sorted(self.recent_waits)
+        return waits[min(len(waits) - 1, int(fraction * len(waits)))]
+
+
+@dataclass
+class Waiter:
+    future: asyncio.Future[None]
+    enqueued_at: float
+
+
+class LaneScheduler:
+    """
+    Hands out a fixed number of execution slots to requests from several lanes.
+
+    Whenever a slot frees up it goes to the highest priority lane that has a queued request and is below its own
+    concurrency limit, so scoring requests never wait behind queued inference. Keeping the inference limit below the
+    number of slots also leaves a slot free for scoring while inference traffic saturates its own lane.
+    """
+
+    slots: int
+    lanes: dict[Lane, LaneConfig]
+    stats: dict[Lane, LaneStats]
+    _queues: dict[Lane, deque[Waiter]]
+    _busy: int
+
+    def __init__(self, slots: int, lanes: dict[Lane, LaneConfig]):
+        self.slots = slots
+        self.lanes = lanes
+        self.stats = {lane: LaneStats() for lane in lanes}
+        self._queues = {lane: deque() for lane in lanes}
+        self._busy = 0
+
+    def queue_depth(self, lane: Lane) -> int:
+        return len(self._queues[lane])
+
+    def is_full(self, lane: Lane) -> bool:
+        """Whether acquire() on the lane would be rejected right now."""
+        queue = self._queues[lane]
+        return not (not queue and self._can_dispatch(lane)) and len(queue) >= self.lanes[lane].max_queue
+
+    async def acquire(self, lane: Lane) -> None:
+        """
+        Wait for a slot in the given lane. Every successful acquire() must be paired with a release().
+
+        Raises:
+            LaneFullError: If the lane's queue is already full
+        """
+        stats = self.stats[lane]
+        queue = self._queues[lane]
+
+        if not queue and self._can_dispatch(lane):
+            self._start(lane)
+            stats.record_wait(0.0)
+            return
+
+        if len(queue) >= self.lanes[lane].max_queue:
+            stats.rejected += 1
+            raise LaneFullError(f"{lane.name.lower()} queue is full")
+
+        waiter = Waiter(asyncio.get_running_loop().create_future(), time.perf_counter())
+        queue.append(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.cancelled():
+                if waiter in queue:
+                    queue.remove(waiter)
+            else:
+                # The slot was handed over just as the request was cancelled, so pass it on.
+                self.release(lane)
+            raise
+
+        stats.record_wait(time.perf_counter() - waiter.enqueued_at)
+
+    def release(self, lane: Lane) -> None:
+        self._busy -= 1
+        self.stats[lane].in_flight -= 1
+        self._dispatch()
+
+    def _can_dispatch(self, lane: Lane) -> bool:
+        return self._busy < self.slots and self.stats[lane].in_flight < self.lanes[lane].max_concurrency
+
+    def _start(self, lane: Lane) -> None:
+        self._busy += 1
+        self.stats[lane].in_flight += 1
+
+    def _dispatch(self) -> None:
+        for lane in sorted(self.lanes):
+            queue = self._queues[lane]
+            while queue and self._can_dispatch(lane):
+                waiter = queue.popleft()
+                if waiter.future.cancelled():
+                    continue
+                self._start(lane)
+                waiter.future.set_result(None)
+
+    def snapshot(self) -> dict[str, dict[str, int | float]]:
+        return {
+            lane.name.lower(): {
+                "queue_depth": len(self._queues[lane]),
+                "in_flight": stats.in_flight,
+                "served": stats.served,
+                "rejected": stats.rejected,
+                "timed_out": stats.timed_out,
+                "wait_p50_ms": stats.wait_percentile(0.5) * 1000,
+                "wait_p99_ms": stats.wait_percentile(0.99) * 1000,
+                "wait_max_ms": max(stats.recent_waits, default=0.0) * 1000,
+            }
+            for lane, stats in self.stats.items()
+        }
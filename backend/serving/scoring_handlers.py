@@ -0,0 +1,110 @@
+"""
+The handlers a scoring-only server needs, importing neither the environment, the planners nor any ML library.
+
+Worker processes of a scoring-only server import only this module, so they start in a fraction of the time and memory
+of full ones.
+"""
+
+import base64
+import math
+from typing import Any, Callable, TypeVar
+
+from backend.data_transfer.dto_converters import convert_dto_grid_to_grid, convert_yields_to_dto
+from backend.data_transfer.enum_tables import DISTRICT_TO_STRING, IMPROVEMENT_TO_STRING, YIELD_TYPE_TO_STRING
+from backend.data_transfer.tile_string import TileString
+from backend.models.civmap import CivMap
+from backend.placement.district_legality import PLACEABLE_DISTRICTS, get_district_legality, pack_legality
+from backend.placement.improvement_legality import PLACEABLE_IMPROVEMENTS, get_improvement_legality, legality_table
+from backend.serving.metrics import RequestProfile, Stage
+from backend.yields.yield_logic import get_score
+
+T = TypeVar("T")
+
+# What the request running in this process has done so far, reset by run_profiled() for every request
+PROFILE = RequestProfile()
+
+
+def run_profiled(fn: Callable[..., T], *args: object) -> tuple[T, RequestProfile]:
+    """Run a handler with PROFILE reset, returning what it recorded along with its result."""
+    PROFILE.reset()
+    return fn(*args), PROFILE
+
+
+def init_scoring_worker() -> None:
+    """
+    Preload everything a scoring request needs, so the first request to each worker process does not pay for it.
+
+    Runs once in every worker process of the pool.
+    """
+    empty_map = CivMap()
+    empty_map.create_empty_map()
+    get_score(empty_map.tiles)
+    legality_table()
+
+
+def calculate_score(grid: dict[str, TileString]) -> dict[str, Any]:
+    with PROFILE.stage(Stage.CONVERSION):
+        internal_grid = convert_dto_grid_to_grid(grid)
+    with PROFILE.stage(Stage.SCORING):
+        score = get_score(internal_grid)
+
+    with PROFILE.stage(Stage.CONVERSION):
+        summary_out: dict[str, int] = {}
+        for yield_type, value in score.summary.items():
+            summary_out[YIELD_TYPE_TO_STRING[yield_type]] = math.floor(value)
+
+        tiles_out: dict[str, dict[str, float]] = {}
+        for tile_key, info in score.tiles.items():
+            tiles_out[tile_key] = convert_yields_to_dto(info)
+
+    return {
+        "summary": summary_out,
+        "tiles": tiles_out,
+    }
+
+
+def improvement_legality(grid: dict[str, TileString]) -> dict[str, Any]:
+    """
+    Which improvements can be placed on every tile of the map.
+
+    Returns:
+        The improvements, in the order of the rows, and for every tile a row saying whether each of them fits there
+    """
+    with PROFILE.stage(Stage.CONVERSION):
+        internal_grid = convert_dto_grid_to_grid(grid)
+    with PROFILE.stage(Stage.LEGALITY):
+        legal = get_improvement_legality(internal_grid)
+
+    with PROFILE.stage(Stage.CONVERSION):
+        improvements = [IMPROVEMENT_TO_STRING[improvement].value for improvement in PLACEABLE_IMPROVEMENTS]
+        rows = {f"{q},{r}": row for (q, r), row in zip(internal_grid, legal.tolist())}
+
+    return {
+        "improvements": improvements,
+        "legal": rows,
+    }
+
+
+def district_legality(grid: dict[str, TileString]) -> dict[str, Any]:
+    """
+    Which districts can be placed on every tile of the map, as a bitset per district.
+
+    Returns:
+        The tiles, in the order of the bits, and for every district its bitset encoded in base64
+    """
+    with PROFILE.stage(Stage.CONVERSION):
+        internal_grid = convert_dto_grid_to_grid(grid)
+    with PROFILE.stage(Stage.LEGALITY):
+        bitsets = pack_legality(get_district_legality(internal_grid))
+
+    with PROFILE.stage(Stage.CONVERSION):
+        tiles = [f"{q},{r}" for q, r in internal_grid]
+        legal = {
+            DISTRICT_TO_STRING[district].value: base64.b64encode(bitset).decode("ascii")
+            for district, bitset in zip(PLACEABLE_DISTRICTS, bitsets)
+        }
+
+    return {
+        "tiles": tiles,
+        "legal": legal,
+    }
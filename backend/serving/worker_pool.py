@@ -0,0 +1,160 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Callable, TypeVar
+
+from backend.logger import setup_logger
+from backend.serving.scheduler import Lane, LaneConfig, LaneScheduler
+from backend.utils import available_cores
+
+logger = setup_logger(__name__)
+
+T = TypeVar("T")
+
+
+class WorkerCrashedError(Exception):
+    """Raised when a worker process died while running a request, or the pool was broken by an earlier crash."""
+
+
+@dataclass(frozen=True)
+class PoolConfig:
+    workers: int
+    lanes: dict[Lane, LaneConfig]
+
+    @classmethod
+    def from_env(cls, inference: bool = True) -> "PoolConfig":
+        """
+        Read the pool configuration from the environment.
+
+        Without inference, the pool has only the scoring lane, which may use every worker.
+
+        CIV_WORKERS: Number of worker processes. Defaults to the number of usable cores.
+        CIV_SCORING_QUEUE: /calculate requests allowed to wait for a worker. Defaults to 8 per worker.
+        CIV_SCORING_TIMEOUT: Seconds a /calculate request may take, including time spent queued. Defaults to 5.
+        CIV_INFERENCE_CONCURRENCY: Workers /analyze-map may occupy at once. Defaults to, and is capped at, all but one,
+            so a worker is always free for scoring. With a single worker, the inference lane takes no requests.
+        CIV_INFERENCE_QUEUE: /analyze-map requests allowed to wait for a worker. Defaults to 2 per worker.
+        CIV_INFERENCE_TIMEOUT: Seconds an /analyze-map request may take, including time spent queued. Defaults to 30.
+        """
+        workers = max(1, int(os.getenv("CIV_WORKERS", available_cores())))
+        lanes = {
+            Lane.SCORING: LaneConfig(
+                max_concurrency=workers,
+                max_queue=int(os.getenv("CIV_SCORING_QUEUE", 8 * workers)),
+                timeout=float(os.getenv("CIV_SCORING_TIMEOUT", 5.0)),
+            ),
+        }
+        if inference:
+            concurrency = min(int(os.getenv("CIV_INFERENCE_CONCURRENCY", workers - 1)), workers - 1)
+            if concurrency == 0:
+                logger.warning("Only one worker, so /analyze-map only runs the greedy planner, on the scoring lane")
+            lanes[Lane.INFERENCE] = LaneConfig(
+                max_concurrency=concurrency,
+                max_queue=int(os.getenv("CIV_INFERENCE_QUEUE", 2 * workers)) if concurrency else 0,
+                timeout=float(os.getenv("CIV_INFERENCE_TIMEOUT", 30.0)),
+            )
+        return cls(workers=workers, lanes=lanes)
+
+
+class WorkerPool:
+    """
+    Runs CPU-bound request handlers in worker processes so they never block the event loop.
+
+    Each request goes through a LaneScheduler with one slot per worker, so the executor never has work queued
+    internally and the scheduler alone decides which lane runs next. Requests beyond a lane's queue limit are rejected
+    immediately rather than being queued without bound, which keeps latency bounded under load spikes.
+    """
+
+    config: PoolConfig
+    scheduler: LaneScheduler
+    # Run once in every worker process as it starts, to preload what requests need
+    initializer: Callable[[], None] | None
+    _executor: ProcessPoolExecutor | None
+
+    def __init__(self, config: PoolConfig, initializer: Callable[[], None] | None = None):
+        self.config = config
+        self.initializer = initializer
+        self.scheduler = LaneScheduler(config.workers, config.lanes)
+        self._executor = None
+
+    def start(self) -> None:
+        self._executor, futures = self._start_executor()
+        for future in futures:
+            future.result()
+        logger.info(f"Started {self.config.workers} worker processes")
+
+    def _start_executor(self) -> tuple[ProcessPoolExecutor, list[Future[int]]]:
+        executor = ProcessPoolExecutor(
+            max_workers=self.config.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=self.initializer,
+        )
+        # Start every worker now so model loading happens at startup instead of on the first requests.
+        return executor, [executor.submit(os.getpid) for _ in range(self.config.workers)]
+
+    def _replace_broken(self, executor: ProcessPoolExecutor) -> None:
+        """
+        Replace an executor broken by a worker process dying, with new workers that run the initializer again.
+
+        Every request that was running on the broken executor fails at once, so only the first one to get here replaces
+        it. The new workers start in the background rather than blocking the event loop while they load.
+        """
+        if self._executor is not executor:
+            return
+        logger.error("A worker process died, restarting the worker pool")
+        executor.shutdown(wait=False, cancel_futures=True)
+        self._executor, _ = self._start_executor()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, lane: Lane, fn: Callable[..., T], *args: object) -> T:
+        """
+        Run fn(*args) in a worker process once the lane is given a slot.
+
+        Raises:
+            LaneFullError: If the lane's queue is already full
+            asyncio.TimeoutError: If the request does not finish within the lane's timeout
+            WorkerCrashedError: If the worker process running the request died, in which case the pool is restarted
+        """
+        if self._executor is None:
+            raise RuntimeError("WorkerPool.start() must be called before running requests")
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.config.lanes[lane].timeout
+        try:
+            await asyncio.wait_for(self.scheduler.acquire(lane), timeout=deadline - loop.time())
+        except asyncio.TimeoutError:
+            self.scheduler.stats[lane].timed_out += 1
+            raise
+
+        # Read only once given a slot, since a crash may have replaced the executor while the request waited
+        executor = self._executor
+        if executor is None:
+            self.scheduler.release(lane)
+            raise RuntimeError("WorkerPool.shutdown() was called while the request waited")
+        try:
+            future: Future[T] = executor.submit(fn, *args)
+        except BrokenProcessPool as e:
+            self.scheduler.release(lane)
+            self._replace_broken(executor)
+            raise WorkerCrashedError("The worker pool is restarting") from e
+        except BaseException:
+            self.scheduler.release(lane)
+            raise
+        # A timed out request keeps its worker busy until it finishes, so its slot is only released then.
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.scheduler.release, lane))
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=deadline - loop.time())
+        except asyncio.TimeoutError:
+            self.scheduler.stats[lane].timed_out += 1
+            raise
+        except BrokenProcessPool as e:
+            self._replace_broken(executor)
+            raise WorkerCrashedError("A worker process died while running the request") from e
@@ -0,0 +1,95 @@
+"""
+Structured tracing for the scoring and placement hot paths, off unless turned on.
+
+Traced sites check tracing.ENABLED before building an event, so with tracing off they cost a lookup and a branch and
+nothing is formatted or allocated. With tracing on, events go into a ring buffer keeping the most recent ones, which
+dump() hands back for inspection. Each process has its own buffer, so events from scoring workers stay in the workers.
+
+Tracing starts on when CIV_TRACE=1, and the buffer holds CIV_TRACE_CAPACITY events (10000 by default).
+"""
+
+import os
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum, IntEnum
+
+from backend.logger import setup_logger
+from backend.models.civmap import Tile
+
+logger = setup_logger(__name__)
+
+# Read as tracing.ENABLED, never imported by name, so that enable() and disable() reach every traced site
+ENABLED = os.getenv("CIV_TRACE", "0") == "1"
+DEFAULT_CAPACITY = 10_000
+
+
+class TraceKind(str, Enum):
+    # An adjacency source adding to a district's yield. detail is the AdjacencySource, value what it added.
+    ADJACENCY = "adjacency"
+    # The adjacency yield of a district in get_score(). detail is the YieldType, value the yield.
+    DISTRICT_YIELD = "district_yield"
+    # A placement rule refusing a district or improvement on a tile. detail names the rule.
+    REJECTION = "rejection"
+
+
+@dataclass(frozen=True, slots=True)
+class TraceEvent:
+    kind: TraceKind
+    q: int
+    r: int
+    # The district or improvement the event is about
+    subject: IntEnum
+    # Kept as it was recorded, and only formatted by describe()
+    detail: object = None
+    value: float = 0.0
+
+    def describe(self) -> str:
+        text = f"{self.kind.value} at {self.q},{self.r} for {self.subject.name}"
+        if isinstance(self.detail, Enum):
+            text += f": {self.detail.name}"
+        elif self.detail is not None:
+            text += f": {self.detail}"
+        if self.kind is not TraceKind.REJECTION:
+            text += f" = {self.value:g}"
+        return text
+
+
+_events: deque[TraceEvent] = deque(maxlen=int(os.getenv("CIV_TRACE_CAPACITY", DEFAULT_CAPACITY)))
+
+
+def enable(capacity: int | None = None) -> None:
+    """
+    Start recording events.
+
+    Args:
+        capacity: How many of the most recent events to keep, if it should change. Events already recorded are kept.
+    """
+    global ENABLED, _events
+    if capacity is not None and capacity != _events.maxlen:
+        _events = deque(_events, maxlen=capacity)
+    ENABLED = True
+
+
+def disable() -> None:
+    """Stop recording events. Those already recorded stay until dumped."""
+    global ENABLED
+    ENABLED = False
+
+
+def record(kind: TraceKind, tile: Tile, subject: IntEnum, detail: object = None, value: float = 0.0) -> None:
+    """Add an event to the buffer. Callers check ENABLED first, so that nothing is built when tracing is off."""
+    _events.append(TraceEvent(kind, tile.q, tile.r, subject, detail, value))
+
+
+def dump(clear: bool = True) -> list[TraceEvent]:
+    """The recorded events, oldest first, emptying the buffer unless clear is False."""
+    events = list(_events)
+    if clear:
+        _events.clear()
+    return events
+
+
+def log_dump(clear: bool = True) -> None:
+    """Write the recorded events to the log at INFO, oldest first."""
+    for event in dump(clear):
+        logger.info(event.describe())
@@ -1,38 +1,184 @@
+import argparse
+import json
 import os
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field, fields, replace
+from enum import Enum
+from pathlib import Path
 from typing import Any, Callable
 
+import gymnasium as gym
+import torch as th
 from sb3_contrib.common.wrappers import ActionMasker
 from sb3_contrib.ppo_mask import MaskablePPO
-from stable_baselines3.common.callbacks import CheckpointCallback
+from stable_baselines3.common.callbacks import BaseCallback, CheckpointCallback
 from stable_baselines3.common.monitor import Monitor
 from stable_baselines3.common.utils import set_random_seed
-from stable_baselines3.common.vec_env import SubprocVecEnv
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecEnv
 
+from backend.distributed.data_parallel import DataParallelMaskablePPO, LearnerGroup, spawn_learners
+from backend.distributed.learner import (
+    AsyncMaskablePPO,
+    DistributedMaskablePPO,
+    RemoteEnvs,
+    RolloutServer,
+    spawn_local_workers,
+)
 from backend.logger import setup_logger
+from backend.perf.step_profiler import StepProfiler, run_episodes
 
-from .civenv import CivEnv
-from .utils import load_map_from_json
+from .civenv import CivEnv, ObservationMode
+from .feature_extractors import PackedPlanesExtractor, TileEmbeddingExtractor
+from .utils import DEFAULT_MAP_GLOB, THREAD_POOL_VARIABLES, available_cores, load_map_from_json, load_templates
 
 logger = setup_logger(__name__)
 
-MAP_COUNT = 11
-
 init_function = Callable[[], Monitor[Any, Any]]
 
+DEFAULT_PPO_KWARGS: dict[str, Any] = {
+    "policy": "MlpPolicy",
+    "verbose": 1,
+    "clip_range": 0.2,
+    "max_grad_norm": 0.5,
+    "learning_rate": 1e-4,
+    "ent_coef": 0.02,
+    "n_steps": 512,
+    "batch_size": 128,
+}
+
+
+class Vectorization(str, Enum):
+    """Where the training envs run."""
+
+    # Measure the cost of a step and decide
+    AUTO = "auto"
+    # One process per env, pinned to its own core
+    SUBPROCESS = "subprocess"
+    # All envs in the learner process, stepped one after another
+    IN_PROCESS = "in_process"
+    # Envs in rollout workers that collect whole trajectories and send them to the learner over TCP
+    DISTRIBUTED = "distributed"
+    # Like distributed, but workers keep collecting with the latest weights they have while the learner trains
+    ASYNC = "async"
+
+
+@dataclass
+class TrainingConfig:
+    """Everything a training run needs. Read from a JSON file with the same keys; missing keys keep these defaults."""
+
+    total_timesteps: int = 1_000_000
+    # None sizes it from the cores: one env per core but one in subprocesses, or 4 in process
+    num_envs: int | None = None
+    vectorization: Vectorization = Vectorization.AUTO
+    # With automatic vectorization, envs get their own processes if a step takes at least this long. Below that the
+    # cost of sending actions and observations between processes outweighs stepping in parallel.
+    subprocess_min_step_ms: float = 0.5
+    pin_workers: bool = True
+    # With distributed vectorization: where the learner listens for rollout workers, how many it starts on this
+    # machine (None starts one per core but the learner's), how many more it waits for from other machines, and how
+    # many envs each local worker runs
+    listen: str = "127.0.0.1:0"
+    local_workers: int | None = None
+    remote_workers: int = 0
+    envs_per_worker: int = 4
+    # Seconds to wait for all rollout workers to connect
+    worker_timeout: float = 60.0
+    # With async vectorization: how many trajectories may wait for the learner before workers pause, how many policy
+    # versions old a trajectory may be before it is dropped, and the V-trace importance ratio clips
+    queue_size: int = 8
+    max_policy_lag: int = 4
+    vtrace_rho_clip: float = 1.0
+    vtrace_c_clip: float = 1.0
+    # Learner processes training one model data-parallel, each with its own share of the cores, envs and minibatches
+    learner_processes: int = 1
+    # Threads torch may use in the learner process. None uses every available core, or with async vectorization, the
+    # cores not given to local rollout workers.
+    learner_threads: int | None = None
+    seed: int = 42
+    map_glob: str = DEFAULT_MAP_GLOB
+    # uint8 and packed observations make rollout buffers and trajectories sent by workers 4 and 32 times smaller than
+    # float32 ones, for the same policy. tiles observations are a row of 9 bytes per tile instead of planes, read by a
+    # policy that embeds each tile and passes messages between neighbors.
+    observation_mode: ObservationMode = ObservationMode.FLOAT
+    # Cities an episode may found, each building its own districts
+    max_cities: int = 1
+    monitor_dir: str = "../civ_ai_logs/"
+    # None turns TensorBoard logging off
+    tensorboard_log: str | None = "./civ_ai_logs/"
+    checkpoint_dir: str = "./agents/checkpoints/"
+    # In env steps, summed over all envs
+    checkpoint_every: int = 100_000
+    # Held-out maps a separate process scores every checkpoint on as it is saved, logged under eval/. None turns it
+    # off. The evaluator runs eval_workers processes at a lower priority than training, each playing a deterministic
+    # and eval_sampled sampled episodes per map.
+    eval_map_glob: str | None = None
+    eval_sampled: int = 4
+    eval_workers: int = 1
+    model_path: str = "./agents/civ_agent_v1.0"
+    # Keyword arguments for MaskablePPO, on top of DEFAULT_PPO_KWARGS
+    ppo: dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_file(cls, path: Path) -> "TrainingConfig":
+        """
+        Raises:
+            ValueError: If the file has keys that are not config fields
+        """
+        values = json.loads(path.read_text())
+        unknown = set(values) - {f.name for f in fields(cls)}
+        if unknown:
+            raise ValueError(f"Unknown training config keys in {path}: {', '.join(sorted(unknown))}")
+        if "vectorization" in values:
+            values["vectorization"] = Vectorization(values["vectorization"])
+        if "observation_mode" in values:
+            values["observation_mode"] = ObservationMode(values["observation_mode"])
+        return cls(**values)
+
+    def ppo_kwargs(self) -> dict[str, Any]:
+        kwargs = {**DEFAULT_PPO_KWARGS, **self.ppo}
+        if self.observation_mode is ObservationMode.PACKED:
+            kwargs["policy_kwargs"] = {
+                "features_extractor_class": PackedPlanesExtractor,
+                **kwargs.get("policy_kwargs", {}),
+            }
+        elif self.observation_mode is ObservationMode.TILES:
+            kwargs["policy_kwargs"] = {
+                "features_extractor_class": TileEmbeddingExtractor,
+                **kwargs.get("policy_kwargs", {}),
+            }
+        return kwargs
+
+
+def make_env(
+    rank: int,
+    seed: int = 0,
+    map_paths: list[Path] | None = None,
+    monitor_dir: str = "../civ_ai_logs/",
+    core: int | None = None,
+    observation_mode: ObservationMode = ObservationMode.FLOAT,
+    max_cities: int = 1,
+) -> init_function:
+    """
+    A function creating one training env, to run either in process or in a worker process.
+
+    When core is given, the process the env is created in is pinned to that core and limited to one torch thread, so
+    workers never compete with each other for cores.
+    """
 
-def make_env(rank: int, seed: int = 0) -> init_function:
     def _init() -> Monitor[Any, Any]:
-        log_dir = "../civ_ai_logs/"
-        os.makedirs(log_dir, exist_ok=True)
+        if core is not None:
+            if hasattr(os, "sched_setaffinity"):
+                os.sched_setaffinity(0, {core})
+            th.set_num_threads(1)
 
-        template_maps = []
-        for i in range(MAP_COUNT):
-            civ_map = load_map_from_json(f"maps/civ_test_map{i}.json")
-            template_maps.append(civ_map)
+        os.makedirs(monitor_dir, exist_ok=True)
+        template_maps = [load_map_from_json(str(path)) for path in map_paths or load_templates(DEFAULT_MAP_GLOB)]
 
-        env = CivEnv(template_maps)
+        env = CivEnv(template_maps, observation_mode, max_cities)
         env = ActionMasker(env, lambda e: e.action_mask())
-        env = Monitor(env, filename=os.path.join(log_dir, str(rank)))
+        env = Monitor(env, filename=os.path.join(monitor_dir, str(rank)))
 
         env.reset(seed=seed + rank)
         return env
@@ -41,30 +187,369 @@ def make_env(rank: int, seed: int = 0) -> init_function:
     return _init
 
 
-if __name__ == "__main__":
-    num_envs = 4
-
-    vec_env = SubprocVecEnv([make_env(rank=i, seed=42) for i in range(num_envs)])
-
-    model = MaskablePPO(
-        "MlpPolicy",
-        vec_env,
-        verbose=1,
-        tensorboard_log="./civ_ai_logs/",
-        clip_range=0.2,
-        max_grad_norm=0.5,
-        learning_rate=1e-4,
-        ent_coef=0.02,
-        n_steps=512,
-        batch_size=128,
+def measure_step_seconds(map_paths: list[Path], episodes: int = 5, seed: int = 0) -> float:
+    """Mean wall time of one CivEnv step in this process, along random legal episodes."""
+    profiled = StepProfiler(CivEnv([load_map_from_json(str(path)) for path in map_paths]))
+    run_episodes(profiled, episodes, seed)
+    return profiled.report.step_seconds / max(1, profiled.report.steps)
+
+
+def choose_vectorization(config: TrainingConfig, map_paths: list[Path], cores: int) -> Vectorization:
+    if config.vectorization is not Vectorization.AUTO:
+        return config.vectorization
+    if cores < 2:
+        return Vectorization.IN_PROCESS
+
+    step_ms = measure_step_seconds(map_paths, seed=config.seed) * 1000
+    chosen = Vectorization.SUBPROCESS if step_ms >= config.subprocess_min_step_ms else Vectorization.IN_PROCESS
+    logger.info(f"Env steps take {step_ms:.2f} ms in process, using {chosen.value} vectorization")
+    return chosen
+
+
+def usable_cores() -> list[int]:
+    return sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(available_cores()))
+
+
+def build_vec_env(config: TrainingConfig, map_paths: list[Path]) -> VecEnv:
+    """
+    Create the training envs, sized and placed for the cores this process may use.
+
+    Worker processes start with their native thread pools limited to one thread, and are pinned round robin to every
+    core but the first, which is left to the learner while rollouts are collected.
+    """
+    cores = usable_cores()
+    vectorization = choose_vectorization(config, map_paths, len(cores))
+
+    if vectorization is Vectorization.IN_PROCESS:
+        num_envs = config.num_envs or 4
+        factories: list[Callable[[], gym.Env[Any, Any]]] = [
+            make_env(
+                rank,
+                config.seed,
+                map_paths,
+                config.monitor_dir,
+                observation_mode=config.observation_mode,
+                max_cities=config.max_cities,
+            )
+            for rank in range(num_envs)
+        ]
+        logger.info(f"Running {num_envs} envs in process")
+        return DummyVecEnv(factories)
+
+    num_envs = config.num_envs or max(1, len(cores) - 1)
+    worker_cores = cores[1:] or cores
+    factories = [
+        make_env(
+            rank,
+            config.seed,
+            map_paths,
+            config.monitor_dir,
+            core=worker_cores[rank % len(worker_cores)] if config.pin_workers else None,
+            observation_mode=config.observation_mode,
+            max_cities=config.max_cities,
+        )
+        for rank in range(num_envs)
+    ]
+
+    # Worker processes read these when they start, so they are only set while the workers are created
+    previous = {name: os.environ.get(name) for name in THREAD_POOL_VARIABLES}
+    os.environ.update(dict.fromkeys(THREAD_POOL_VARIABLES, "1"))
+    try:
+        vec_env = SubprocVecEnv(factories, start_method="spawn")
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    logger.info(f"Running {num_envs} envs in worker processes on {len(worker_cores)} cores")
+    return vec_env
+
+
+def local_worker_count(config: TrainingConfig, cores: int) -> int:
+    return config.local_workers if config.local_workers is not None else max(1, cores - 1)
+
+
+def learner_thread_count(config: TrainingConfig) -> int:
+    if config.learner_threads is not None:
+        return config.learner_threads
+    cores = available_cores()
+    if config.vectorization is Vectorization.ASYNC:
+        # Workers and the learner run at the same time, so they must not compete for cores
+        return max(1, cores - local_worker_count(config, cores))
+    return cores
+
+
+def build_remote_envs(
+    config: TrainingConfig, map_paths: list[Path]
+) -> tuple[RemoteEnvs, list[subprocess.Popen[bytes]]]:
+    """
+    Start the local rollout workers and wait until they and the remote ones have connected.
+
+    Local workers are pinned like subprocess envs, to every core but the first. Remote workers are started by hand with
+    python -m backend.distributed.worker, pointed at config.listen.
+    """
+    cores = usable_cores()
+    local_workers = local_worker_count(config, len(cores))
+    worker_cores = cores[1:] or cores
+
+    server = RolloutServer(config.listen)
+    logger.info(
+        f"Waiting for {local_workers} local and {config.remote_workers} remote rollout workers on {server.address}"
+    )
+    workers = spawn_local_workers(
+        server.address, local_workers, config.envs_per_worker, worker_cores if config.pin_workers else None
+    )
+    try:
+        server.accept(local_workers + config.remote_workers, config.worker_timeout)
+    except BaseException:
+        server.close()
+        for worker in workers:
+            worker.kill()
+        raise
+
+    spaces_env = CivEnv([load_map_from_json(str(map_paths[0]))], config.observation_mode)
+    logger.info(f"Running {server.num_envs} envs in {len(server.connections)} rollout workers")
+    return RemoteEnvs(server, spaces_env.observation_space, spaces_env.action_space), workers
+
+
+class ThroughputCallback(BaseCallback):
+    """
+    Reports env steps per second while collecting rollouts, and over the whole run including learning.
+
+    In a data-parallel run, the rollout rate measured in this process is scaled up to all learner processes, which
+    collect in lockstep.
+    """
+
+    def __init__(self, processes: int = 1) -> None:
+        super().__init__()
+        self.processes = processes
+        self._training_start = 0.0
+        self._rollout_start = 0.0
+        self._rollout_start_steps = 0
+
+    def _on_training_start(self) -> None:
+        self._training_start = time.perf_counter()
+
+    def _on_rollout_start(self) -> None:
+        self._rollout_start = time.perf_counter()
+        self._rollout_start_steps = self.num_timesteps
+
+    def _on_step(self) -> bool:
+        return True
+
+    def _on_rollout_end(self) -> None:
+        elapsed = time.perf_counter() - self._rollout_start
+        steps_per_sec = self.processes * (self.num_timesteps - self._rollout_start_steps) / max(elapsed, 1e-9)
+        self.logger.record("time/rollout_env_steps_per_sec", steps_per_sec)
+
+    def _on_training_end(self) -> None:
+        elapsed = time.perf_counter() - self._training_start
+        steps = self.model.num_timesteps
+        logger.info(f"Trained for {steps} env steps at {steps / elapsed:,.0f} env steps/s")
+
+
+class EvaluationLogCallback(BaseCallback):
+    """
+    Logs the background evaluator's results under eval/ as they come in.
+
+    After every rollout, only the lines appended to the results file since the last one are read, so training never
+    waits for an evaluation.
+    """
+
+    def __init__(self, results_path: Path) -> None:
+        super().__init__()
+        self.results_path = results_path
+        self._offset = 0
+
+    def _on_training_start(self) -> None:
+        # Results of earlier runs are not this run's
+        self._offset = self.results_path.stat().st_size if self.results_path.exists() else 0
+
+    def _on_step(self) -> bool:
+        return True
+
+    def _on_rollout_end(self) -> None:
+        if not self.results_path.exists():
+            return
+        with self.results_path.open("rb") as f:
+            f.seek(self._offset)
+            appended = f.read()
+        # A line still being written is left for the next rollout
+        complete = appended[: appended.rfind(b"\n") + 1]
+        self._offset += len(complete)
+        for line in complete.splitlines():
+            result = json.loads(line)
+            self.logger.record("eval/mean_score", result["mean_score"])
+            if result["mean_sampled_score"] is not None:
+                self.logger.record("eval/mean_sampled_score", result["mean_sampled_score"])
+            if result["timesteps"] is not None:
+                self.logger.record("eval/checkpoint_timesteps", result["timesteps"])
+            logger.info(f"Evaluated {result['checkpoint']}: mean score {result['mean_score']:.1f}")
+
+
+def evaluation_results_path(config: TrainingConfig) -> Path:
+    return Path(config.checkpoint_dir) / "evaluations.jsonl"
+
+
+def start_evaluator(config: TrainingConfig) -> subprocess.Popen[bytes]:
+    """
+    Start the process that scores checkpoints on the held-out maps as they are saved.
+
+    It lowers its own priority and runs torch and BLAS with a single thread, so rollouts and gradient steps keep the
+    cores they had, and it exits by itself if training dies.
+    """
+    assert config.eval_map_glob is not None
+    command = [sys.executable, "-m", "backend.evaluate", "--watch", config.checkpoint_dir]
+    command += ["--maps", config.eval_map_glob, "--output", str(evaluation_results_path(config))]
+    command += ["--sampled", str(config.eval_sampled), "--workers", str(config.eval_workers)]
+    command += ["--max-cities", str(config.max_cities), "--seed", str(config.seed)]
+    env = {**os.environ, **dict.fromkeys(THREAD_POOL_VARIABLES, "1")}
+    return subprocess.Popen(command, env=env)
+
+
+def shard_config(config: TrainingConfig, map_paths: list[Path]) -> TrainingConfig:
+    """
+    The config each learner process of a data-parallel run trains with.
+
+    Envs and minibatches are split evenly, so the processes together collect and update on as much as one process
+    would with config. Every process gets the same vectorization and number of envs, since they must all take the same
+    number of gradient steps.
+
+    Raises:
+        ValueError: If the config cannot be split evenly, or uses rollout workers
+    """
+    processes = config.learner_processes
+    if config.vectorization in (Vectorization.DISTRIBUTED, Vectorization.ASYNC):
+        raise ValueError(f"{config.vectorization.value} vectorization cannot be combined with learner_processes")
+    batch_size = config.ppo_kwargs()["batch_size"]
+    if batch_size % processes:
+        raise ValueError(f"batch_size {batch_size} does not split evenly over {processes} learner processes")
+    if config.num_envs is not None and config.num_envs % processes:
+        raise ValueError(f"num_envs {config.num_envs} does not split evenly over {processes} learner processes")
+
+    # The last process gets the fewest cores
+    cores = LearnerGroup(processes - 1, processes).cores(usable_cores())
+    vectorization = choose_vectorization(config, map_paths, len(cores))
+    if config.num_envs is not None:
+        num_envs = config.num_envs // processes
+    elif vectorization is Vectorization.IN_PROCESS:
+        num_envs = 4
+    else:
+        num_envs = max(1, len(cores) - 1)
+    return replace(
+        config,
+        vectorization=vectorization,
+        num_envs=num_envs,
+        ppo={**config.ppo, "batch_size": batch_size // processes},
     )
 
-    checkpoint_callback = CheckpointCallback(
-        save_freq=100_000, save_path="./agents/checkpoints/", name_prefix="civ_agent"
+
+def train_shard(group: LearnerGroup, config: TrainingConfig) -> None:
+    """One learner process of a data-parallel run, on its share of the cores with its own envs."""
+    if config.pin_workers and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, group.cores(usable_cores()))
+    shard = replace(
+        config,
+        seed=config.seed + group.rank * 10_000,
+        monitor_dir=os.path.join(config.monitor_dir, f"learner_{group.rank}"),
+        tensorboard_log=config.tensorboard_log if group.is_main else None,
+        ppo={**config.ppo, "verbose": config.ppo_kwargs()["verbose"] if group.is_main else 0},
     )
+    run_training(shard, group)
+
+
+def train(config: TrainingConfig) -> None:
+    if config.learner_processes > 1:
+        spawn_learners(config.learner_processes, train_shard, shard_config(config, load_templates(config.map_glob)))
+    else:
+        run_training(config)
 
-    logger.info("Training... Press Ctrl+C to stop and save.")
-    model.learn(total_timesteps=1000000, callback=checkpoint_callback)
 
-    model.save("./agents/civ_agent_v1.0")
-    logger.info("Model saved!")
+def run_training(config: TrainingConfig, group: LearnerGroup | None = None) -> None:
+    """Train in this process, alone or as one of a group of data-parallel learner processes."""
+    map_paths = load_templates(config.map_glob)
+    th.set_num_threads(learner_thread_count(config))
+    is_main = group is None or group.is_main
+
+    workers: list[subprocess.Popen[bytes]] = []
+    vec_env: VecEnv
+    if config.vectorization in (Vectorization.DISTRIBUTED, Vectorization.ASYNC):
+        vec_env, workers = build_remote_envs(config, map_paths)
+    else:
+        vec_env = build_vec_env(config, map_paths)
+    evaluator = start_evaluator(config) if is_main and config.eval_map_glob is not None else None
+
+    try:
+        model: MaskablePPO
+        if config.vectorization is Vectorization.ASYNC:
+            assert isinstance(vec_env, RemoteEnvs)
+            model = AsyncMaskablePPO(
+                env=vec_env,
+                queue_size=config.queue_size,
+                max_policy_lag=config.max_policy_lag,
+                rho_clip=config.vtrace_rho_clip,
+                c_clip=config.vtrace_c_clip,
+                tensorboard_log=config.tensorboard_log,
+                **config.ppo_kwargs(),
+            )
+            vec_env.server.setup(
+                model.policy_class,
+                model.policy_kwargs,
+                config.map_glob,
+                config.seed,
+                config.observation_mode,
+                config.max_cities,
+            )
+        elif isinstance(vec_env, RemoteEnvs):
+            model = DistributedMaskablePPO(env=vec_env, tensorboard_log=config.tensorboard_log, **config.ppo_kwargs())
+            vec_env.server.setup(
+                model.policy_class,
+                model.policy_kwargs,
+                config.map_glob,
+                config.seed,
+                config.observation_mode,
+                config.max_cities,
+            )
+        elif group is not None:
+            model = DataParallelMaskablePPO(
+                env=vec_env, world_size=group.world_size, tensorboard_log=config.tensorboard_log, **config.ppo_kwargs()
+            )
+        else:
+            model = MaskablePPO(env=vec_env, tensorboard_log=config.tensorboard_log, **config.ppo_kwargs())
+
+        processes = group.world_size if group is not None else 1
+        callbacks: list[BaseCallback] = [ThroughputCallback(processes)] if is_main else []
+        if is_main:
+            callbacks.append(
+                CheckpointCallback(
+                    save_freq=max(1, config.checkpoint_every // (vec_env.num_envs * processes)),
+                    save_path=config.checkpoint_dir,
+                    name_prefix="civ_agent",
+                )
+            )
+        if evaluator is not None:
+            callbacks.append(EvaluationLogCallback(evaluation_results_path(config)))
+
+        logger.info("Training... Press Ctrl+C to stop and save.")
+        model.learn(total_timesteps=config.total_timesteps, callback=callbacks)
+    finally:
+        vec_env.close()
+        for worker in workers:
+            worker.wait()
+        if evaluator is not None:
+            evaluator.terminate()
+            evaluator.wait()
+
+    if is_main:
+        model.save(config.model_path)
+        logger.info("Model saved!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the district placement agent.")
+    parser.add_argument("--config", type=Path, help="JSON training config, see TrainingConfig for the keys")
+    args = parser.parse_args()
+
+    train(TrainingConfig.from_file(args.config) if args.config else TrainingConfig())
@@ -1,16 +1,54 @@
 import json
 import math
-from enum import Enum
-
+import os
+from collections.abc import Mapping
+from enum import Enum, IntEnum
+from glob import glob
+from pathlib import Path
+from typing import Any
+
+from backend.data_transfer.enum_tables import (
+    DISTRICT_FROM_RAW,
+    FEATURE_FROM_RAW,
+    IMPROVEMENT_FROM_RAW,
+    RESOURCE_FROM_RAW,
+    RESOURCE_TYPE_FROM_RAW,
+    TERRAIN_FROM_RAW,
+)
+from backend.data_transfer.tile_record import TileRecord
 from backend.logger import setup_logger
 from backend.models.civmap import CivMap, Tile
+from backend.models.hex_topology import hex_distance, hex_radius
 from backend.yields.district_adjacency_rules import YieldType
 
 logger = setup_logger(__name__)
 
+# Map files are exported by the frontend, so categorical fields hold strings rather than int enum values.
+RAW_ENUM_FIELDS: dict[str, Mapping[str, IntEnum]] = {
+    "terrain": TERRAIN_FROM_RAW,
+    "feature": FEATURE_FROM_RAW,
+    "district": DISTRICT_FROM_RAW,
+    "resource": RESOURCE_FROM_RAW,
+    "resourceType": RESOURCE_TYPE_FROM_RAW,
+    "improvement": IMPROVEMENT_FROM_RAW,
+}
+
+# The map templates agents are trained and evaluated on
+DEFAULT_MAP_GLOB = "maps/civ_test_map*.json"
+
+# Environment variables read by the native thread pools of torch, numpy's BLAS and friends when they start
+THREAD_POOL_VARIABLES = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+def available_cores() -> int:
+    """Number of cores this process may run on, respecting CPU affinity where the platform supports it."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
 
 def get_hex_distance(tile1: Tile, tile2: Tile) -> int:
-    return (abs(tile1.q - tile2.q) + abs(tile1.q + tile1.r - tile2.q - tile2.r) + abs(tile1.r - tile2.r)) // 2
+    return hex_distance((tile1.q, tile1.r), (tile2.q, tile2.r))
 
 
 def load_map_from_json(filename: str) -> CivMap:
@@ -23,13 +61,30 @@ def load_map_from_json(filename: str) -> CivMap:
         key = get_tuple_from_string(key_string)
 
         try:
-            civ_map.tiles[key] = Tile.model_validate(tile_dict)
+            civ_map.tiles[key] = TileRecord.model_validate(decode_raw_enum_fields(tile_dict)).to_tile()
         except Exception as e:
             logger.error(f"Failed to validate tile at {key}: {e}")
 
+    civ_map.radius = hex_radius(civ_map.tiles)
     return civ_map
 
 
+def load_templates(map_glob: str) -> list[Path]:
+    paths = sorted(Path(p) for p in glob(map_glob))
+    if not paths:
+        raise ValueError(f"No map templates match {map_glob}")
+    return paths
+
+
+def decode_raw_enum_fields(tile_dict: dict[str, Any]) -> dict[str, Any]:
+    decoded = dict(tile_dict)
+    for field, table in RAW_ENUM_FIELDS.items():
+        value = decoded.get(field)
+        if isinstance(value, str) and value in table:
+            decoded[field] = table[value]
+    return decoded
+
+
 def get_tuple_from_string(key_string: str) -> tuple[int, int]:
     q_str, r_str = key_string.split(",")
     return int(q_str), int(r_str)
@@ -0,0 +1,189 @@
+from dataclasses import replace
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+
+from backend.yields.district_adjacency_rules import DISTRICT_ADJACENCY_RULES
+from backend.yields.yield_logic import get_tile_score, source_matches
+from backend.yields.yield_models import AdjacencySource
+
+from ..models.civmap import CITY_RADIUS, Tile
+from ..models.hex_topology import Coordinate, HexTopology, hex_topology
+from ..models.int_enums import AdjacencyClass, District, Feature
+
+NUM_DISTRICTS = len(District)
+
+# Every adjacency source of every district, flattened, so rules can be evaluated as matrix products
+SOURCES: list[AdjacencySource] = [source for rules in DISTRICT_ADJACENCY_RULES.values() for source in rules.sources]
+
+# SOURCE_WEIGHTS[d, s] is what one match of source s is worth to district d, zero if s is not one of d's sources
+SOURCE_WEIGHTS = np.zeros((NUM_DISTRICTS, len(SOURCES)))
+_offset = 0
+for _district, _rules in DISTRICT_ADJACENCY_RULES.items():
+    for _i, _source in enumerate(_rules.sources):
+        SOURCE_WEIGHTS[_district.value, _offset + _i] = _source.amount
+    _offset += len(_rules.sources)
+
+# Sources that also count a river running along the district itself, as in run_adjacency_logic
+RIVER_SOURCES = np.array(
+    [s.kind == AdjacencyClass.FEATURE and s.values is not None and Feature.RIVER in s.values for s in SOURCES]
+)
+
+TileProfile = tuple[int, int, int, int, bool]
+_PROFILE_MATCHES: dict[TileProfile, npt.NDArray[np.bool_]] = {}
+
+
+def get_profile_matches(tile: Tile) -> npt.NDArray[np.bool_]:
+    """
+    Whether this tile matches each source when it holds each district, shape (sources, districts).
+
+    Computed with source_matches() itself, so the vectorized scores agree with get_score() by construction. Results
+    only depend on the tile's static attributes, so they are cached per combination of those.
+    """
+    profile = (tile.terrain, tile.feature, tile.resourceType, tile.improvement, tile.mountain is None)
+    matches = _PROFILE_MATCHES.get(profile)
+    if matches is None:
+        matches = np.zeros((len(SOURCES), NUM_DISTRICTS), dtype=bool)
+        for district in District:
+            probe = replace(tile, district=district)
+            for s, source in enumerate(SOURCES):
+                matches[s, district.value] = source_matches(source, probe)
+        _PROFILE_MATCHES[profile] = matches
+    return matches
+
+
+class PlacementScorer:
+    """
+    Array form of get_score() for one map, updated incrementally as districts are placed and removed.
+
+    For every (district, tile) pair, marginal_gains() gives exactly how much get_score()'s total would change if that
+    district were placed there, in one vectorized pass. The city limits are fixed, except for city_center_gains() and
+    claim_city(), which cover founding the city on a map that has none.
+    """
+
+    keys: list[Coordinate]
+    n_tiles: int
+    topology: HexTopology
+    neighbors: npt.NDArray[np.intp]
+    matches: npt.NDArray[np.bool_]
+    tile_yields: npt.NDArray[np.float64]
+    rivers: npt.NDArray[np.bool_]
+    within_city: npt.NDArray[np.bool_]
+    districts: npt.NDArray[np.intp]
+    distances: npt.NDArray[np.int64]
+
+    def __init__(self, grid: dict[Coordinate, Tile]):
+        self.keys = list(grid.keys())
+        self.n_tiles = len(self.keys)
+        self.topology = hex_topology(self.keys)
+        # Neighbor indices in get_neighbors() order, padded with the index of an always-empty sentinel column
+        self.neighbors = self.topology.neighbors
+
+        tiles = list(grid.values())
+        # matches[s, d, k]: tile k matches source s when it holds district d. The last tile is the sentinel.
+        self.matches = np.zeros((len(SOURCES), NUM_DISTRICTS, self.n_tiles + 1), dtype=bool)
+        for k, tile in enumerate(tiles):
+            self.matches[:, :, k] = get_profile_matches(tile)
+
+        self.tile_yields = np.array([sum(get_tile_score(tile).values()) for tile in tiles])
+        self.rivers = np.array([any(tile.rivers) for tile in tiles])
+        self.within_city = np.array([tile.withinCityLimits for tile in tiles])
+        self.districts = np.array([tile.district.value for tile in tiles] + [District.NONE.value], dtype=np.intp)
+        # distances[i, j]: hex distance between tiles i and j
+        self.distances = self.topology.distances
+
+        self._sources = np.arange(len(SOURCES))[:, None]
+        self._tiles = np.arange(self.n_tiles + 1)[None, :]
+        self._refresh()
+
+    def _refresh(self) -> None:
+        # current[s, k]: tile k matches source s as it is now
+        self.current = self.matches[self._sources, self.districts[None, :], self._tiles]
+        self.current[:, self.n_tiles] = False
+        # counts[s, k]: neighbors of tile k matching source s, plus the river bonus for tile k itself
+        self.counts = self.current[:, self.neighbors].sum(axis=2) + RIVER_SOURCES[:, None] * self.rivers[None, :]
+        # neighbor_weights[k, s]: total weight of source s to the districts around tile k
+        weights = np.vstack([SOURCE_WEIGHTS[self.districts[: self.n_tiles]], np.zeros((1, len(SOURCES)))])
+        self.neighbor_weights = weights[self.neighbors].sum(axis=1)
+
+    def set_within_city(self, within_city: npt.NDArray[np.bool_]) -> None:
+        self.within_city = within_city.copy()
+
+    def claim_city(self, tile: int) -> None:
+        """
+        Bring the tiles within CITY_RADIUS of a new city center within city limits, as make_city() does.
+
+        Tiles already within limits, like those of a saved layout, stay so.
+        """
+        self.within_city = self.within_city | self.topology.disk_mask(CITY_RADIUS)[tile]
+
+    def total(self) -> float:
+        """The same total as summing get_score(grid).summary."""
+        districts = self.districts[: self.n_tiles]
+        undeveloped = (districts == District.NONE.value) & self.within_city
+        adjacency = (SOURCE_WEIGHTS[districts] * self.counts.T).sum()
+        return float(self.tile_yields[undeveloped].sum() + adjacency)
+
+    def adjacency_gains(self, district: int) -> npt.NDArray[np.float64]:
+        """Adjacency yield the district would get on each tile."""
+        result: npt.NDArray[np.float64] = SOURCE_WEIGHTS[district] @ self.counts
+        return result
+
+    def neighbor_gains(self, district: int) -> npt.NDArray[np.float64]:
+        """Change in the adjacency yields of the surrounding districts if the district were placed on each tile."""
+        change = self.matches[:, district, : self.n_tiles].astype(np.float64) - self.current[:, : self.n_tiles]
+        result: npt.NDArray[np.float64] = (self.neighbor_weights * change.T).sum(axis=1)
+        return result
+
+    def marginal_gains(self, district: int) -> npt.NDArray[np.float64]:
+        """Change in total score from placing the district on each currently empty tile."""
+        lost = np.where(self.within_city, self.tile_yields, 0.0)
+        return self.adjacency_gains(district) + self.neighbor_gains(district) - lost
+
+    def marginal_gains_many(self, districts: npt.NDArray[np.intp]) -> npt.NDArray[np.float64]:
+        """marginal_gains() for several districts at once, shape (districts, tiles)."""
+        adjacency = SOURCE_WEIGHTS[districts] @ self.counts
+        change: npt.NDArray[np.float64] = self.matches[:, districts, : self.n_tiles] - self.current[
+            :, None, : self.n_tiles
+        ].astype(np.float64)
+        neighbor = np.einsum("ks,sdk->dk", self.neighbor_weights, change)
+        lost = np.where(self.within_city, self.tile_yields, 0.0)
+        result: npt.NDArray[np.float64] = adjacency + neighbor - lost[None, :]
+        return result
+
+    def city_center_gains(self) -> npt.NDArray[np.float64]:
+        """
+        Change in total score from founding the city on each tile, for a map without a city.
+
+        The undeveloped tiles within CITY_RADIUS that were not within city limits yet start counting their yields,
+        the city center tile stops counting its own, and it counts towards the adjacency of the districts around it.
+        """
+        free = self.districts[: self.n_tiles] == District.NONE.value
+        new_yields = np.where(free & ~self.within_city, self.tile_yields, 0.0)
+        lost = np.where(self.within_city, self.tile_yields, 0.0)
+        city_yields: npt.NDArray[np.float64] = self.topology.disk_mask(CITY_RADIUS) @ new_yields - new_yields - lost
+        result: npt.NDArray[np.float64] = (
+            city_yields
+            + self.adjacency_gains(District.CITY_CENTER.value)
+            + self.neighbor_gains(District.CITY_CENTER.value)
+        )
+        return result
+
+    def place(self, district: int, tile: int) -> None:
+        """Place a district on a tile. Placing District.NONE removes whatever is there."""
+        previous = int(self.districts[tile])
+        change = self.matches[:, district, tile].astype(np.int64) - self.current[:, tile]
+        self.districts[tile] = district
+        self.current[:, tile] = self.matches[:, district, tile]
+
+        neighbors = self.neighbors[tile]
+        neighbors = neighbors[neighbors != self.n_tiles]
+        self.counts[:, neighbors] += change[:, None]
+        self.neighbor_weights[neighbors] += SOURCE_WEIGHTS[district] - SOURCE_WEIGHTS[previous]
+
+    def remove(self, tile: int) -> None:
+        self.place(District.NONE.value, tile)
+
+    def state(self) -> dict[str, Any]:
+        return {"districts": self.districts[: self.n_tiles].copy(), "within_city": self.within_city.copy()}
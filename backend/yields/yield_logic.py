@@ -1,6 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
-from backend.logger import setup_logger
+from backend import tracing
+from backend.tracing import TraceKind
 from backend.yields.district_adjacency_rules import (
     DISTRICT_ADJACENCY_RULES,
     DistrictAdjacencyRules,
@@ -19,8 +20,6 @@ from ..models.int_enums import (
     Terrain,
 )
 
-logger = setup_logger(__name__)
-
 YieldDict = dict[YieldType, float]
 
 
@@ -28,6 +27,9 @@ class ScoreResult(BaseModel):
     summary: dict[YieldType, float]
     tiles: dict[str, dict[YieldType, float]]
 
+    # Always built with model_construct(), so the validator is only built if something does validate one
+    model_config = ConfigDict(defer_build=True)
+
 
 def get_score(grid: dict[tuple[int, int], Tile]) -> ScoreResult:
     total_yields: YieldDict = {y: 0.0 for y in YieldType}
@@ -38,7 +40,6 @@ def get_score(grid: dict[tuple[int, int], Tile]) -> ScoreResult:
         key = f"{q},{r}"
 
         if tile.district == District.NONE:
-            logger.debug(f"{q}, {r} has no district")
             tile_results[key] = get_tile_score(tile)
             if tile.withinCityLimits:
                 tile_yields = tile_results[key]
@@ -48,17 +49,29 @@ def get_score(grid: dict[tuple[int, int], Tile]) -> ScoreResult:
 
         rules = DISTRICT_ADJACENCY_RULES.get(tile.district)
         if rules is None:
-            logger.debug(f"{tile.q}, {tile.r} has no rules")
             tile_results[key] = {}
             continue
 
         score = run_adjacency_logic(tile, grid, rules)
-        logger.debug(f"{tile.district.name} : {score}")
+        if tracing.ENABLED:
+            tracing.record(TraceKind.DISTRICT_YIELD, tile, tile.district, rules.yield_type, score)
 
         total_yields[rules.yield_type] += score
         tile_results[key] = {rules.yield_type: score}
 
-    return ScoreResult(summary=total_yields, tiles=tile_results)
+    # Both dicts are built here with the declared types, so skip re-validating every tile's yields.
+    return ScoreResult.model_construct(summary=total_yields, tiles=tile_results)
+
+
+def get_tile_contribution(tile: Tile, grid: dict[tuple[int, int], Tile]) -> float:
+    """What the tile adds to the total of get_score(grid), over all yield types."""
+    if tile.district == District.NONE:
+        return float(sum(get_tile_score(tile).values())) if tile.withinCityLimits else 0.0
+
+    rules = DISTRICT_ADJACENCY_RULES.get(tile.district)
+    if rules is None:
+        return 0.0
+    return run_adjacency_logic(tile, grid, rules)
 
 
 def run_adjacency_logic(center_tile: Tile, grid: dict[tuple[int, int], Tile], rules: DistrictAdjacencyRules) -> float:
@@ -71,7 +84,6 @@ def run_adjacency_logic(center_tile: Tile, grid: dict[tuple[int, int], Tile], ru
 
         for neighbor in neighbors:
             if neighbor and source_matches(source, neighbor):
-                logger.debug(f"{center_tile.district.name} : {source.values}")
                 count += 1
 
         source_score = count * source.amount
@@ -84,6 +96,8 @@ def run_adjacency_logic(center_tile: Tile, grid: dict[tuple[int, int], Tile], ru
         ):
             source_score += source.amount
 
+        if tracing.ENABLED and source_score:
+            tracing.record(TraceKind.ADJACENCY, center_tile, center_tile.district, source, source_score)
         total_score += source_score
 
     return total_score
@@ -3,7 +3,7 @@ from typing import Any
 
 import numpy as np
 import numpy.typing as npt
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 
 @dataclass(frozen=True)
@@ -23,6 +23,8 @@ class TileYieldsModel(BaseModel):
     production: float = Field(ge=0)
     food: float = Field(ge=0)
 
+    model_config = ConfigDict(defer_build=True)
+
     def to_internal(self) -> "TileYields":
         return TileYields(**self.model_dump())
 
@@ -0,0 +1,13 @@
+from pathlib import Path
+
+import pytest
+
+from backend.models.civmap import CivMap
+from backend.utils import load_map_from_json
+
+MAPS_DIR = Path(__file__).resolve().parent.parent / "maps"
+
+
+@pytest.fixture(scope="session")
+def templates() -> list[CivMap]:
+    return [load_map_from_json(str(path)) for path in sorted(MAPS_DIR.glob("civ_test_map*.json"))]
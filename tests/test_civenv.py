@@ -0,0 +1,97 @@
+import random
+from typing import Any, Iterator
+
+import numpy as np
+import numpy.typing as npt
+import pytest
+
+from backend.civenv import CivEnv, sum_score
+from backend.models.civmap import CivMap
+from backend.models.int_enums import District
+from backend.placement.district_validation import can_place_district
+from backend.yields.yield_logic import get_score
+
+SEEDS = range(8)
+
+
+def reference_mask(env: CivEnv) -> npt.NDArray[np.bool_]:
+    """The action mask computed from scratch with can_place_district(), bypassing every cache."""
+    civ_map = env.current_civ_map
+    grid = np.zeros((len(env.placeable_districts), env.n_tiles), dtype=bool)
+    for i, key in enumerate(env.tile_keys):
+        tile = civ_map.tiles[key]
+        if tile.district != District.NONE:
+            continue
+        if tile.city is None:
+            if len(civ_map.cities) < env.max_cities:
+                grid[env._city_center_row, i] = can_place_district(District.CITY_CENTER, civ_map.tiles, key)
+            continue
+        for row, district in enumerate(env.placeable_districts):
+            if district is not District.CITY_CENTER and not tile.city.districts_built[district.value]:
+                grid[row, i] = can_place_district(district, civ_map.tiles, key)
+    return grid.reshape(-1)
+
+
+def random_episode(templates: list[CivMap], max_cities: int, seed: int) -> Iterator[CivEnv]:
+    """Play an episode of random legal actions, yielding the env before every step and once it has ended."""
+    # CivEnv.init_map() picks the template with the global random module
+    random.seed(seed)
+    rng = random.Random(seed)
+    env = CivEnv(templates, max_cities=max_cities)
+    env.reset(seed=seed)
+    while True:
+        yield env
+        legal = np.flatnonzero(env.action_mask())
+        if not len(legal):
+            return
+        _, _, terminated, _, _ = env.step(int(rng.choice(legal)))
+        if terminated:
+            yield env
+            return
+
+
+def snapshot(env: CivEnv) -> tuple[Any, ...]:
+    tiles = env.current_civ_map.tiles.values()
+    return (
+        [(tile.district, tile.withinCityLimits, None if tile.city is None else tile.city.id) for tile in tiles],
+        [list(city.districts_built) for city in env.current_civ_map.cities],
+        env._current_sig,
+        env._city_centers,
+        env._score,
+        env.last_yield,
+        env._get_obs().tobytes(),
+    )
+
+
+@pytest.mark.parametrize("max_cities", [1, 3])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_incremental_mask_matches_full_recompute(templates: list[CivMap], max_cities: int, seed: int) -> None:
+    for env in random_episode(templates, max_cities, seed):
+        incremental = env.action_mask().copy()
+        # Without cached masks to start from, the mask is checked again on every tile
+        env._action_mask_cache.clear()
+        full = env.action_mask()
+        np.testing.assert_array_equal(incremental, full)
+        np.testing.assert_array_equal(full, reference_mask(env))
+
+
+@pytest.mark.parametrize("max_cities", [1, 3])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_incremental_score_matches_get_score(templates: list[CivMap], max_cities: int, seed: int) -> None:
+    for env in random_episode(templates, max_cities, seed):
+        if env._score is not None:
+            assert env._score == pytest.approx(sum_score(get_score(env.current_civ_map.tiles).summary))
+
+
+@pytest.mark.parametrize("max_cities", [1, 3])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_pop_placement_restores_state_exactly(templates: list[CivMap], max_cities: int, seed: int) -> None:
+    rng = random.Random(seed)
+    for env in random_episode(templates, max_cities, seed):
+        legal = np.flatnonzero(env.action_mask())
+        if not len(legal):
+            break
+        before = snapshot(env)
+        env.push_placement(int(rng.choice(legal)))
+        env.pop_placement()
+        assert snapshot(env) == before
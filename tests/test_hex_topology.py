@@ -0,0 +1,25 @@
+from backend.models.hex_topology import (
+    DISK_CACHE_SIZE,
+    NEIGHBOR_CACHE_SIZE,
+    disk_coordinates,
+    map_topology,
+    neighbor_coordinates,
+)
+
+
+def test_coordinates_agree_with_the_topology_tables() -> None:
+    topology = map_topology(4)
+    for i, key in enumerate(topology.keys):
+        on_map = [topology.index.get(neighbor, topology.n_tiles) for neighbor in neighbor_coordinates(key)]
+        assert on_map == topology.neighbors[i].tolist()
+        disk = sorted(topology.index[k] for k in disk_coordinates(key, 2) if k in topology.index)
+        assert disk == topology.disk(i, 2).tolist()
+
+
+def test_coordinate_caches_stay_bounded() -> None:
+    far = [(q, 10_000 + r) for q in range(100) for r in range(100)]
+    for key in far:
+        neighbor_coordinates(key)
+        disk_coordinates(key, 1)
+    assert neighbor_coordinates.cache_info().currsize <= NEIGHBOR_CACHE_SIZE
+    assert disk_coordinates.cache_info().currsize <= DISK_CACHE_SIZE
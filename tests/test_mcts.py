@@ -0,0 +1,38 @@
+import time
+from pathlib import Path
+
+import pytest
+from sb3_contrib import MaskablePPO
+
+from backend.civenv import CivEnv
+from backend.planning.mcts import MCTSPlanner
+from backend.utils import load_map_from_json
+
+MAPS_DIR = Path(__file__).resolve().parent.parent / "maps"
+
+# Beyond the budget, plan() may spend one forward pass on the root and one policy line, which it always completes
+TOLERANCE_SECONDS = 0.25
+
+
+@pytest.fixture(scope="module")
+def model() -> MaskablePPO:
+    # An untrained policy costs the same per forward pass as a trained one
+    env = CivEnv([load_map_from_json(str(MAPS_DIR / "civ_test_map0.json"))])
+    return MaskablePPO("MlpPolicy", env, seed=0, device="cpu")
+
+
+@pytest.mark.parametrize("budget_seconds", [0.1, 0.5])
+@pytest.mark.parametrize("map_name", ["civ_test_map0", "final_city_layout2"])
+def test_plan_returns_within_budget_and_leaves_env_unchanged(
+    model: MaskablePPO, map_name: str, budget_seconds: float
+) -> None:
+    env = CivEnv([load_map_from_json(str(MAPS_DIR / f"{map_name}.json"))])
+    env.reset(seed=0)
+    before = (env.state_key(), len(env._undo_stack), env._score, env._get_obs().tobytes())
+
+    start = time.perf_counter()
+    result = MCTSPlanner(model, env).plan(budget_seconds)
+    assert time.perf_counter() - start < budget_seconds + TOLERANCE_SECONDS
+
+    assert result.actions
+    assert (env.state_key(), len(env._undo_stack), env._score, env._get_obs().tobytes()) == before
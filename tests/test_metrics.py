@@ -0,0 +1,78 @@
+from typing import Iterator
+
+import pytest
+
+from backend.serving.metrics import Counter, Gauge, Histogram, Metric, MetricsRegistry, RequestProfile, Stage
+
+
+def test_metric_without_samples_cannot_be_created() -> None:
+    class Incomplete(Metric):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete("civ_incomplete", "Never rendered.")  # type: ignore[abstract]
+
+
+def test_metric_with_samples_renders() -> None:
+    class Constant(Metric):
+        def samples(self) -> Iterator[str]:
+            yield f"{self.name} 1"
+
+    assert Constant("civ_constant", "Always one.").render().endswith("civ_constant 1\n")
+
+
+def test_counter_and_gauge_render_per_label_values() -> None:
+    counter = Counter("civ_things_total", "Things.", ("kind",))
+    counter.inc(kind="a")
+    counter.inc(2, kind="a")
+    counter.inc(kind="b")
+    gauge = Gauge("civ_level", "Level.")
+    gauge.set(0.5)
+
+    assert 'civ_things_total{kind="a"} 3' in counter.render()
+    assert 'civ_things_total{kind="b"} 1' in counter.render()
+    assert "# TYPE civ_things_total counter" in counter.render()
+    assert "civ_level 0.5" in gauge.render()
+
+
+def test_collected_values_are_read_when_rendered() -> None:
+    depth = {"value": 1.0}
+    gauge = Gauge("civ_depth", "Depth.", collect=lambda: {(): depth["value"]})
+    depth["value"] = 4.0
+    assert "civ_depth 4" in gauge.render()
+
+
+def test_wrong_labels_are_rejected() -> None:
+    counter = Counter("civ_things_total", "Things.", ("kind",))
+    with pytest.raises(ValueError):
+        counter.inc(color="red")
+
+
+def test_histogram_buckets_are_cumulative() -> None:
+    histogram = Histogram("civ_seconds", "Seconds.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+    lines = histogram.render().splitlines()
+
+    assert 'civ_seconds_bucket{le="0.1"} 1' in lines
+    assert 'civ_seconds_bucket{le="1"} 3' in lines
+    assert 'civ_seconds_bucket{le="+Inf"} 4' in lines
+    assert "civ_seconds_sum 6.05" in lines
+    assert "civ_seconds_count 4" in lines
+
+
+def test_registry_rejects_duplicate_names() -> None:
+    registry = MetricsRegistry()
+    registry.register(Gauge("civ_level", "Level."))
+    with pytest.raises(ValueError):
+        registry.register(Counter("civ_level", "Level again."))
+
+
+def test_request_profile_reset_keeps_model_load_time() -> None:
+    profile = RequestProfile(model_load_seconds=2.0)
+    with profile.stage(Stage.SCORING):
+        pass
+    profile.steps = 3
+    profile.reset()
+    assert profile.stages == {} and profile.steps == 0
+    assert profile.model_load_seconds == 2.0
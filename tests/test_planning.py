@@ -0,0 +1,93 @@
+from pathlib import Path
+
+import pytest
+
+from backend.civenv import CivEnv, sum_score
+from backend.planning.exact import BranchAndBoundSolver
+from backend.planning.greedy import GreedyPlanner
+from backend.utils import load_map_from_json
+from backend.yields.yield_logic import get_score
+
+MAPS_DIR = Path(__file__).resolve().parent.parent / "maps"
+MAP_PATHS = sorted(MAPS_DIR.glob("*.json"))
+
+# A map the exact solver proves optimal on in about a second
+MAP = MAPS_DIR / "civ_test_map10.json"
+
+# Enough for a good layout on every map in a fraction of a second, without proving most of them optimal
+NODE_LIMIT = 500
+
+
+def new_env(path: Path) -> CivEnv:
+    env = CivEnv([load_map_from_json(str(path))])
+    env.reset()
+    return env
+
+
+def score_of(env: CivEnv, actions: list[int]) -> float:
+    """The score get_score() gives the layout the actions place, leaving the env as it was."""
+    for action in actions:
+        env.push_placement(action)
+    score = sum_score(get_score(env.current_civ_map.tiles).summary)
+    for _ in actions:
+        env.pop_placement()
+    return score
+
+
+def assert_legal(env: CivEnv, actions: list[int]) -> None:
+    """Check that every action is allowed by the env's action mask when it is played, leaving the env as it was."""
+    played = 0
+    try:
+        for action in actions:
+            assert env.action_mask()[action], f"{env.decode_action(action)} is illegal after {played} actions"
+            env.push_placement(action)
+            played += 1
+    finally:
+        for _ in range(played):
+            env.pop_placement()
+
+
+@pytest.mark.parametrize("lookahead", [1, 2])
+@pytest.mark.parametrize("path", MAP_PATHS, ids=lambda path: path.stem)
+def test_greedy_actions_are_legal(path: Path, lookahead: int) -> None:
+    env = new_env(path)
+    assert_legal(env, GreedyPlanner(env, lookahead).plan().actions)
+
+
+@pytest.mark.parametrize("lookahead", [1, 2, 3])
+@pytest.mark.parametrize("path", MAP_PATHS, ids=lambda path: path.stem)
+def test_greedy_score_matches_replayed_score(path: Path, lookahead: int) -> None:
+    env = new_env(path)
+    result = GreedyPlanner(env, lookahead).plan()
+    assert result.score == score_of(env, result.actions)
+
+
+@pytest.mark.parametrize("lookahead", [2, 3])
+@pytest.mark.parametrize("path", MAP_PATHS, ids=lambda path: path.stem)
+def test_lookahead_never_scores_below_plain_greedy(path: Path, lookahead: int) -> None:
+    env = new_env(path)
+    assert GreedyPlanner(env, lookahead).plan().score >= GreedyPlanner(env).plan().score
+
+
+@pytest.mark.parametrize("path", MAP_PATHS, ids=lambda path: path.stem)
+def test_exact_actions_are_legal(path: Path) -> None:
+    env = new_env(path)
+    assert_legal(env, BranchAndBoundSolver(env, NODE_LIMIT).solve().actions)
+
+
+@pytest.mark.parametrize("path", MAP_PATHS, ids=lambda path: path.stem)
+def test_exact_score_matches_replayed_score(path: Path) -> None:
+    env = new_env(path)
+    result = BranchAndBoundSolver(env, NODE_LIMIT).solve()
+    assert result.score == score_of(env, result.actions)
+
+
+def test_exact_solution_is_at_least_as_good_as_greedy() -> None:
+    env = new_env(MAP)
+    greedy = GreedyPlanner(env).plan()
+    exact = BranchAndBoundSolver(env).solve()
+
+    assert exact.proved_optimal
+    assert greedy.score == score_of(env, greedy.actions)
+    assert exact.score == score_of(env, exact.actions)
+    assert exact.score >= greedy.score
@@ -0,0 +1,55 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.data_transfer.dto_converters import convert_grid_to_dto
+from backend.main import ServiceMode, create_app
+from backend.models.civmap import CivMap
+from backend.serving.response_cache import ResponseCache
+
+
+def test_get_misses_until_put() -> None:
+    cache = ResponseCache(2)
+    key = cache.key(b"{}")
+    assert cache.get(key) is None
+    cache.put(key, b"response")
+    assert cache.get(key) == b"response"
+
+
+def test_keys_depend_only_on_the_body() -> None:
+    assert ResponseCache.key(b"{}") == ResponseCache.key(b"{}")
+    assert ResponseCache.key(b"{}") != ResponseCache.key(b"{ }")
+
+
+def test_least_recently_used_entry_is_dropped_when_full() -> None:
+    cache = ResponseCache(2)
+    cache.put(b"a", b"1")
+    cache.put(b"b", b"2")
+    # Reading a makes b the least recently used
+    assert cache.get(b"a") == b"1"
+    cache.put(b"c", b"3")
+    assert cache.get(b"b") is None
+    assert cache.get(b"a") == b"1"
+    assert cache.get(b"c") == b"3"
+
+
+def test_zero_capacity_stores_nothing() -> None:
+    cache = ResponseCache(0)
+    cache.put(b"a", b"1")
+    assert cache.get(b"a") is None
+
+
+def test_district_legality_is_answered_from_the_cache(templates: list[CivMap], monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("CIV_WORKERS", "1")
+    body = {
+        key: tile.model_dump(mode="json", by_alias=True)
+        for key, tile in convert_grid_to_dto(templates[0].tiles).items()
+    }
+    with TestClient(create_app(ServiceMode.SCORING)) as client:
+        first = client.post("/district-legality", json=body)
+        second = client.post("/district-legality", json=body)
+        metrics = client.get("/metrics").text
+
+    assert first.status_code == second.status_code == 200
+    assert first.content == second.content
+    assert 'civ_response_cache_lookups_total{route="/district-legality",outcome="miss"} 1' in metrics
+    assert 'civ_response_cache_lookups_total{route="/district-legality",outcome="hit"} 1' in metrics
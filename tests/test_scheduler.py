@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+from backend.serving.scheduler import Lane, LaneConfig, LaneFullError, LaneScheduler
+from backend.serving.worker_pool import PoolConfig
+
+
+def single_slot_scheduler(max_queue: int = 2) -> LaneScheduler:
+    lanes = {lane: LaneConfig(max_concurrency=1, max_queue=max_queue, timeout=1.0) for lane in Lane}
+    return LaneScheduler(1, lanes)
+
+
+def test_acquire_beyond_the_queue_limit_is_rejected() -> None:
+    async def scenario() -> None:
+        scheduler = single_slot_scheduler(max_queue=1)
+        await scheduler.acquire(Lane.SCORING)
+        queued = asyncio.create_task(scheduler.acquire(Lane.SCORING))
+        await asyncio.sleep(0)
+        assert scheduler.is_full(Lane.SCORING)
+        with pytest.raises(LaneFullError):
+            await scheduler.acquire(Lane.SCORING)
+        assert scheduler.stats[Lane.SCORING].rejected == 1
+
+        scheduler.release(Lane.SCORING)
+        await queued
+        assert not scheduler.is_full(Lane.SCORING)
+        assert scheduler.stats[Lane.SCORING].served == 2
+
+    asyncio.run(scenario())
+
+
+def test_freed_slot_goes_to_the_scoring_lane_first() -> None:
+    async def scenario() -> None:
+        scheduler = single_slot_scheduler()
+        await scheduler.acquire(Lane.INFERENCE)
+        order: list[Lane] = []
+
+        async def acquire(lane: Lane) -> None:
+            await scheduler.acquire(lane)
+            order.append(lane)
+            scheduler.release(lane)
+
+        # The inference request is queued first, but scoring has priority
+        waiting = [asyncio.create_task(acquire(Lane.INFERENCE)), asyncio.create_task(acquire(Lane.SCORING))]
+        await asyncio.sleep(0)
+        scheduler.release(Lane.INFERENCE)
+        await asyncio.gather(*waiting)
+        assert order == [Lane.SCORING, Lane.INFERENCE]
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue() -> None:
+    async def scenario() -> None:
+        scheduler = single_slot_scheduler()
+        await scheduler.acquire(Lane.SCORING)
+        queued = asyncio.create_task(scheduler.acquire(Lane.SCORING))
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth(Lane.SCORING) == 1
+
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert scheduler.queue_depth(Lane.SCORING) == 0
+        scheduler.release(Lane.SCORING)
+        assert scheduler.stats[Lane.SCORING].in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_single_worker_keeps_inference_off_the_only_slot(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("CIV_WORKERS", "1")
+    monkeypatch.setenv("CIV_INFERENCE_CONCURRENCY", "1")
+    config = PoolConfig.from_env()
+    assert config.lanes[Lane.INFERENCE].max_concurrency == 0
+
+    async def scenario() -> None:
+        scheduler = LaneScheduler(config.workers, config.lanes)
+        assert scheduler.is_full(Lane.INFERENCE)
+        with pytest.raises(LaneFullError):
+            await scheduler.acquire(Lane.INFERENCE)
+        await asyncio.wait_for(scheduler.acquire(Lane.SCORING), timeout=1.0)
+
+    asyncio.run(scenario())
+
+
+def test_inference_never_takes_the_last_free_worker(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("CIV_WORKERS", "2")
+    monkeypatch.setenv("CIV_INFERENCE_CONCURRENCY", "2")
+    config = PoolConfig.from_env()
+    assert config.lanes[Lane.INFERENCE].max_concurrency == 1
+
+    async def scenario() -> None:
+        scheduler = LaneScheduler(config.workers, config.lanes)
+        await scheduler.acquire(Lane.INFERENCE)
+        queued = asyncio.create_task(scheduler.acquire(Lane.INFERENCE))
+        await asyncio.sleep(0)
+        # The second inference request waits, while scoring gets the other worker at once
+        await asyncio.wait_for(scheduler.acquire(Lane.SCORING), timeout=1.0)
+        assert not queued.done()
+        queued.cancel()
+
+    asyncio.run(scenario())
@@ -0,0 +1,18 @@
+from backend.civenv import CivEnv
+from backend.models.civmap import CivMap
+from backend.perf.step_profiler import PHASE_METHODS, StepProfiler, run_episodes
+
+
+def test_phase_methods_exist() -> None:
+    for methods in PHASE_METHODS.values():
+        for method in methods:
+            assert callable(getattr(CivEnv, method, None)), method
+
+
+def test_phases_cover_most_of_the_step_time(templates: list[CivMap]) -> None:
+    profiled = StepProfiler(CivEnv(templates))
+    run_episodes(profiled, episodes=20, seed=0)
+    report = profiled.report
+    other = report.total_seconds - sum(report.phases.values())
+    assert report.phases["scoring"] > 0
+    assert other < 0.1 * report.total_seconds
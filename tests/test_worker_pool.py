@@ -0,0 +1,74 @@
+import asyncio
+import os
+import time
+from typing import Iterator
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from backend.main import record_latency
+from backend.serving.dispatch import run_in_pool
+from backend.serving.metrics import ServerMetrics
+from backend.serving.scheduler import Lane, LaneConfig
+from backend.serving.worker_pool import PoolConfig, WorkerCrashedError, WorkerPool
+
+
+@pytest.fixture
+def pool() -> Iterator[WorkerPool]:
+    pool = WorkerPool(PoolConfig(workers=1, lanes={Lane.SCORING: LaneConfig(1, 4, timeout=10.0)}))
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+
+def test_request_past_its_timeout_raises_and_is_counted() -> None:
+    pool = WorkerPool(PoolConfig(workers=1, lanes={Lane.SCORING: LaneConfig(1, 4, timeout=0.1)}))
+
+    async def scenario() -> None:
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.run(Lane.SCORING, time.sleep, 0.5)
+        assert pool.scheduler.stats[Lane.SCORING].timed_out == 1
+        # The slot is only released once the worker finishes the request
+        assert pool.scheduler.stats[Lane.SCORING].in_flight == 1
+        while pool.scheduler.stats[Lane.SCORING].in_flight:
+            await asyncio.sleep(0.05)
+
+    pool.start()
+    try:
+        asyncio.run(scenario())
+    finally:
+        pool.shutdown()
+
+
+def test_pool_is_restarted_after_a_worker_dies(pool: WorkerPool) -> None:
+    async def scenario() -> tuple[int, int]:
+        before = await pool.run(Lane.SCORING, os.getpid)
+        with pytest.raises(WorkerCrashedError):
+            await pool.run(Lane.SCORING, os._exit, 1)
+        after = await pool.run(Lane.SCORING, os.getpid)
+        return before, after
+
+    before, after = asyncio.run(scenario())
+    assert before != after
+    assert pool.scheduler.stats[Lane.SCORING].in_flight == 0
+
+
+def test_crashed_request_is_answered_with_503(pool: WorkerPool) -> None:
+    app = FastAPI()
+    app.state.pool = pool
+    app.state.metrics = ServerMetrics(pool.scheduler)
+    app.middleware("http")(record_latency)
+
+    @app.post("/run")
+    async def run(request: Request, crash: bool) -> int:
+        if crash:
+            await run_in_pool(request, Lane.SCORING, os._exit, 1)
+        pid, _ = await run_in_pool(request, Lane.SCORING, os.getpid)
+        return pid
+
+    client = TestClient(app)
+    response = client.post("/run", params={"crash": True})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert client.post("/run", params={"crash": False}).status_code == 200